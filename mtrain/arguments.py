@@ -147,6 +147,14 @@ def add_preprocessing_arguments(parser):
              "(basepath). Alternatively, the basepath to a separate tuning " +
              "corpus can be provided. Examples: `2000`, `/foo/bar/tuning_corpus`"
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed for the random selection of segments for tuning and " +
+             "evaluation from the training corpus (basepath). Trainings with " +
+             "the same seed use the same segments, default=`%s`" % C.CORPUS_SPLIT_SEED,
+        default=C.CORPUS_SPLIT_SEED
+    )
     parser.add_argument(
         "--preprocess_external_tune",
         help="preprocess external tuning corpus. Don't use if " +
@@ -363,10 +371,81 @@ def add_nematus_trans_arguments(parser):
     )
     nematus_args.add_argument(
         "--keep_temp_files",
-        help="Keep temporary directories and files created. Paths are logged in 'translation.log'.",
+        help="Deprecated, has no effect: translation no longer creates temporary files.",
+        default=False,
+        action="store_true"
+    )
+    nematus_args.add_argument(
+        "--chunk_size",
+        type=int,
+        help="read STDIN in chunks of this many lines, and write the " +
+             "translations of each chunk to STDOUT as soon as it is " +
+             "translated. By default, segments are streamed through all " +
+             "components and written as they are translated, without " +
+             "flushing STDOUT",
+        default=None
+    )
+
+def add_cache_arguments(parser):
+    """
+    Options for caching translations, Moses backend only.
+    """
+    cache_args = parser.add_argument_group("Cache arguments")
+
+    cache_args.add_argument(
+        "--cache_size",
+        type=int,
+        help="maximum number of translations cached in memory, " +
+        "default=0 (no caching, unless --cache_path is given)",
+        default=0
+    )
+    cache_args.add_argument(
+        "--cache_path",
+        type=str,
+        help="path to an SQLite database file where translations are " +
+        "cached persistently, across runs of `mtrans`",
+        default=None
+    )
+
+def add_server_arguments(parser):
+    """
+    Options for running `mtrans` as a translation server.
+    """
+    server_args = parser.add_argument_group("Server arguments")
+
+    server_args.add_argument(
+        "--server",
+        help="load the engine once and serve translations over local HTTP " +
+        "instead of translating STDIN",
         default=False,
         action="store_true"
     )
+    server_args.add_argument(
+        "--host",
+        type=str,
+        help="host name or IP address the server is bound to, default=`%s`" % C.SERVER_HOST,
+        default=C.SERVER_HOST
+    )
+    server_args.add_argument(
+        "--port",
+        type=int,
+        help="port the server listens on, default=`%d`" % C.SERVER_PORT,
+        default=C.SERVER_PORT
+    )
+    server_args.add_argument(
+        "--max_queue_size",
+        type=int,
+        help="maximum number of pending requests, further requests are " +
+        "rejected with status 503, default=`%d`" % C.SERVER_MAX_QUEUE_SIZE,
+        default=C.SERVER_MAX_QUEUE_SIZE
+    )
+    server_args.add_argument(
+        "--max_batch_size",
+        type=int,
+        help="maximum number of segments translated at once, " +
+        "default=`%d`" % C.SERVER_MAX_BATCH_SIZE,
+        default=C.SERVER_MAX_BATCH_SIZE
+    )
 
 def get_translation_parser():
     """
@@ -388,8 +467,19 @@ def get_translation_parser():
         default="INFO"
     )
 
+    parser.add_argument(
+        "--num_processes",
+        type=int,
+        help="number of identical processes started for each external " +
+        "component (e.g. tokenizer, decoder), allows concurrent requests " +
+        "to be handled in parallel, default=1",
+        default=1
+    )
+
     add_pre_postprocessing_arguments(parser)
     add_nematus_trans_arguments(parser)
+    add_cache_arguments(parser)
+    add_server_arguments(parser)
 
     return parser
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Caches final translations of source segments, in memory and optionally on disk.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+
+from mtrain import constants as C
+
+
+def engine_identity(basepath):
+    """
+    Computes a string that identifies a trained engine. It changes whenever the
+    engine is retrained, so that cached translations are invalidated.
+
+    @param basepath the path to the engine, i.e., `mtrain`'s output directory
+    """
+    identity = hashlib.sha1()
+    with open(basepath + os.sep + C.CONFIG, 'rb') as config:
+        identity.update(config.read())
+    path_moses_ini = os.sep.join([basepath, C.PATH_COMPONENT['engine'], 'moses.ini'])
+    if os.path.exists(path_moses_ini):
+        identity.update(repr(os.path.getmtime(path_moses_ini)).encode('utf-8'))
+    return identity.hexdigest()
+
+
+class TranslationCache(object):
+    """
+    Thread-safe, size-bounded cache of translations. Recently used entries are
+    kept in memory (LRU), and all entries are optionally stored in an SQLite
+    database that persists across runs.
+    """
+
+    def __init__(self, engine_id, max_size=C.CACHE_MAX_SIZE, path=None, max_persistent_size=C.CACHE_MAX_PERSISTENT_SIZE):
+        """
+        @param engine_id a string identifying the engine, see `engine_identity`
+        @param max_size maximum number of entries kept in memory
+        @param path path to an SQLite database file for persistent storage,
+            None to only cache in memory
+        @param max_persistent_size maximum number of entries in the database,
+            oldest entries are removed first
+        """
+        self._engine_id = engine_id
+        self._max_size = max_size
+        self._max_persistent_size = max_persistent_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            # a write-ahead log does not need to be synced to disk for every
+            # transaction
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT)'
+            )
+            self._connection.commit()
+            self._persistent_size = self._connection.execute(
+                'SELECT COUNT(*) FROM translations'
+            ).fetchone()[0]
+
+    @property
+    def persistent(self):
+        """
+        Whether entries are stored in a database, i.e., whether looking them up
+        and storing them may need disk access.
+        """
+        return self._connection is not None
+
+    def close(self):
+        """
+        Closes the database connection, if any.
+        """
+        logging.debug("Translation cache: %d hits, %d misses", self.hits, self.misses)
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _key(self, segment, options):
+        """
+        Computes the key for a source @param segment translated with
+        @param options, a dictionary of translation options.
+        """
+        material = json.dumps([self._engine_id, sorted(options.items()), segment], ensure_ascii=False)
+        return hashlib.sha1(material.encode('utf-8')).hexdigest()
+
+    def get(self, segment, **options):
+        """
+        Returns the cached translation of @param segment, or None.
+        """
+        key = self._key(segment, options)
+        with self._lock:
+            translation = self._entries.get(key)
+            if translation is not None:
+                self._entries.move_to_end(key)
+            elif self._connection is not None:
+                row = self._connection.execute(
+                    'SELECT translation FROM translations WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    translation = row[0]
+                    self._remember(key, translation)
+            if translation is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return translation
+
+    def put(self, segment, translation, **options):
+        """
+        Caches the @param translation of @param segment.
+        """
+        self.put_many([(segment, translation)], **options)
+
+    def put_many(self, translations, **options):
+        """
+        Caches several @param translations, a list of (segment, translation)
+        tuples, storing them in the database in a single transaction.
+        """
+        rows = [(self._key(segment, options), translation) for segment, translation in translations]
+        with self._lock:
+            for key, translation in rows:
+                self._remember(key, translation)
+            if self._connection is not None and rows:
+                before = self._connection.total_changes
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO translations (key, translation) VALUES (?, ?)', rows
+                )
+                self._persistent_size += self._connection.total_changes - before
+                if self._persistent_size > self._max_persistent_size:
+                    excess = self._persistent_size - self._max_persistent_size
+                    self._connection.execute(
+                        'DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY rowid LIMIT ?)', (excess,)
+                    )
+                    self._persistent_size -= excess
+                self._connection.commit()
+
+    def _remember(self, key, translation):
+        """
+        Adds an entry to the in-memory cache, evicting the least recently
+        used entry if necessary.
+        """
+        self._entries[key] = translation
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
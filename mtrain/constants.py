@@ -30,6 +30,7 @@ MOSES = MOSES_HOME + os.sep + 'bin/moses'
 MOSES_TRAIN_MODEL = MOSES_HOME + os.sep + 'scripts/training/train-model.perl'
 MOSES_TOKENIZER = MOSES_HOME + os.sep + 'scripts/tokenizer/tokenizer.perl'
 MOSES_DETOKENIZER = MOSES_HOME + os.sep + 'scripts/tokenizer/detokenizer.perl'
+MOSES_NONBREAKING_PREFIXES = MOSES_HOME + os.sep + 'scripts/share/nonbreaking_prefixes'
 MOSES_TRUECASER = MOSES_HOME + os.sep + 'scripts/recaser/truecase.perl'
 MOSES_TRAIN_TRUECASER = MOSES_HOME + os.sep + 'scripts/recaser/train-truecaser.perl'
 MOSES_RECASER = ''
@@ -61,6 +62,9 @@ NEMATUS_BUILD_DICT = NEMATUS_HOME + os.sep + 'data/build_dictionary.py'
 NEMATUS_NMT = NEMATUS_HOME + os.sep + 'nematus/nmt.py'
 NEMATUS_TRANSLATE = NEMATUS_HOME + os.sep + 'nematus/translate.py'
 
+# Path to the translation worker that keeps a Nematus model in memory
+NEMATUS_WORKER = os.path.dirname(os.path.abspath(__file__)) + os.sep + 'nematus_worker.py'
+
 
 ######################################
 # Constants related to preprocessing
@@ -78,6 +82,8 @@ MOSES_SPECIAL_CHARS['"'] = "&quot;"
 MOSES_SPECIAL_CHARS["'"] = "&apos;"
 MOSES_SPECIAL_CHARS["["] = "&#91;"
 MOSES_SPECIAL_CHARS["]"] = "&#93;"
+# Number of characters (roughly) escaped or de-escaped at once in files
+SPECIAL_CHARS_FILE_CHUNK_SIZE = 2 ** 20
 
 # Protected patterns relevant for tokenization and masking
 # Dictionary[name of pattern / mask token] = 'regular expression'
@@ -88,6 +94,48 @@ PROTECTED_PATTERNS['entity'] = r'&[a-zA-Z0-9#]+;'
 PROTECTED_PATTERNS['email'] = r'[\w\-\_\.]+\@([\w\-\_]+\.)+[a-zA-Z]{2,}'
 PROTECTED_PATTERNS['url'] = r'(https?:\/\/(?:www\.|(?!www))[^\s\.]+\.[^\s]{2,}|www\.[^\s]+\.[^\s]{2,})'
 
+# (De-)tokenizer implementations: the Moses Perl scripts run as external
+# processes (default), or a compatible implementation in Python that runs
+# in-process; set MTRAIN_TOKENIZER_BACKEND=python to use the latter
+TOKENIZER_BACKEND_PERL = 'perl'
+TOKENIZER_BACKEND_PYTHON = 'python'
+TOKENIZER_BACKENDS = {
+    TOKENIZER_BACKEND_PERL: "tokenizer.perl and detokenizer.perl from Moses",
+    TOKENIZER_BACKEND_PYTHON: "in-process Python implementation, compatible " +
+                              "with the Moses scripts"
+}
+TOKENIZER_BACKEND = os.environ.get('MTRAIN_TOKENIZER_BACKEND') if os.environ.get('MTRAIN_TOKENIZER_BACKEND') else TOKENIZER_BACKEND_PERL
+
+# (De-)truecaser implementations, analogous to the (de-)tokenizer backends;
+# set MTRAIN_TRUECASER_BACKEND=python to use the in-process implementation
+TRUECASER_BACKEND_PERL = 'perl'
+TRUECASER_BACKEND_PYTHON = 'python'
+TRUECASER_BACKENDS = {
+    TRUECASER_BACKEND_PERL: "truecase.perl and detruecase.perl from Moses",
+    TRUECASER_BACKEND_PYTHON: "in-process Python implementation, compatible " +
+                              "with the Moses scripts"
+}
+TRUECASER_BACKEND = os.environ.get('MTRAIN_TRUECASER_BACKEND') if os.environ.get('MTRAIN_TRUECASER_BACKEND') else TRUECASER_BACKEND_PERL
+# Precompiled truecasing models that can be memory-mapped are stored next to
+# the Moses model, with this suffix
+TRUECASING_BINARY_MODEL_SUFFIX = '.bin'
+
+# Sharded preprocessing of corpora: number of shards per worker process (more
+# shards balance the load better), and size of blocks read when looking for
+# shard boundaries
+SHARDS_PER_WORKER = 4
+SHARDING_BLOCK_SIZE = 1024 * 1024
+
+# Seed of the random number generator that selects segments for tuning and
+# evaluation from the base corpus, so that repeated trainings use the same split
+CORPUS_SPLIT_SEED = 42
+
+# Maximum number of lines written to an external process (e.g. the Moses
+# tokenizer) before its output is read when processing batches of lines
+EXTERNAL_PROCESSOR_MAX_IN_FLIGHT = 256
+# Default number of identical processes in a pool of external processors
+EXTERNAL_PROCESSOR_POOL_SIZE = 4
+
 # Relative paths to components inside working directory
 PATH_COMPONENT = {
     # Maps components to their base directory name
@@ -114,6 +162,7 @@ SUFFIX_LOWERCASED = 'lowercased'
 SUFFIX_CASED = 'cased'
 SUFFIX_TRUECASED = 'truecased'
 SUFFIX_WITH_MARKUP = 'with_markup'
+SUFFIX_UNSPLIT = 'unsplit'
 SUFFIX_WITHOUT_MARKUP = 'without_markup'
 SUFFIX_FINAL = 'final'
 
@@ -185,6 +234,20 @@ BPE_NUM_JOINT_OPERATIONS = 50000  # joint vocabulary
 
 BPE_VOCAB_THRESHOLD = 50
 
+# BPE implementations: apply_bpe.py from subword-nmt as an external process
+# (default), or a compatible implementation in Python that runs in-process;
+# set MTRAIN_BPE_BACKEND=python to use the latter
+BPE_BACKEND_SUBWORD_NMT = 'subword-nmt'
+BPE_BACKEND_PYTHON = 'python'
+BPE_BACKENDS = {
+    BPE_BACKEND_SUBWORD_NMT: "apply_bpe.py from subword-nmt",
+    BPE_BACKEND_PYTHON: "in-process Python implementation, compatible " +
+                        "with apply_bpe.py"
+}
+BPE_BACKEND = os.environ.get('MTRAIN_BPE_BACKEND') if os.environ.get('MTRAIN_BPE_BACKEND') else BPE_BACKEND_SUBWORD_NMT
+BPE_SEPARATOR = '@@'
+BPE_CACHE_SIZE = 100000  # segmented words kept in memory
+
 
 ######################################
 # Constants related to XML processing
@@ -258,6 +321,21 @@ EVALUATION_TOOLS = {
                           "performs internal tokenization."
 }
 
+# Translation cache
+CACHE_MAX_SIZE = 100000  # entries kept in memory
+CACHE_MAX_PERSISTENT_SIZE = 10000000  # entries kept on disk
+CACHE_COMMIT_SIZE = 1000  # translations of a file stored on disk in one transaction
+
+# Pipelined translation of files: maximum number of segments waiting between
+# two stages (e.g. tokenized segments waiting for the decoder)
+PIPELINE_QUEUE_SIZE = 64
+
+# Translation server
+SERVER_HOST = '127.0.0.1'  # only accept local connections
+SERVER_PORT = 8050
+SERVER_MAX_QUEUE_SIZE = 64  # pending requests, further requests are rejected
+SERVER_MAX_BATCH_SIZE = 64  # segments translated at once
+
 # Python logging levels
 LOGGING_LEVELS = {
     "DEBUG": logging.DEBUG,
@@ -297,6 +375,8 @@ NEMATUS_SIZE_HIDDEN = 512
 NEMATUS_SIZE_EMB = 1024
 
 TRANS_BEAM_SIZE = 12
+# Maximum number of segments translated at once by a Nematus worker
+TRANS_BATCH_SIZE = 80
 
 
 NEMATUS_OPTIONS = {
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import math
 import random
 
 
@@ -204,3 +205,63 @@ class ParallelCorpus(object):
         # TODO: this is slow (O(n)) and needs improvement
         i = random.randrange(len(self._bisegments))
         return self._bisegments.pop(i)
+
+
+class ReservoirSampler(object):
+    """
+    Selects a uniform random sample of fixed size from a stream of items of
+    unknown length (Algorithm L, Li 1994). Instead of drawing a random number
+    for every item, the number of items skipped until the next item enters
+    the sample is drawn, so that the random number generator is only used
+    for items that are selected.
+    """
+
+    def __init__(self, size, random_generator=None):
+        """
+        @param size the number of items in the sample
+        @param random_generator a random.Random object, the `random` module
+            if None
+        """
+        self._size = size
+        self._random = random if random_generator is None else random_generator
+        self._num_items = 0
+        self._next_item = 0
+        self._weight = 1.0
+        if self._size > 0:
+            self._weight = self._next_weight()
+        else:
+            self._next_item = float('inf')
+
+    def offer(self):
+        """
+        Offers the next item of the stream to the sample.
+
+        @return the position in the sample (0 <= position < size) that the
+            item takes, replacing the item in this position once the sample
+            is full. None if the item does not enter the sample.
+        """
+        i = self._num_items
+        self._num_items += 1
+        if i < self._size:
+            if i == self._size - 1:
+                self._skip()
+            return i
+        if i < self._next_item:
+            return None
+        self._weight *= self._next_weight()
+        self._skip()
+        return self._random.randrange(self._size)
+
+    def _next_weight(self):
+        return math.exp(math.log(self._random.random() or 1e-300) / self._size)
+
+    def _skip(self):
+        """
+        Determines the next item that enters the sample.
+        """
+        if self._weight >= 1.0:
+            self._next_item = float('inf')
+            return
+        self._next_item = self._num_items + int(
+            math.log(self._random.random() or 1e-300) / math.log(1.0 - self._weight)
+        )
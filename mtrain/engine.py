@@ -4,22 +4,29 @@
 Translation engine processes.
 """
 
+import os
+
+from array import array
 from collections import defaultdict
 from mtrain import commander
 from mtrain import constants as C
-from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.preprocessing.external import ExternalProcessor, create_processor, process_async
 
 
 class EngineMoses(object):
     """
     Starts a translation engine process for moses backend and keep it running.
     """
-    def __init__(self, path_moses_ini, report_alignment=False, report_segmentation=False):
+    def __init__(self, path_moses_ini, report_alignment=False, report_segmentation=False, num_processes=1,
+                 asynchronous=False):
         """
         @param path_moses_ini path to Moses configuration file
         @param report_alignment whether Moses should report word alignments
         @param report_segmentation whether Moses should report how the translation
             is made up of phrases
+        @param num_processes number of Moses processes kept in memory
+        @param asynchronous whether the Moses process is used from asyncio
+            coroutines, through `translate_segment_async`
         """
         self._path_moses_ini = path_moses_ini
         self._report_alignment = report_alignment
@@ -39,86 +46,99 @@ class EngineMoses(object):
             trailing_output = True
         if self._report_segmentation:
             arguments.append('-report-segmentation')
+        self._arguments = arguments
 
-        self._processor = ExternalProcessor(
-            command=" ".join([C.MOSES] + arguments),
-            stream_stderr=True,
-            trailing_output=trailing_output
-        )
+        self._num_processes = num_processes
+        self._asynchronous = asynchronous
+        self._trailing_output = trailing_output
+        # the Moses process kept in memory is started when the first segment
+        # is translated, so that `translate_file` alone does not load the
+        # models twice
+        self._processor = None
+
+    def _get_processor(self):
+        """
+        Returns the Moses process kept in memory, starting it if necessary.
+        """
+        if self._processor is None:
+            self._processor = create_processor(
+                command=" ".join([C.MOSES] + self._arguments),
+                num_processes=self._num_processes,
+                asynchronous=self._asynchronous,
+                stream_stderr=True,
+                trailing_output=self._trailing_output
+            )
+        return self._processor
 
     def close(self):
-        del self._processor
+        if self._processor is not None:
+            self._processor.close()
+            self._processor = None
 
     def _extract_alignment(self, alignment_string):
         """
-        Transforms a word alignment string into an easily
-            accessible dictionary {source: [target, ...], ...}
+        Transforms a word alignment string into a flat array of
+            (source, target) index pairs.
         @param alignment_string the exact string returned by Moses
             that contains alignment information
         """
-        alignments = defaultdict(list)
-
-        for alignment in alignment_string.strip().split(" "):
-            source, target = [int(string) for string in alignment.split("-")]
-            alignments[source].append(target)
-
-        return alignments
+        indexes = [int(index) for index in alignment_string.replace("-", " ").split()]
+        if len(indexes) % 2:
+            raise ValueError("Malformed word alignment: '%s'" % alignment_string)
+        return _index_array(indexes)
 
     def _separate_tokens_from_segmentation(self, translation):
         """
-        Transform phrase segmentation strings into easily
-            accessible dictionary:
-            {(source start, source end): (target start, target end), ...}
+        Separates the tokens of a translation from the phrase segmentation
+            interspersed with them.
         @param translation a translation string returned by Moses that does not
             contain word alignments anymore, but phrase segmentation is still
             interspersed
+        @return the tokens, a flat array of (source start, source end) pairs,
+            and an array of offsets: phrase i covers the target tokens from
+            offsets[i] to offsets[i+1] - 1
         """
         tokens = []
-        segmentation = {}
-        current_phrase_indexes = []
-        current_index = 0
+        source_spans = []
+        target_offsets = [0]
 
         for string in translation.split(" "):
             if '|' in string:
-                current_segmentation = string.replace('|', '').split("-")
-                if len(current_phrase_indexes) == 1:
-                    current_phrase_indexes.append(current_phrase_indexes[0]) # duplicate single index
-
-                current_key = tuple(int(index) for index in current_segmentation)
-                segmentation[current_key] = tuple(int(index) for index in current_phrase_indexes)
-
-                current_phrase_indexes = []
+                source_start, source_end = string.replace('|', '').split("-")
+                source_spans.append(int(source_start))
+                source_spans.append(int(source_end))
+                target_offsets.append(len(tokens))
             else:
-                if len(current_phrase_indexes) >= 2:
-                    current_phrase_indexes.pop()
-                current_phrase_indexes.append(str(current_index))
                 tokens.append(string)
-                current_index += 1
 
-        return tokens, segmentation
+        return tokens, _index_array(source_spans), _index_array(target_offsets)
 
     def _untangle_translation(self, translation):
         """
         Separates the actual translation from reported segmentation
-            and word alignments. Changes slightly the segmentation info
-            by adding information about the source tokens.
+            and word alignments, in a single pass over each part.
         @param translation the exact string returned by a Moses engine
+        @return a TranslatedSegment object
         """
+        alignment_pairs = None
+        source_spans = None
+        target_offsets = None
+
         if self._report_alignment:
-            alignment = []
             parts = translation.split('|||')
             translation = parts[0].strip() # update translation to remove alignment info
 
-            alignment = self._extract_alignment(parts[1])
+            alignment_pairs = self._extract_alignment(parts[1])
 
         if self._report_segmentation:
-            tokens, segmentation = self._separate_tokens_from_segmentation(translation)
+            tokens, source_spans, target_offsets = self._separate_tokens_from_segmentation(translation)
             translation = " ".join(tokens) # update translation to only contain actual tokens
 
-        return (
+        return TranslatedSegment.from_arrays(
             translation,
-            alignment if self._report_alignment else None,
-            segmentation if self._report_segmentation else None
+            alignment_pairs=alignment_pairs,
+            source_spans=source_spans,
+            target_offsets=target_offsets
         )
 
     def translate_segment(self, segment):
@@ -128,75 +148,239 @@ class EngineMoses(object):
         @return a TranslatedSegment object with a translation and,
         optionally, alignments and/or segmentation info
         """
-        translation = self._processor.process(segment)
-        translation, alignment, segmentation = self._untangle_translation(translation)
+        translation = self._get_processor().process(segment)
+        return self._translated_segment(translation)
 
-        return TranslatedSegment(
-            translated_segment=translation,
-            alignment=alignment,
-            segmentation=segmentation
-        )
+    async def translate_segment_async(self, segment):
+        """
+        Translates a single input @param segment in an asyncio coroutine, see
+        `translate_segment`.
+        """
+        translation = await process_async(self._get_processor(), segment)
+        return self._translated_segment(translation)
 
-    def translate_file(self, input_path, output_path):
+    def translate_segments(self, segments):
         """
-        Translates an entire file.
+        Translates a list of input @param segments, keeping several segments in
+        flight in the Moses process.
+
+        @return a list of TranslatedSegment objects
+        """
+        translations = self._get_processor().process_batch(segments)
+        return [self._translated_segment(translation) for translation in translations]
+
+    def _translated_segment(self, translation):
+        """
+        Creates a TranslatedSegment object from the exact string returned by
+        Moses for a single segment.
+        """
+        return self._untangle_translation(translation)
+
+    def translate_file(self, input_path, output_path, num_threads=1):
+        """
+        Translates an entire file with a single, multi-threaded Moses process.
+        The Moses process kept in memory is stopped first, so that the models
+        are not loaded twice; it is restarted if segments are translated
+        afterwards.
 
         @param input_path path to temp file with preprocessed input segments
         @param output_path path to temp file were raw translations should be written
+        @param num_threads number of threads used by the Moses decoder
+        """
+        self.close()
+        arguments = self._arguments + ['-threads %d' % num_threads]
+        commander.run(
+            '{moses} {arguments} < "{input_path}" > "{output_path}"'.format(
+                moses=C.MOSES,
+                arguments=" ".join(arguments),
+                input_path=input_path,
+                output_path=output_path
+            ),
+            "Translating file with Moses: %d threads" % num_threads
+        )
+
+    def read_translations(self, output_path):
         """
+        Reads raw translations written by `translate_file` and yields a
+        TranslatedSegment object for each input segment, in order.
 
-        raise NotImplementedError
+        @param output_path path to file with raw translations
+        """
+        with open(output_path, "r", encoding="utf-8") as output_handle:
+            for line in output_handle:
+                # Moses prints an empty line after alignment info, actual
+                # translations always contain the alignment separator
+                if self._report_alignment and '|||' not in line:
+                    continue
+                yield self._translated_segment(line.strip())
 
 
 class EngineNematus(object):
     """
-    Starts a translation engine process for a Nematus backend.
+    Starts a translation engine process for a Nematus backend and keeps it
+    running, so that the model is loaded only once.
     """
-    def __init__(self, model_path, device, preallocate, beam_size):
+    def __init__(self, model_path, device, preallocate, beam_size, batch_size=C.TRANS_BATCH_SIZE):
         """
         @param model_path full path to model trained in `mtrain` using backend nematus
         @param device GPU or CPU device for translation
         @param preallocate preallocate memory on a GPU device
         @param beam_size size of beam in beam search
+        @param batch_size maximum number of segments translated at once
         """
         self._model_path = model_path
         self._device = device
         self._preallocate = preallocate
         self._beam_size = beam_size
+        self._batch_size = batch_size
+
+        theano_flags = 'THEANO_FLAGS=mode=FAST_RUN,floatX=float32,device={device},on_unused_input=warn,gpuarray.preallocate={preallocate}'.format(
+            device=self._device,
+            preallocate=self._preallocate
+        )
+        arguments = [
+            '-m %s' % self._model_path,
+            '-k %d' % self._beam_size,
+            '--batch_size %d' % self._batch_size,
+            '--nematus_path %s' % os.path.dirname(C.NEMATUS_TRANSLATE),
+        ]
+        self._processor = ExternalProcessor(
+            command=" ".join([theano_flags, C.PYTHON2, C.NEMATUS_WORKER] + arguments),
+            stream_stderr=True
+        )
+
+    def close(self):
+        self._processor.close()
+        del self._processor
+
+    def translate_segment(self, segment):
+        """
+        Translates a single preprocessed input @param segment.
+        """
+        return self._processor.process(segment)
+
+    def translate_segments(self, segments):
+        """
+        Translates a list of preprocessed input @param segments. Segments are
+        sent to the worker without waiting for previous translations, so that
+        the worker can translate them in batches.
+        """
+        return self._processor.process_batch(segments, max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT)
+
+    def translate_stream(self, segments):
+        """
+        Translates the preprocessed input @param segments of an iterable and
+        yields translations as soon as they are available. Segments are
+        read while earlier ones are translated, so that the worker can
+        translate them in batches.
+        """
+        return self._processor.process_stream(segments, max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT)
 
     def translate_file(self, input_path, output_path):
         """
         Translates an entire file.
 
-        @param input_path path to temp file with preprocessed input segments
-        @param output_path path to temp file were raw translations should be written
+        @param input_path path to file with preprocessed input segments
+        @param output_path path to file were raw translations should be written
         """
-        theano_trans_flags = 'THEANO_FLAGS=mode=FAST_RUN,floatX=float32,device={device},on_unused_input=warn,gpuarray.preallocate={preallocate} python2 {script} '.format(
-            device=self._device,
-            preallocate=self._preallocate,
-            script=C.NEMATUS_TRANSLATE
-        )
-        nematus_trans_options = '-m {model} -i {input} -o {output} -k {beam_size} -n -p 1'.format(
-            model=self._model_path,
-            input=input_path,
-            output=output_path,
-            beam_size=self._beam_size
-        )
-        commander.run(
-            '{nematus_command}'.format(
-                nematus_command=theano_trans_flags + nematus_trans_options
-            ),
-        )
+        with open(input_path, "r", encoding="utf-8") as input_handle, \
+             open(output_path, "w", encoding="utf-8") as output_handle:
+            for translation in self.translate_stream(line.strip() for line in input_handle):
+                output_handle.write(translation + "\n")
+
+def _index_array(indexes):
+    """
+    Stores a list of token @param indexes compactly, with 16 bits per index
+    unless an index is larger.
+    """
+    try:
+        return array('H', indexes)
+    except OverflowError:
+        return array('L', indexes)
+
 
 class TranslatedSegment(object):
     """
     Models a single translated segment together with its word alignments and
-    phrase segmentation.
+    phrase segmentation. Alignments and segmentation reported by Moses are
+    stored in flat arrays, the dictionaries are only built when accessed.
     """
+    __slots__ = ('translation', '_alignment', '_alignment_pairs', '_segmentation',
+                 '_source_spans', '_target_offsets')
+
     def __init__(self, translated_segment, alignment=None, segmentation=None):
+        """
+        @param translated_segment the translation
+        @param alignment word alignments, a dictionary {source: [target, ...], ...}
+        @param segmentation phrase segmentation, a dictionary
+            {(source start, source end): (target start, target end), ...}
+        """
         self.translation = translated_segment
-        self.alignment = alignment
-        self.segmentation = segmentation
+        self._alignment = alignment
+        self._alignment_pairs = None
+        self._segmentation = segmentation
+        self._source_spans = None
+        self._target_offsets = None
+
+    @classmethod
+    def from_arrays(cls, translated_segment, alignment_pairs=None, source_spans=None, target_offsets=None):
+        """
+        Creates a TranslatedSegment from compact arrays.
+
+        @param alignment_pairs a flat array of (source, target) index pairs
+        @param source_spans a flat array of (source start, source end) pairs,
+            one for each phrase in target order
+        @param target_offsets an array of offsets, phrase i covers the target
+            tokens from target_offsets[i] to target_offsets[i+1] - 1
+        """
+        translated = cls(translated_segment)
+        translated._alignment_pairs = alignment_pairs
+        translated._source_spans = source_spans
+        translated._target_offsets = target_offsets
+        return translated
+
+    @property
+    def alignment(self):
+        """
+        Word alignments, a dictionary {source: [target, ...], ...} that
+        returns an empty list for unaligned source tokens.
+        """
+        if self._alignment is None and self._alignment_pairs is not None:
+            pairs = self._alignment_pairs
+            alignment = defaultdict(list)
+            for index in range(0, len(pairs), 2):
+                alignment[pairs[index]].append(pairs[index + 1])
+            self._alignment = alignment
+        return self._alignment
+
+    @alignment.setter
+    def alignment(self, alignment):
+        self._alignment = alignment
+        self._alignment_pairs = None
+
+    @property
+    def segmentation(self):
+        """
+        Phrase segmentation, a dictionary in target order
+        {(source start, source end): (target start, target end), ...}, where
+        phrases without target tokens are mapped to an empty tuple.
+        """
+        if self._segmentation is None and self._source_spans is not None:
+            spans = self._source_spans
+            offsets = self._target_offsets
+            segmentation = {}
+            for phrase in range(len(spans) // 2):
+                first, following = offsets[phrase], offsets[phrase + 1]
+                segmentation[(spans[2 * phrase], spans[2 * phrase + 1])] = \
+                    (first, following - 1) if following > first else ()
+            self._segmentation = segmentation
+        return self._segmentation
+
+    @segmentation.setter
+    def segmentation(self, segmentation):
+        self._segmentation = segmentation
+        self._source_spans = None
+        self._target_offsets = None
 
     def __repr__(self):
         generic_string = super(TranslatedSegment, self).__repr__()
@@ -63,8 +63,7 @@ class Evaluator(object):
                                                   training_config=self._training_args,
                                                   device=self._training_args.device_train,
                                                   preallocate=0.2,
-                                                  beam_size=12,
-                                                  keep_temp_files=False)
+                                                  beam_size=12)
         else:
             raise NotImplementedError
 
@@ -95,7 +94,13 @@ class Evaluator(object):
         input_handle = open(input_path, "r")
         hypothesis_handle = open(hypothesis_path, "w")
 
-        self._engine.translate_file(input_handle=input_handle, output_handle=hypothesis_handle)
+        if self._training_args.backend == C.BACKEND_MOSES:
+            # translate with a single, multi-threaded decoder run
+            self._engine.translate_file(input_handle=input_handle,
+                                        output_handle=hypothesis_handle,
+                                        num_threads=self._training_args.threads)
+        else:
+            self._engine.translate_file(input_handle=input_handle, output_handle=hypothesis_handle)
 
         input_handle.close()
         hypothesis_handle.close()
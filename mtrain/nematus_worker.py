@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Long-lived Nematus translation worker. Loads a model once and translates
+segments read from STDIN, writing exactly one output line per input line to
+STDOUT. Lines that are available at the same time are translated as a batch.
+
+Nematus requires Python 2, therefore this script must not import `mtrain` and
+is kept compatible with both Python 2 and 3.
+'''
+
+from __future__ import print_function
+
+import os
+import sys
+import select
+import argparse
+
+READ_SIZE = 65536
+
+
+class _IdentityTranslator(object):
+    '''
+    Stand-in for a Nematus model that returns its input, for testing.
+    '''
+
+    def translate(self, segments):
+        return segments
+
+
+class _NematusTranslator(object):
+    '''
+    Wraps the Translator class of Nematus, keeping the model in memory.
+    '''
+
+    def __init__(self, model_path, beam_size, nematus_path=None):
+        '''
+        @param model_path full path to model trained in `mtrain` using backend nematus
+        @param beam_size size of beam in beam search
+        @param nematus_path directory containing Nematus' translate.py
+        '''
+        if nematus_path:
+            sys.path.insert(0, nematus_path)
+        from translate import Translator
+        from settings import TranslationSettings
+
+        self._settings = TranslationSettings(from_console_arguments=False)
+        self._settings.models = [model_path]
+        self._settings.beam_width = beam_size
+        self._settings.normalization_alpha = 1.0 # equivalent to `-n`
+        self._settings.num_processes = 1
+        self._translator = Translator(self._settings)
+
+    def translate(self, segments):
+        translations = self._translator.translate_list(segments, self._settings)
+        return [" ".join(translation.target_words) for translation in translations]
+
+
+def read_batches(fd, max_batch_size):
+    '''
+    Reads complete lines from the file descriptor @param fd. Blocks until at
+    least one line is available, then collects all further lines that can be
+    read without blocking and yields them in batches of at most
+    @param max_batch_size lines.
+    '''
+    buffered = b''
+    end_of_stream = False
+    while not end_of_stream:
+        # block until at least one complete line is available
+        while b'\n' not in buffered:
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                end_of_stream = True
+                break
+            buffered += chunk
+        # add everything else that is available right now
+        while not end_of_stream and select.select([fd], [], [], 0)[0]:
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                end_of_stream = True
+                break
+            buffered += chunk
+        if end_of_stream:
+            complete = buffered
+            buffered = b''
+        else:
+            last_newline = buffered.rindex(b'\n') + 1
+            complete = buffered[:last_newline]
+            buffered = buffered[last_newline:]
+        # split on newlines only: `splitlines` would also split on carriage
+        # returns within a segment and break one-line-in/one-line-out
+        lines = complete.split(b'\n')
+        if lines[-1] == b'':
+            lines.pop()
+        lines = [line.decode('utf-8').strip() for line in lines]
+        for start in range(0, len(lines), max_batch_size):
+            yield lines[start:start + max_batch_size]
+
+
+def serve(translator, input_fd, output_stream, max_batch_size):
+    '''
+    Translates batches of lines from @param input_fd until the end of the
+    stream, flushing the output after each batch.
+    '''
+    for batch in read_batches(input_fd, max_batch_size):
+        for translation in translator.translate(batch):
+            output_stream.write(translation.encode('utf-8') + b'\n')
+        output_stream.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translates lines from STDIN with a Nematus model kept in memory.")
+    parser.add_argument("-m", "--model", help="path to model.npz")
+    parser.add_argument("-k", "--beam_size", type=int, default=12, help="size of beam in beam search")
+    parser.add_argument("--batch_size", type=int, default=80, help="maximum number of segments translated at once")
+    parser.add_argument("--nematus_path", help="directory containing Nematus' translate.py")
+    parser.add_argument("--identity", action="store_true", help="do not load a model, return input segments (for testing)")
+    args = parser.parse_args()
+
+    if args.identity:
+        translator = _IdentityTranslator()
+    else:
+        translator = _NematusTranslator(args.model, args.beam_size, args.nematus_path)
+
+    output_stream = getattr(sys.stdout, 'buffer', sys.stdout)
+    serve(translator, sys.stdin.fileno(), output_stream, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""
+Runs items through a sequence of stages, each in its own thread. Stages are
+connected by bounded queues, so that all stages work at the same time on
+different items (e.g. the tokenizer on segment i+2 while the decoder
+translates segment i+1 and the detokenizer finishes segment i).
+"""
+
+import queue
+import threading
+
+from mtrain import constants as C
+
+# marks the end of the items in a queue
+_END = object()
+
+
+class _Failure(object):
+    """
+    An exception raised in a stage, passed on to the consumer of the pipeline.
+    """
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def run_pipeline(items, stages, queue_size=C.PIPELINE_QUEUE_SIZE):
+    """
+    Applies the functions in @param stages to all @param items, one after
+    the other, and yields the results in the order of the items.
+
+    Each stage runs in a thread of its own and handles one item at a time,
+    so components used by a single stage are never used concurrently. If a
+    stage raises an exception, it is raised in the consumer. If the consumer
+    stops early, all threads are stopped.
+
+    @param items an iterable of items, read in a thread of its own
+    @param stages a list of functions that take an item and return the
+        processed item
+    @param queue_size the maximum number of items waiting between two stages
+    """
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+    stopped = threading.Event()
+
+    def _put(item_queue, item):
+        """
+        Puts @param item in @param item_queue, unless the pipeline is stopped.
+        """
+        while not stopped.is_set():
+            try:
+                item_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(item_queue):
+        """
+        Gets the next item from @param item_queue, _END if the pipeline is
+        stopped.
+        """
+        while not stopped.is_set():
+            try:
+                return item_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed():
+        try:
+            for item in items:
+                if not _put(queues[0], item):
+                    return
+            _put(queues[0], _END)
+        except Exception as e:
+            _put(queues[0], _Failure(e))
+
+    def _run_stage(stage, input_queue, output_queue):
+        while True:
+            item = _get(input_queue)
+            if item is _END or isinstance(item, _Failure):
+                _put(output_queue, item)
+                return
+            try:
+                item = stage(item)
+            except Exception as e:
+                _put(output_queue, _Failure(e))
+                return
+            if not _put(output_queue, item):
+                return
+
+    threads = [threading.Thread(target=_feed)]
+    for stage, input_queue, output_queue in zip(stages, queues, queues[1:]):
+        threads.append(threading.Thread(target=_run_stage, args=(stage, input_queue, output_queue)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
@@ -2,12 +2,16 @@
 
 """
 Wraps sub-word nmt to provide byte-pair encoding (BPE) as a preprocessing step.
+Segments can also be encoded in-process, compatible with sub-word nmt's
+`apply_bpe.py`.
 """
 import os
+import re
+import functools
 
 from mtrain import constants as C
 from mtrain import commander
-from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.preprocessing.external import create_processor
 
 
 class BytePairEncoderFile(object):
@@ -91,15 +95,199 @@ class BytePairEncoderFile(object):
         )
 
 
+class BytePairEncoder(object):
+    """
+    Applies a trained BPE model in-process, like `apply_bpe.py`. Merge
+    operations are loaded once into a table that maps symbol pairs to their
+    rank, and segmented words are kept in an LRU cache. Thread-safe.
+    """
+    def __init__(self, bpe_model_path, vocab_path=None, vocab_threshold=C.BPE_VOCAB_THRESHOLD,
+                 separator=C.BPE_SEPARATOR, cache_size=C.BPE_CACHE_SIZE):
+        """
+        @param bpe_model_path full path to BPE model
+        @param vocab_path optional path to vocabulary file
+        @param vocab_threshold minimum frequency of vocabulary items
+        @param separator appended to subwords that do not end a word
+        @param cache_size maximum number of segmented words kept in memory
+        """
+        with open(bpe_model_path, encoding='utf-8') as model_file:
+            first_line = model_file.readline()
+            if first_line.startswith('#version:'):
+                self._version = tuple(
+                    int(x) for x in re.sub(r'(\.0+)*$', '', first_line.split()[-1]).split(".")
+                )
+                codes = model_file.read().splitlines()
+            else:
+                self._version = (0, 1)
+                codes = [first_line.rstrip('\r\n')] + model_file.read().splitlines()
+        if self._version not in ((0, 1), (0, 2)):
+            raise NotImplementedError("Unsupported BPE model version: %s" % (self._version,))
+
+        # only the first instance of duplicate merge operations counts
+        self._ranks = {}
+        for rank, code in reversed(list(enumerate(codes))):
+            self._ranks[tuple(code.strip('\r\n ').split(' '))] = rank
+        # maps merged symbols to the pair they were merged from
+        self._reverse = {first + second: (first, second) for first, second in self._ranks}
+
+        self._vocab = None
+        if vocab_path is not None:
+            self._vocab = set()
+            with open(vocab_path, encoding='utf-8') as vocab_file:
+                for line in vocab_file:
+                    word, frequency = line.strip('\r\n ').split(' ')
+                    if vocab_threshold is None or int(frequency) >= vocab_threshold:
+                        self._vocab.add(word)
+
+        self._separator = separator
+        self._encode_word = functools.lru_cache(maxsize=cache_size)(self._encode_word_uncached)
+
+    def close(self):
+        self._encode_word.cache_clear()
+
+    def cache_info(self):
+        """
+        Returns hits, misses and the size of the word cache.
+        """
+        return self._encode_word.cache_info()
+
+    def encode_segment(self, segment):
+        """
+        Encodes a single @param segment. Whitespace around the segment is kept.
+        """
+        output = []
+        leading_whitespace = len(segment) - len(segment.lstrip())
+        if leading_whitespace:
+            output.append(segment[:leading_whitespace])
+        subwords = []
+        for word in segment.strip().split(' '):
+            if not word:
+                continue # eliminate double spaces
+            encoded_word = self._encode_word(word)
+            subwords.extend(subword + self._separator for subword in encoded_word[:-1])
+            subwords.append(encoded_word[-1])
+        output.append(" ".join(subwords))
+        trailing_whitespace = len(segment) - len(segment.rstrip())
+        if trailing_whitespace and trailing_whitespace != len(segment):
+            output.append(segment[-trailing_whitespace:])
+        return "".join(output)
+
+    def encode_segments(self, segments):
+        """
+        Encodes a list of @param segments.
+        """
+        return [self.encode_segment(segment) for segment in segments]
+
+    # `process` and `process_batch` as in an ExternalProcessor
+    process = encode_segment
+
+    def process_batch(self, segments, max_in_flight=None):
+        return self.encode_segments(segments)
+
+    def _encode_word_uncached(self, word):
+        """
+        Segments a single @param word into a tuple of subwords.
+        """
+        if self._version == (0, 1):
+            symbols = list(word) + ['</w>']
+        else:
+            if len(word) == 1:
+                return (word,)
+            symbols = list(word[:-1]) + [word[-1] + '</w>']
+
+        ranks = self._ranks
+        while len(symbols) > 1:
+            # apply the highest-ranked merge operation to all occurrences
+            best_pair = None
+            best_rank = None
+            for pair in zip(symbols, symbols[1:]):
+                rank = ranks.get(pair)
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_pair, best_rank = pair, rank
+            if best_pair is None:
+                break
+            first, second = best_pair
+            merged = []
+            i = 0
+            while i < len(symbols):
+                if i < len(symbols) - 1 and symbols[i] == first and symbols[i + 1] == second:
+                    merged.append(first + second)
+                    i += 2
+                else:
+                    merged.append(symbols[i])
+                    i += 1
+            symbols = merged
+
+        # don't output end-of-word symbols
+        if symbols[-1] == '</w>':
+            symbols.pop()
+        elif symbols[-1].endswith('</w>'):
+            symbols[-1] = symbols[-1].replace('</w>', '')
+
+        if self._vocab is not None:
+            symbols = self._check_vocab_and_split(symbols)
+        return tuple(symbols)
+
+    def _check_vocab_and_split(self, symbols):
+        """
+        Splits subwords that are not in the vocabulary into smaller units,
+        reversing merge operations.
+        """
+        output = []
+        for symbol in symbols[:-1]:
+            if symbol + self._separator in self._vocab:
+                output.append(symbol)
+            else:
+                output.extend(self._recursive_split(symbol, False))
+        symbol = symbols[-1]
+        if symbol in self._vocab:
+            output.append(symbol)
+        else:
+            output.extend(self._recursive_split(symbol, True))
+        return output
+
+    def _recursive_split(self, segment, final):
+        """
+        Recursively splits @param segment into smaller units until all units
+        are in the vocabulary, or cannot be split any further.
+        """
+        try:
+            if final:
+                left, right = self._reverse[segment + '</w>']
+                right = right[:-4]
+            else:
+                left, right = self._reverse[segment]
+        except KeyError:
+            yield segment
+            return
+        if left + self._separator in self._vocab:
+            yield left
+        else:
+            yield from self._recursive_split(left, False)
+        if (final and right in self._vocab) or (not final and right + self._separator in self._vocab):
+            yield right
+        else:
+            yield from self._recursive_split(right, final)
+
+
 class BytePairEncoderSegment(object):
     """
     Applies a trained BPE model to individual segments.
     """
-    def __init__(self, bpe_model_path, vocab_path=None):
+    def __init__(self, bpe_model_path, vocab_path=None, num_processes=1, backend=C.BPE_BACKEND):
         """
         @param bpe_model_path full path to BPE model
         @param vocab_path optional path to vocabulary file
+        @param num_processes number of BPE processes kept in memory
+            (ignored by the in-process backend)
+        @param backend BPE implementation, see C.BPE_BACKENDS
         """
+        if backend == C.BPE_BACKEND_PYTHON:
+            self._processor = BytePairEncoder(bpe_model_path, vocab_path)
+            return
+        elif backend != C.BPE_BACKEND_SUBWORD_NMT:
+            raise ValueError("Unknown BPE backend '%s'" % backend)
+
         arguments = [
             '-c %s' % bpe_model_path
         ]
@@ -111,8 +299,9 @@ class BytePairEncoderSegment(object):
 
         # the subword script apply_bpe.py needs to be run in a Python 3 environment,
         # a constant is used to avoid version problems
-        self._processor = ExternalProcessor(
+        self._processor = create_processor(
             command=" ".join([C.PYTHON3] + [C.SUBWORD_NMT_APPLY] + arguments),
+            num_processes=num_processes,
             stream_stderr=False,
             trailing_output=False,
             shell=False
@@ -131,6 +320,12 @@ class BytePairEncoderSegment(object):
         encoded_segment = self._processor.process(segment)
         return encoded_segment
 
+    def encode_segments(self, segments):
+        """
+        Encodes a list of @param segments by applying a trained BPE model.
+        """
+        return self._processor.process_batch(segments)
+
 
 def bpe_decode_segment(segment):
     """
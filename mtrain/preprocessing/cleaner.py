@@ -14,19 +14,89 @@ def clean(segment):
     return segment  # no additional cleaning by now
 
 
+# replacements in the order in which they are applied
+_ESCAPE_REPLACEMENTS = tuple(C.MOSES_SPECIAL_CHARS.items())
+_DEESCAPE_REPLACEMENTS = tuple(
+    (replacement, char) for char, replacement in reversed(_ESCAPE_REPLACEMENTS)
+)
+
+
+def _replace_all(string, replacements):
+    """
+    Applies @param replacements, a sequence of (old, new) tuples, to
+    @param string one after the other.
+    """
+    for old, new in replacements:
+        # most strings contain few special characters, checking is cheaper than replacing
+        if old in string:
+            string = string.replace(old, new)
+    return string
+
+
+def _replace_all_batch(strings, replacements):
+    """
+    Applies @param replacements to a list of @param strings at once, by
+    joining them with newlines, which are never replaced.
+    """
+    if not strings:
+        return []
+    if any("\n" in string for string in strings):
+        return [_replace_all(string, replacements) for string in strings]
+    return _replace_all("\n".join(strings), replacements).split("\n")
+
+
 def escape_special_chars(segment):
     """
     Escapes characters in @param segment with special meaning in Moses.
     """
-    for char, replacement in C.MOSES_SPECIAL_CHARS.items():
-        segment = segment.replace(char, replacement)
-    return segment
+    return _replace_all(segment, _ESCAPE_REPLACEMENTS)
 
 
 def deescape_special_chars(segment):
     """
     Deespaces characters in @param segment with special meaning in Moses.
     """
-    for char in reversed(list(C.MOSES_SPECIAL_CHARS)):  # ugly, but needed for python 3.4.2
-        segment = segment.replace(C.MOSES_SPECIAL_CHARS[char], char)
-    return segment
+    return _replace_all(segment, _DEESCAPE_REPLACEMENTS)
+
+
+def escape_special_chars_batch(segments):
+    """
+    Escapes characters with special meaning in Moses in a list of @param segments.
+    """
+    return _replace_all_batch(segments, _ESCAPE_REPLACEMENTS)
+
+
+def deescape_special_chars_batch(segments):
+    """
+    Deescapes characters with special meaning in Moses in a list of @param segments.
+    """
+    return _replace_all_batch(segments, _DEESCAPE_REPLACEMENTS)
+
+
+def _replace_all_file(input_path, output_path, replacements):
+    """
+    Applies @param replacements to chunks of whole lines of a file.
+    """
+    with open(input_path, 'r', encoding='utf-8') as input_file, \
+         open(output_path, 'w', encoding='utf-8') as output_file:
+        while True:
+            lines = input_file.readlines(C.SPECIAL_CHARS_FILE_CHUNK_SIZE)
+            if not lines:
+                break
+            output_file.write(_replace_all("".join(lines), replacements))
+
+
+def escape_special_chars_file(input_path, output_path):
+    """
+    Escapes characters with special meaning in Moses in the file @param input_path
+    and writes the result to @param output_path.
+    """
+    _replace_all_file(input_path, output_path, _ESCAPE_REPLACEMENTS)
+
+
+def deescape_special_chars_file(input_path, output_path):
+    """
+    Deescapes characters with special meaning in Moses in the file @param input_path
+    and writes the result to @param output_path.
+    """
+    _replace_all_file(input_path, output_path, _DEESCAPE_REPLACEMENTS)
@@ -7,12 +7,15 @@ by https://github.com/casmacat/moses-mt-server/blob/master/python_server/server.
 Also inspired by eyalarubas.com/python-subproc-nonblock.html
 '''
 
+import asyncio
 import threading
 import logging
+from collections import deque
 from subprocess import Popen, PIPE
 from queue import Queue, Empty
 
 from mtrain import commander
+from mtrain import constants as C
 
 class ExternalProcessor(object):
     '''
@@ -82,19 +85,390 @@ class ExternalProcessor(object):
         with self._lock:
             self._process.stdin.write(line)
             self._process.stdin.flush()
-            result = self._process.stdout.readline()
-            # work around Moses printing an empty line after alignment info
-            if self._trailing_output:
-                self._process.stdout.readline() # do nothing with this line
+            result = self._read_result()
             # attempt reading from STDERR
-            if self._stream_stderr:
-                errors = self._nbsr.readline()
-                if errors:
-                    message = errors.decode()
-                    if commander._is_relevant_for_log(message):
-                        logging.info(message.strip())
+            self._log_stderr()
+        return result
+
+    def process_batch(self, lines, max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT):
+        '''
+        Processes several lines of input through the underlying shell script
+        (process) and returns the corresponding outputs in the same order,
+        keeping several lines in flight (see `process_stream`).
+
+        @param lines an iterable of input lines
+        @param max_in_flight the maximum number of lines that have been written
+            to the process but whose output has not been read yet
+        '''
+        lines = list(lines)
+        if not lines:
+            return []
+        return list(self.process_stream(lines, max_in_flight))
+
+    def process_stream(self, lines, max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT):
+        '''
+        Processes the lines of an iterable through the underlying shell script
+        (process) and yields the corresponding outputs in the same order, as
+        soon as they are available.
+
+        Instead of waiting for the output of each line before writing the next
+        one, a writer thread feeds the lines to STDIN while the calling thread
+        collects the results from STDOUT, keeping several lines in flight. The
+        lines may be produced while earlier ones are processed (e.g. by a
+        generator), memory use is bounded by @param max_in_flight.
+
+        The process is locked until the generator is exhausted or closed, it
+        must not be used by the consumer in the meantime.
+
+        @param lines an iterable of input lines
+        @param max_in_flight the maximum number of lines that have been written
+            to the process but whose output has not been read yet
+        '''
+        slots = threading.Semaphore(max(1, max_in_flight))
+        # True for each line written, then None at the end or an exception
+        written = Queue()
+        stopped = threading.Event()
+
+        def _feed_stdin():
+            '''
+            Writes all lines to STDIN, waiting for a free slot before each one.
+            '''
+            try:
+                for line in lines:
+                    slots.acquire()
+                    if stopped.is_set():
+                        break
+                    self._process.stdin.write((line.strip() + "\n").encode('utf-8'))
+                    self._process.stdin.flush()
+                    written.put(True)
+                written.put(None)
+            except Exception as e:
+                written.put(e)
+
+        with self._lock:
+            writer = threading.Thread(target=_feed_stdin)
+            writer.daemon = True
+            writer.start()
+            finished = False
+            try:
+                while True:
+                    entry = written.get()
+                    if entry is None or isinstance(entry, Exception):
+                        finished = True
+                        if entry is not None:
+                            raise entry
+                        break
+                    result = self._read_result()
+                    slots.release()
+                    yield result
+            finally:
+                # if the consumer stopped early, outputs of lines in flight are
+                # discarded, so that inputs and outputs stay in sync
+                stopped.set()
+                slots.release()
+                while not finished:
+                    entry = written.get()
+                    if entry is None or isinstance(entry, Exception):
+                        break
+                    self._read_result()
+                writer.join()
+                self._log_stderr(drain=True)
+
+    def _read_result(self):
+        '''
+        Reads the output that corresponds to a single line of input from STDOUT.
+        '''
+        result = self._process.stdout.readline()
+        # work around Moses printing an empty line after alignment info
+        if self._trailing_output:
+            self._process.stdout.readline() # do nothing with this line
         return result.decode().strip()
 
+    def _log_stderr(self, drain=False):
+        '''
+        Logs relevant lines from STDERR, if it is streamread.
+
+        @param drain whether all available lines should be read instead of
+            a single one
+        '''
+        if not self._stream_stderr:
+            return
+        while True:
+            errors = self._nbsr.readline()
+            if not errors:
+                break
+            message = errors.decode()
+            if commander._is_relevant_for_log(message):
+                logging.info(message.strip())
+            if not drain:
+                break
+
+class ExternalProcessorPool(object):
+    '''
+    Thread-safe pool of identical external I/O shell scripts. Each request is
+    dispatched to the least busy process, so that concurrent callers are not
+    serialized on a single process.
+    '''
+
+    def __init__(self, command, size=C.EXTERNAL_PROCESSOR_POOL_SIZE, **kwargs):
+        '''
+        @param command the command that should be executed on the shell
+        @param size the number of processes that are started
+        @param kwargs further arguments passed to each ExternalProcessor
+        '''
+        self.command = command
+        self._processors = [ExternalProcessor(command, **kwargs) for _ in range(max(1, size))]
+        # number of requests currently handled by each process
+        self._busy = [0] * len(self._processors)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self._processors)
+
+    def close(self):
+        '''
+        Closes all underlying processes.
+        '''
+        for processor in self._processors:
+            processor.close()
+
+    def _acquire(self):
+        '''
+        Picks the process with the fewest pending requests, ties are broken
+        in favour of the process with the lowest index.
+        '''
+        with self._lock:
+            index = self._busy.index(min(self._busy))
+            self._busy[index] += 1
+        return index
+
+    def _release(self, index):
+        with self._lock:
+            self._busy[index] -= 1
+
+    def process(self, line):
+        '''
+        Processes a line of input through an idle process of the pool and
+        returns the corresponding output.
+        '''
+        index = self._acquire()
+        try:
+            return self._processors[index].process(line)
+        finally:
+            self._release(index)
+
+    def process_batch(self, lines, max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT):
+        '''
+        Processes several lines of input, splitting them into contiguous chunks
+        that are processed by different processes at the same time. Outputs are
+        returned in the order of the inputs.
+
+        @param lines an iterable of input lines
+        @param max_in_flight the maximum number of lines in flight per process
+        '''
+        lines = list(lines)
+        if self.size == 1 or len(lines) <= 1:
+            return self._process_chunk(lines, max_in_flight)
+        chunk_size = -(-len(lines) // self.size) # ceiling division
+        chunks = [lines[i:i + chunk_size] for i in range(0, len(lines), chunk_size)]
+        results = [None] * len(chunks)
+        errors = []
+
+        def _run(chunk_index):
+            try:
+                results[chunk_index] = self._process_chunk(chunks[chunk_index], max_in_flight)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_run, args=(i,)) for i in range(len(chunks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return [result for chunk_results in results for result in chunk_results]
+
+    def process_stream(self, lines, max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT):
+        '''
+        Processes the lines of an iterable through the least busy process of
+        the pool and yields the outputs in order, see
+        `ExternalProcessor.process_stream`.
+        '''
+        index = self._acquire()
+        try:
+            yield from self._processors[index].process_stream(lines, max_in_flight)
+        finally:
+            self._release(index)
+
+    def _process_chunk(self, lines, max_in_flight):
+        index = self._acquire()
+        try:
+            return self._processors[index].process_batch(lines, max_in_flight)
+        finally:
+            self._release(index)
+
+
+class AsyncExternalProcessor(object):
+    '''
+    Wrapper for interaction with an external I/O shell script from asyncio
+    coroutines. Several lines can be in flight at the same time: each caller
+    writes its line and waits for a future, which a reader task resolves as
+    the outputs arrive, in order.
+
+    The process is started when the first line is processed, in the running
+    event loop. All coroutines must use the same event loop.
+    '''
+
+    def __init__(self, command, stream_stderr=False, trailing_output=False,
+                 max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT):
+        '''
+        @param command the command that should be executed on the shell
+        @param stream_stderr whether STDERR should be read and logged
+        @param trailing_output whether the external process outputs trailing
+            lines after the actual, single, output line
+        @param max_in_flight the maximum number of lines that have been written
+            to the process but whose output has not been read yet
+        '''
+        self.command = command
+        self._stream_stderr = stream_stderr
+        self._trailing_output = trailing_output
+        self._max_in_flight = max(1, max_in_flight)
+        self._process = None
+        self._starting = None
+        self._slots = None
+        self._pending = deque() # futures of lines in flight, in input order
+        self._tasks = []
+
+    async def start(self):
+        '''
+        Starts the underlying process, unless it is running already.
+        '''
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        await self._starting
+
+    async def _start(self):
+        logging.debug("Executing %s", self.command)
+        self._process = await asyncio.create_subprocess_exec(
+            '/bin/sh', '-c', self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE if self._stream_stderr else None
+        )
+        self._slots = asyncio.Semaphore(self._max_in_flight)
+        self._tasks.append(asyncio.ensure_future(self._read_results()))
+        if self._stream_stderr:
+            self._tasks.append(asyncio.ensure_future(self._log_stderr()))
+
+    def close(self):
+        '''
+        Closes the underlying process.
+        '''
+        for task in self._tasks:
+            task.cancel()
+        if self._process is not None:
+            self._process.stdin.close()
+            if self._process.returncode is None:
+                self._process.terminate()
+
+    async def wait_closed(self):
+        '''
+        Waits until the underlying process has ended after `close`.
+        '''
+        if self._process is not None:
+            await self._process.wait()
+
+    async def process(self, line):
+        '''
+        Processes a line of input through the underlying shell script (process)
+        and returns the corresponding output.
+        '''
+        await self.start()
+        line = line.strip() + "\n"
+        async with self._slots:
+            result = asyncio.get_running_loop().create_future()
+            # no other coroutine runs between registering the future and
+            # writing the line, so futures are in the order of the inputs
+            self._pending.append(result)
+            try:
+                self._process.stdin.write(line.encode('utf-8'))
+                await self._process.stdin.drain()
+            except ConnectionError:
+                result.cancel()
+                raise RuntimeError("Process ended unexpectedly: %s" % self.command)
+            return await result
+
+    async def process_batch(self, lines):
+        '''
+        Processes several lines of input, all of them in flight at the same
+        time (up to the maximum), and returns the outputs in the same order.
+        '''
+        return list(await asyncio.gather(*[self.process(line) for line in lines]))
+
+    async def _read_results(self):
+        '''
+        Reads outputs from STDOUT and passes them to the waiting callers.
+        '''
+        try:
+            while True:
+                result = await self._process.stdout.readline()
+                if not result:
+                    break
+                # work around Moses printing an empty line after alignment info
+                if self._trailing_output:
+                    await self._process.stdout.readline() # do nothing with this line
+                if self._pending:
+                    future = self._pending.popleft()
+                    if not future.done():
+                        future.set_result(result.decode().strip())
+        finally:
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(RuntimeError("Process ended unexpectedly: %s" % self.command))
+
+    async def _log_stderr(self):
+        '''
+        Logs relevant lines from STDERR.
+        '''
+        while True:
+            errors = await self._process.stderr.readline()
+            if not errors:
+                break
+            message = errors.decode()
+            if commander._is_relevant_for_log(message):
+                logging.info(message.strip())
+
+
+async def process_async(processor, line):
+    '''
+    Processes a @param line with an AsyncExternalProcessor without blocking
+    the event loop, or with any other (in-process) processor directly.
+    '''
+    if isinstance(processor, AsyncExternalProcessor):
+        return await processor.process(line)
+    return processor.process(line)
+
+
+def create_processor(command, num_processes=1, asynchronous=False, **kwargs):
+    '''
+    Creates a single ExternalProcessor or, if @param num_processes is greater
+    than 1, an ExternalProcessorPool. Both offer the same interface.
+
+    @param command the command that should be executed on the shell
+    @param asynchronous whether an AsyncExternalProcessor should be created
+        instead, for use in asyncio coroutines (@param num_processes is
+        ignored, lines are in flight concurrently in a single process)
+    @param kwargs further arguments passed to each ExternalProcessor
+    '''
+    if asynchronous:
+        return AsyncExternalProcessor(command, **kwargs)
+    if num_processes > 1:
+        return ExternalProcessorPool(command, size=num_processes, **kwargs)
+    return ExternalProcessor(command, **kwargs)
+
 class _NonBlockingStreamReader:
     '''
     Reads from stream without blocking, even if nothing can be read
@@ -12,6 +12,8 @@ import sys
 import re
 import logging
 
+from collections import defaultdict, deque
+
 class _Replacement(object):
     '''
     Tracks replacements in strings.
@@ -35,6 +37,134 @@ class _Replacement(object):
         self.occurrences.append((replaced, matched))
         return replaced
 
+class _ProtectedPatterns(object):
+    '''
+    Compiles protected patterns into a single alternation with a named group
+    for each pattern, so that a segment is masked in a single scan.
+
+    Masking pattern by pattern lets later patterns see the mask tokens of
+    earlier ones. Whenever this could make a difference, i.e. if a match is
+    not delimited by whitespace, contains the start of a match of an earlier
+    pattern, or if a pattern matches mask tokens, segments are masked
+    pattern by pattern instead, so that the result is always the same.
+    '''
+    def __init__(self, patterns):
+        '''
+        @param patterns an ordered dictionary {mask_token: regex, ...}
+        '''
+        self._masks = list(patterns.keys())
+        self._regexes = [re.compile(regex) for regex in patterns.values()]
+        self._group_indexes = {}
+        self._combined = None
+        self._earlier = []
+
+        if self._can_combine():
+            alternatives = []
+            for index, regex in enumerate(self._regexes):
+                group_name = "mask%d" % index
+                self._group_indexes[group_name] = index
+                alternatives.append("(?P<%s>%s)" % (group_name, regex.pattern))
+                # patterns that are masked before the pattern at index
+                self._earlier.append(
+                    re.compile("|".join(self._regexes[earlier].pattern for earlier in range(index))) if index else None
+                )
+            try:
+                self._combined = re.compile("|".join(alternatives))
+            except re.error:
+                self._combined = None
+
+    def _can_combine(self):
+        '''
+        Determines whether patterns can be combined into a single regular
+            expression. Not possible for patterns with backreferences, or if
+            patterns match mask tokens.
+        '''
+        for regex in self._regexes:
+            if re.search(r"\\[1-9]|\(\?P=", regex.pattern):
+                return False
+            for mask in self._masks:
+                for mask_token in ("__%s__" % mask, "__%s_0123456789__" % mask):
+                    if regex.search(mask_token):
+                        return False
+        return True
+
+    def mask(self, segment, with_id=False):
+        '''
+        Replaces all matches of protected patterns in @param segment with
+            mask tokens.
+        @param with_id whether mask tokens should be numbered, e.g. __xml_0__
+        @return the masked segment and a list of tuples
+            [(mask_token, original_content), ...], ordered by pattern first
+        '''
+        if self._combined is None:
+            return self._mask_sequentially(segment, with_id)
+
+        occurrences = [[] for _ in self._masks]
+        earlier_starts = {}
+        parts = []
+        position = 0
+
+        for match in self._combined.finditer(segment):
+            index = self._group_indexes[match.lastgroup]
+            start, end = match.span()
+            if not self._is_isolated(segment, start, end, index, earlier_starts):
+                return self._mask_sequentially(segment, with_id)
+
+            mask = self._masks[index]
+            if with_id:
+                replaced = "__%s_%d__" % (mask, len(occurrences[index]))
+            else:
+                replaced = "__%s__" % mask
+            occurrences[index].append((replaced, match.group(0)))
+
+            parts.append(segment[position:start])
+            parts.append(replaced)
+            position = end
+
+        if not parts:
+            return segment, []
+        parts.append(segment[position:])
+
+        mapping = []
+        for pattern_occurrences in occurrences:
+            mapping.extend(pattern_occurrences)
+        return "".join(parts), mapping
+
+    def _is_isolated(self, segment, start, end, index, earlier_starts):
+        '''
+        Determines whether the match of the pattern at @param index from
+            @param start to @param end is masked in the same way as when
+            masking pattern by pattern.
+        @param earlier_starts a dictionary {index: (searched_from, match_start)}
+            that caches searches for earlier patterns in @param segment
+        '''
+        if start > 0 and not segment[start - 1].isspace():
+            return False
+        if end < len(segment) and not segment[end].isspace():
+            return False
+
+        earlier = self._earlier[index]
+        if earlier is None:
+            return True
+        searched_from, match_start = earlier_starts.get(index, (None, None))
+        # the leftmost match from a position does not depend on where the search started
+        if searched_from is None or not searched_from <= start <= match_start:
+            earlier_match = earlier.search(segment, start)
+            match_start = earlier_match.start() if earlier_match else len(segment)
+            earlier_starts[index] = (start, match_start)
+        return match_start >= end
+
+    def _mask_sequentially(self, segment, with_id):
+        '''
+        Replaces matches of protected patterns one pattern after the other.
+        '''
+        mapping = []
+        for mask, regex in zip(self._masks, self._regexes):
+            replacement = _Replacement(mask, with_id=with_id)
+            segment = regex.sub(replacement, segment)
+            mapping.extend(replacement.occurrences)
+        return segment, mapping
+
 class Masker(object):
     
     def __init__(self, strategy, escape=True, force_all=True, remove_all=True):
@@ -58,6 +188,18 @@ class Masker(object):
         if not constants.PROTECTED_PATTERNS:
             sys.exit('Masking is not possible because no patterns are defined in PROTECTED_PATTERNS in mtrain/constants.py.')
 
+        self._protected_patterns = _ProtectedPatterns(constants.PROTECTED_PATTERNS)
+
+        # recognize mask tokens without formatting a regex for every pattern
+        masks = "|".join(re.escape(mask) for mask in constants.PROTECTED_PATTERNS.keys())
+        if self._strategy == constants.MASKING_IDENTITY:
+            self._mask_token_regex = re.compile(r"__(?:%s)_\d+__" % masks)
+        else:
+            self._mask_token_regex = None
+        self._mask_tokens = set("__%s__" % mask for mask in constants.PROTECTED_PATTERNS.keys())
+        # finds mask tokens of any strategy in a string
+        self._mask_search_regex = re.compile(r"__(?:%s)(?:_\d+)?__" % masks)
+
     def mask_segment(self, segment, force_mask_translation=False):
         '''
         Introduces mask tokens into segment and escapes characters.
@@ -65,17 +207,12 @@ class Masker(object):
         @param force_mask_translation whether the mask token should
             be wrapped with unsecaped XML for forced decoding
         '''
-        mapping = []
-        
-        for mask_token, regex in constants.PROTECTED_PATTERNS.items():        
-            if self._strategy == constants.MASKING_IDENTITY:
-                replacement = _Replacement(mask_token, with_id=True)
-            # currently, for all other strategies
-            else:
-                replacement = _Replacement(mask_token, with_id=False)
-            segment = re.sub(regex, replacement, segment)
-            mapping.extend(replacement.occurrences)
-        
+        # currently, mask tokens are numbered for identity masking only
+        segment, mapping = self._protected_patterns.mask(
+            segment,
+            with_id=self._strategy == constants.MASKING_IDENTITY
+        )
+
         if self._escape:
             segment = cleaner.escape_special_chars(segment)
     
@@ -116,45 +253,90 @@ class Masker(object):
         Determines whether an input @param token is a mask or not.
         '''
         # make sure token is a string
-        token = str(token)        
-        
-        for mask in constants.PROTECTED_PATTERNS.keys():
-            if self._strategy == constants.MASKING_IDENTITY:
-                 if re.match("__%s_\d+__" % mask, token):
-                    return True
-            else:
-                if token == "__%s__" % mask:
-                    return True
-        return False
+        token = str(token)
+
+        if self._mask_token_regex is not None:
+            return self._mask_token_regex.match(token) is not None
+        return token in self._mask_tokens
 
-    def _first_original(self, mask, mapping):
+    def _index_mapping(self, mapping):
         '''
-        Returns the original that belongs to the first occurrence of
-            @param mask from @param mapping.
-        @return the original and index of this tuple in the mapping
+        Indexes the positions of mask tokens in @param mapping.
+        @return a dictionary {mask_token: deque([index, ...]), ...}, indexes
+            in the order of the mapping
         '''
-        for index, tuple in enumerate(mapping):
-            token, original = tuple
-            if token == mask:
-                return original, index
+        positions = defaultdict(deque)
+        for index, (mask_token, _) in enumerate(mapping):
+            positions[mask_token].append(index)
+        return positions
 
     def _remove_mask_tokens(self, segment):
         '''
         Removes all mask tokens from a string.
         '''
-        normal_tokens = []
-
-        for token in segment.split(" "):    
-            if not self._is_mask_token(token):
-                normal_tokens.append(token)
-
-        return " ".join(normal_tokens)
+        return " ".join(
+            token for token in segment.split(" ") if not self._is_mask_token(token)
+        )
 
     def _unmask_segment_identity(self, target_segment, mapping):
         '''
         Replaces mask tokens in @param target_segment using unique mask
             tokens in @param mapping.
         '''
+        unmasked = self._replace_first_occurrences(target_segment, mapping)
+        if unmasked is None:
+            unmasked = self._replace_first_occurrences_sequentially(target_segment, mapping)
+        target_segment, unused_originals = unmasked
+
+        if self._remove_all and self._mask_in_string(target_segment):
+            target_segment = self._remove_mask_tokens(target_segment)
+
+        if self._force_all and unused_originals:
+            for original in unused_originals:
+                target_segment = " ".join( [target_segment, original] )
+
+        return target_segment
+
+    def _replace_first_occurrences(self, target_segment, mapping):
+        '''
+        Replaces the first occurrence of each mask token in @param mapping
+            with its original content, in a single scan of @param target_segment.
+        @return the unmasked segment and a list of originals whose mask tokens
+            do not occur in the segment, or None if the result could differ
+            from replacing mask tokens one after the other, e.g. if originals
+            contain something that looks like a mask token
+        '''
+        originals = {}
+        for mask_token, original in mapping:
+            if "__" in original or mask_token in originals or \
+                    not self._mask_search_regex.fullmatch(mask_token):
+                return None
+            originals[mask_token] = original
+
+        parts = []
+        position = 0
+        for match in self._mask_search_regex.finditer(target_segment):
+            start, end = match.span()
+            # mask tokens that overlap this one, e.g. in __xml_0__xml_1__
+            if self._mask_search_regex.match(target_segment, end - 2):
+                return None
+            original = originals.pop(match.group(0), None)
+            if original is not None:
+                parts.append(target_segment[position:start])
+                parts.append(original)
+                position = end
+
+        parts.append(target_segment[position:])
+        unused_originals = [original for mask_token, original in mapping if mask_token in originals]
+        return "".join(parts), unused_originals
+
+    def _replace_first_occurrences_sequentially(self, target_segment, mapping):
+        '''
+        Replaces the first occurrence of each mask token in @param mapping
+            with its original content, one mask token after the other.
+        @return the unmasked segment and a list of originals whose mask tokens
+            do not occur in the segment
+        '''
         unused_originals = []
 
         for mask_token, original in mapping:
@@ -165,14 +347,7 @@ class Masker(object):
                 unused_originals.append(original)
             target_segment = unmasked_segment
 
-        if self._remove_all and self._mask_in_string(target_segment):
-            target_segment = self._remove_mask_tokens(target_segment)
-
-        if self._force_all and unused_originals:
-            for original in unused_originals:
-                target_segment = " ".join( [target_segment, original] )
-
-        return target_segment
+        return target_segment, unused_originals
 
     def _unmask_segment_alignment(self, source_segment, target_segment, mapping, alignment):
         '''
@@ -194,6 +369,8 @@ class Masker(object):
         else:
             source_tokens = source_segment.split(" ")
             target_tokens = target_segment.split(" ")
+            mapping_positions = self._index_mapping(mapping)
+            used = [False] * len(mapping)
             # go through source tokens
             for source_index, source_token in enumerate(source_tokens):
                 if self._is_mask_token(source_token):
@@ -207,19 +384,21 @@ class Masker(object):
                             print("source_tokens: %s" % source_tokens)
                             print("target_tokens: %s" % target_tokens)
                             raise
-                        if self._is_mask_token(target_token):
-                            # then, finally reinsert original content
-                            target_tokens[candidate_index], remove_index = self._first_original(source_token, mapping)
-                            del mapping[remove_index]
+                        if self._is_mask_token(target_token) and mapping_positions[source_token]:
+                            # then, finally reinsert original content of the first unused occurrence
+                            mapping_index = mapping_positions[source_token].popleft()
+                            target_tokens[candidate_index] = mapping[mapping_index][1]
+                            used[mapping_index] = True
 
                             # immediately break out, do not check other aligned candidates in the target phrase
                             break
 
+            # remove used entries from the mapping
+            mapping[:] = [entry for entry, is_used in zip(mapping, used) if not is_used]
+
             # if there are still mask tokens in the target segment
             if self._remove_all and self._mask_in_list(target_tokens):
-                  for index, token in reversed(list(enumerate(target_tokens))):
-                    if self._is_mask_token(token):
-                        del target_tokens[index]
+                target_tokens = [token for token in target_tokens if not self._is_mask_token(token)]
             # and if masks are left in the mapping that could not be assigned
             if self._force_all and mapping:
                 for _, original in mapping:
@@ -282,15 +461,15 @@ class Masker(object):
         '''
         
         source_tokens = source_segment.split(" ")
-        target_tokens = target_segment.split(" ")
+        # positions of mask tokens in the target segment that are not aligned yet
+        target_positions = defaultdict(deque)
+        for target_index, target_token in enumerate(target_segment.split(" ")):
+            if self._is_mask_token(target_token):
+                target_positions[target_token].append(target_index)
 
         for source_index, source_token in enumerate(source_tokens):
-            if self._is_mask_token(source_token):
-                for target_index, target_token in enumerate(target_tokens):
-                    if source_token == target_token:
-                        alignment[source_index].append(target_index)
-                        target_tokens[target_index] = "USED"
-                        break
+            if self._is_mask_token(source_token) and target_positions[source_token]:
+                alignment[source_index].append(target_positions[source_token].popleft())
 
         return alignment
 
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+
+"""
+In-process (de-)tokenization compatible with the Moses scripts
+`tokenizer.perl` and `detokenizer.perl`.
+
+Regular expressions are compiled once, nonbreaking prefixes are loaded once
+per language. Unicode properties used by the Perl scripts (e.g. `\\p{IsAlpha}`)
+are derived from `unicodedata`; Perl's Alphabetic property is approximated by
+letters, letter numbers and non-combining marks, which only differs for rare
+combining marks.
+"""
+
+import os
+import re
+import logging
+import threading
+import unicodedata
+
+from mtrain import constants as C
+
+
+######################################
+# Unicode character classes
+######################################
+
+_CHAR_CLASSES = {}
+_CHAR_CLASSES_LOCK = threading.Lock()
+
+# Perl's \s on Unicode strings
+_WHITESPACE = '\t\n\x0b\x0c\r \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000'
+
+def _ranges_to_class(codepoints):
+    '''
+    Turns a sorted list of @param codepoints into the content of a regex
+    character class, e.g. `\\U00000041-\\U0000005a`.
+    '''
+    ranges = []
+    for codepoint in codepoints:
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    return "".join(
+        '\\U%08x' % start if start == end else '\\U%08x-\\U%08x' % (start, end)
+        for start, end in ranges
+    )
+
+def char_classes():
+    '''
+    Returns a dictionary of regex character class contents (without brackets)
+    that correspond to the Perl Unicode properties used by Moses scripts:
+    `alpha`, `alnum`, `n` (numbers), `lower`, `sc` (currency symbols) and
+    `punct` (POSIX punctuation). Computed once, on first use.
+    '''
+    with _CHAR_CLASSES_LOCK:
+        if not _CHAR_CLASSES:
+            members = {name: [] for name in ('alpha', 'alnum', 'n', 'lower', 'sc', 'punct')}
+            for codepoint in range(0x110000):
+                if 0xD800 <= codepoint <= 0xDFFF:
+                    continue # surrogates
+                char = chr(codepoint)
+                category = unicodedata.category(char)
+                is_alpha = (
+                    category[0] == 'L' or category == 'Nl' or
+                    (category in ('Mn', 'Mc') and unicodedata.combining(char) == 0)
+                )
+                if is_alpha:
+                    members['alpha'].append(codepoint)
+                if is_alpha or category == 'Nd':
+                    members['alnum'].append(codepoint)
+                if category[0] == 'N':
+                    members['n'].append(codepoint)
+                if char.islower():
+                    members['lower'].append(codepoint)
+                if category == 'Sc':
+                    members['sc'].append(codepoint)
+                if category[0] == 'P' or char in '$+<=>^`|~':
+                    members['punct'].append(codepoint)
+            for name, codepoints in members.items():
+                _CHAR_CLASSES[name] = _ranges_to_class(codepoints)
+    return _CHAR_CLASSES
+
+
+def _perl_split(pattern, text):
+    '''
+    Splits @param text like Perl's `split`: trailing empty fields are removed.
+    '''
+    fields = re.split(pattern, text) if pattern != ' ' else text.split(' ')
+    while fields and fields[-1] == '':
+        fields.pop()
+    return fields
+
+
+######################################
+# Nonbreaking prefixes
+######################################
+
+_PREFIXES = {}
+_PREFIXES_LOCK = threading.Lock()
+
+def load_nonbreaking_prefixes(lang_code, prefixes_dir=C.MOSES_NONBREAKING_PREFIXES):
+    '''
+    Loads the nonbreaking prefixes of a language, as `tokenizer.perl` does:
+    prefixes map to 1, prefixes that are nonbreaking only before numbers map
+    to 2. Falls back to English if there is no file for @param lang_code.
+    Tables are loaded once per directory and language.
+    '''
+    key = (prefixes_dir, lang_code)
+    with _PREFIXES_LOCK:
+        if key not in _PREFIXES:
+            prefixes = {}
+            path = os.sep.join([prefixes_dir, 'nonbreaking_prefix.%s' % lang_code])
+            if not os.path.exists(path):
+                logging.warning("No known abbreviations for language '%s', attempting fall-back to English version...", lang_code)
+                path = os.sep.join([prefixes_dir, 'nonbreaking_prefix.en'])
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as prefix_file:
+                    for line in prefix_file:
+                        item = line.rstrip('\n')
+                        if not item or item.startswith('#'):
+                            continue
+                        match = re.match(r'(.*)\s+#NUMERIC_ONLY#', item)
+                        if match:
+                            prefixes[match.group(1)] = 2
+                        else:
+                            prefixes[item] = 1
+            else:
+                logging.warning("No abbreviation files found in %s", prefixes_dir)
+            _PREFIXES[key] = prefixes
+        return _PREFIXES[key]
+
+
+######################################
+# Tokenizer
+######################################
+
+_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '|': '&#124;',
+    '<': '&lt;',
+    '>': '&gt;',
+    "'": '&apos;',
+    '"': '&quot;',
+    '[': '&#91;',
+    ']': '&#93;',
+})
+
+class MosesTokenizer(object):
+    '''
+    Tokenizes segments like `tokenizer.perl`. Offers the same `process` and
+    `process_batch` interface as an ExternalProcessor, is thread-safe and
+    needs no lock.
+    '''
+
+    def __init__(self, lang_code, protected_patterns_path=None, aggressive=True, escape=True,
+                 prefixes_dir=C.MOSES_NONBREAKING_PREFIXES):
+        '''
+        @param lang_code language identifier
+        @param protected_patterns_path path to file with patterns that should
+            not be tokenized, one regular expression per line (`-protected`)
+        @param aggressive whether hyphens between alphanumeric characters
+            should be split off (`-a`)
+        @param escape whether characters that break the Moses decoder should
+            be escaped (the opposite of `-no-escape`)
+        @param prefixes_dir directory with nonbreaking prefix files
+        '''
+        self._lang_code = lang_code
+        self._aggressive = aggressive
+        self._escape = escape
+        self._nonbreaking_prefixes = load_nonbreaking_prefixes(lang_code, prefixes_dir)
+
+        self._protected_patterns = []
+        if protected_patterns_path:
+            with open(protected_patterns_path, encoding='utf-8') as patterns_file:
+                # like tokenizer.perl, every line is a pattern, including comments
+                for line in patterns_file:
+                    pattern = line.rstrip('\n')
+                    if pattern:
+                        self._protected_patterns.append(re.compile(pattern))
+
+        self._compile(char_classes())
+
+    def _compile(self, classes):
+        alpha = classes['alpha']
+        alnum = classes['alnum']
+        n = classes['n']
+
+        self._re_whitespace = re.compile('[%s]+' % _WHITESPACE)
+        self._re_control = re.compile('[\x00-\x1f]')
+        self._re_special = re.compile(r"([^%s\s\.'`,\-])" % alnum)
+        self._re_hyphen = re.compile(r'([%s])-(?=[%s])' % (alnum, alnum))
+        self._re_dot_multi = re.compile(r'\.([\.]+)')
+        self._re_dot_multi_next = re.compile(r'DOTMULTI\.([^\.])')
+        self._re_comma_before = re.compile(r'([^%s])[,]' % n)
+        self._re_comma_after = re.compile(r'[,]([^%s])' % n)
+
+        if self._lang_code == 'en':
+            self._contractions = [
+                (re.compile(r"([^%s])[']([^%s])" % (alpha, alpha)), r"\1 ' \2"),
+                (re.compile(r"([^%s%s])[']([%s])" % (alpha, n, alpha)), r"\1 ' \2"),
+                (re.compile(r"([%s])[']([^%s])" % (alpha, alpha)), r"\1 ' \2"),
+                (re.compile(r"([%s])[']([%s])" % (alpha, alpha)), r"\1 '\2"),
+                # special case for "1990's"
+                (re.compile(r"([%s])[']([s])" % n), r"\1 '\2"),
+            ]
+        elif self._lang_code in ('fr', 'it'):
+            self._contractions = [
+                (re.compile(r"([^%s])[']([^%s])" % (alpha, alpha)), r"\1 ' \2"),
+                (re.compile(r"([^%s])[']([%s])" % (alpha, alpha)), r"\1 ' \2"),
+                (re.compile(r"([%s])[']([^%s])" % (alpha, alpha)), r"\1 ' \2"),
+                (re.compile(r"([%s])[']([%s])" % (alpha, alpha)), r"\1' \2"),
+            ]
+        else:
+            self._contractions = [
+                (re.compile(r"'"), " ' "),
+            ]
+
+        self._re_word_with_period = re.compile(r'(\S+)\.')
+        self._re_alpha = re.compile('[%s]' % alpha)
+        self._re_starts_lower = re.compile('[%s]' % classes['lower'])
+        self._re_starts_digits = re.compile('[0-9]+')
+
+    def close(self):
+        pass
+
+    def process(self, line):
+        '''
+        Tokenizes a single line and returns the tokenized line.
+        '''
+        line = line.strip()
+        if not line:
+            return ''
+        return self._tokenize(line).strip()
+
+    def process_batch(self, lines, max_in_flight=None):
+        '''
+        Tokenizes several lines, returns the tokenized lines in order.
+        '''
+        return [self.process(line) for line in lines]
+
+    def _tokenize(self, text):
+        text = " %s " % text
+
+        # remove ASCII junk
+        text = self._re_whitespace.sub(' ', text)
+        text = self._re_control.sub('', text)
+
+        # find protected patterns
+        protected = []
+        for pattern in self._protected_patterns:
+            remainder = text
+            match = pattern.search(remainder)
+            while match and match.end() > match.start():
+                protected.append(match.group(0))
+                remainder = remainder[match.end():]
+                match = pattern.search(remainder)
+        for i, string in enumerate(protected):
+            text = text.replace(string, " THISISPROTECTED%.3d " % i)
+        text = re.sub(' +', ' ', text).strip(' ')
+
+        # separate out all "other" special characters
+        text = self._re_special.sub(r' \1 ', text)
+
+        # aggressive hyphen splitting
+        if self._aggressive:
+            text = self._re_hyphen.sub(r'\1 @-@ ', text)
+
+        # multi-dots stay together
+        text = self._re_dot_multi.sub(r' DOTMULTI\1', text)
+        while 'DOTMULTI.' in text:
+            text = self._re_dot_multi_next.sub(r'DOTDOTMULTI \1', text)
+            text = text.replace('DOTMULTI.', 'DOTDOTMULTI')
+
+        # separate out "," except if within numbers (5,300)
+        text = self._re_comma_before.sub(r'\1 , ', text)
+        text = self._re_comma_after.sub(r' , \1', text)
+
+        # language-specific handling of apostrophes
+        for pattern, replacement in self._contractions:
+            text = pattern.sub(replacement, text)
+
+        # word token method
+        words = _perl_split(' ', text)
+        tokens = []
+        for i, word in enumerate(words):
+            match = self._re_word_with_period.fullmatch(word)
+            if match:
+                prefix = match.group(1)
+                prefix_type = self._nonbreaking_prefixes.get(prefix)
+                has_next = i < len(words) - 1
+                if ('.' in prefix and self._re_alpha.search(prefix)) or \
+                   prefix_type == 1 or \
+                   (has_next and self._re_starts_lower.match(words[i + 1])):
+                    pass # no change
+                elif prefix_type == 2 and has_next and self._re_starts_digits.match(words[i + 1]):
+                    pass # no change
+                else:
+                    word = prefix + " ."
+            tokens.append(word)
+        text = " ".join(tokens)
+
+        # clean up extraneous spaces
+        text = re.sub(' +', ' ', text).strip(' ')
+
+        # restore protected
+        for i, string in enumerate(protected):
+            text = text.replace("THISISPROTECTED%.3d" % i, string)
+
+        # restore multi-dots
+        while 'DOTDOTMULTI' in text:
+            text = text.replace('DOTDOTMULTI', 'DOTMULTI.')
+        text = text.replace('DOTMULTI', '.')
+
+        # escape special chars
+        if self._escape:
+            text = text.translate(_ESCAPE_TABLE)
+
+        return text
+
+
+######################################
+# Detokenizer
+######################################
+
+_DEESCAPE = [
+    ('&bar;', '|'), # factor separator (legacy)
+    ('&#124;', '|'), # factor separator
+    ('&lt;', '<'), # xml
+    ('&gt;', '>'), # xml
+    ('&bra;', '['), # syntax non-terminal (legacy)
+    ('&ket;', ']'), # syntax non-terminal (legacy)
+    ('&quot;', '"'), # xml
+    ('&apos;', "'"), # xml
+    ('&#91;', '['), # syntax non-terminal
+    ('&#93;', ']'), # syntax non-terminal
+    ('&amp;', '&'), # escape escape
+]
+
+_FINNISH_CASE_SUFFIX = re.compile(
+    r'(N|n|A|a|Ä|ä|ssa|Ssa|ssä|Ssä|sta|stä|Sta|Stä|hun|Hun|hyn|Hyn|han|Han|hän|Hän|hön|Hön|un|Un|yn|Yn|an|An|än|Än|ön|Ön|seen|Seen|lla|Lla|llä|Llä|lta|Lta|ltä|Ltä|lle|Lle|ksi|Ksi|kse|Kse|tta|Tta|ine|Ine)(ni|si|mme|nne|nsa)?(ko|kö|han|hän|pa|pä|kaan|kään|kin)?'
+)
+
+def _is_cjk(char):
+    '''
+    Returns True if @param char is a CJK (Chinese/Japanese/Korean) character,
+    using the same code point ranges as `detokenizer.perl`.
+    '''
+    codepoint = ord(char)
+    return (
+        0x1100 <= codepoint <= 0x11FF or
+        0x2E80 <= codepoint <= 0xA4CF or
+        0xA840 <= codepoint <= 0xA87F or
+        0xAC00 <= codepoint <= 0xD7AF or
+        0xF900 <= codepoint <= 0xFAFF or
+        0xFE30 <= codepoint <= 0xFE4F or
+        0xFF65 <= codepoint <= 0xFFDC or
+        0x20000 <= codepoint <= 0x2FFFF
+    )
+
+class MosesDetokenizer(object):
+    '''
+    Detokenizes segments like `detokenizer.perl`. Offers the same `process`
+    and `process_batch` interface as an ExternalProcessor, is thread-safe and
+    needs no lock.
+    '''
+
+    def __init__(self, lang_code, uppercase_first_letter=False):
+        '''
+        @param lang_code language identifier
+        @param uppercase_first_letter whether or not to uppercase the first
+            letter in the detokenized output (`-u`)
+        '''
+        self._lang_code = lang_code
+        self._uppercase_first_letter = uppercase_first_letter
+        if lang_code not in ('cs', 'en', 'fr', 'it', 'fi'):
+            logging.info("Warning: No built-in rules for language %s.", lang_code)
+
+        classes = char_classes()
+        self._re_markup_line = re.compile(r'<.+>')
+        self._re_right_shift = re.compile(r'[%s\(\[\{¿¡]+' % classes['sc'])
+        self._re_left_shift = re.compile(r'[,\.\?!:;\\%\}\]\)]+')
+        self._re_fr_punctuation = re.compile(r'[\?!:;\\%]')
+        self._re_starts_apostrophe_alpha = re.compile(r"['][%s]" % classes['alpha'])
+        self._re_ends_alnum = re.compile(r'[%s]$' % classes['alnum'])
+        self._re_digits = re.compile(r'[0-9]+')
+        self._re_dot_comma = re.compile(r'[.,]')
+        self._re_ends_alpha_apostrophe = re.compile(r"[%s][']$" % classes['alpha'])
+        self._re_starts_alpha = re.compile(r'[%s]' % classes['alpha'])
+        self._re_ends_alpha = re.compile(r'[%s]$' % classes['alpha'])
+        self._re_dash = re.compile(r'[-–]')
+        self._re_li_mail = re.compile(r'^li$|^mail.*', re.IGNORECASE)
+        self._re_quotes = re.compile(r'[\'"„“`]+')
+        self._re_normalized_double_quotes = re.compile(r'[„“”]+')
+        self._re_uppercase_first = re.compile(r'^([%s%s]*)([%s])' % (classes['punct'], _WHITESPACE, classes['alpha']))
+
+    def close(self):
+        pass
+
+    def process(self, line):
+        '''
+        Detokenizes a single line and returns the detokenized line.
+        '''
+        line = line.strip()
+        if not line or self._re_markup_line.fullmatch(line):
+            # don't try to detokenize XML/HTML tag lines
+            return line
+        return self._detokenize(line).strip()
+
+    def process_batch(self, lines, max_in_flight=None):
+        '''
+        Detokenizes several lines, returns the detokenized lines in order.
+        '''
+        return [self.process(line) for line in lines]
+
+    def _detokenize(self, text):
+        language = self._lang_code
+        text = " %s " % text
+        text = text.replace(' @-@ ', '-')
+        for escaped, char in _DEESCAPE:
+            text = text.replace(escaped, char)
+
+        words = _perl_split(' ', text)
+        num_words = len(words)
+        text = ""
+        quote_count = {"'": 0, '"': 0}
+        prepend_space = " "
+        i = 0
+        while i < num_words:
+            word = words[i]
+            if word and _is_cjk(word[0]):
+                if i > 0 and words[i - 1] and _is_cjk(words[i - 1][-1]):
+                    # perform left shift if this is a second consecutive CJK word
+                    text += word
+                else:
+                    text += prepend_space + word
+                prepend_space = " "
+            elif self._re_right_shift.fullmatch(word):
+                # perform right shift on currency and other random punctuation items
+                text += prepend_space + word
+                prepend_space = ""
+            elif self._re_left_shift.fullmatch(word):
+                if language == 'fr' and self._re_fr_punctuation.fullmatch(word):
+                    # these punctuations are prefixed with a non-breakable space in french
+                    text += " "
+                # perform left shift on punctuation items
+                text += word
+                prepend_space = " "
+            elif language == 'en' and i > 0 and self._re_starts_apostrophe_alpha.match(word) and self._re_ends_alnum.search(words[i - 1]):
+                # left-shift the contraction for English
+                text += word
+                prepend_space = " "
+            elif language == 'cs' and i > 1 and self._re_digits.fullmatch(words[i - 2]) and self._re_dot_comma.fullmatch(words[i - 1]) and self._re_digits.fullmatch(word):
+                # left-shift floats in Czech
+                text += word
+                prepend_space = " "
+            elif language in ('fr', 'it') and i <= num_words - 2 and self._re_ends_alpha_apostrophe.search(word) and self._re_starts_alpha.match(words[i + 1]):
+                # right-shift the contraction for French and Italian
+                text += prepend_space + word
+                prepend_space = ""
+            elif language == 'cs' and i < num_words - 3 and self._re_ends_alpha.search(word) and self._re_dash.fullmatch(words[i + 1]) and self._re_li_mail.search(words[i + 2]):
+                # right-shift "-li" in Czech and a few Czech dashed words (e-mail)
+                text += prepend_space + word + words[i + 1]
+                i += 1 # advance over the dash
+                prepend_space = ""
+            elif self._re_quotes.fullmatch(word):
+                # combine punctuation smartly
+                normalized_quote = '"' if self._re_normalized_double_quotes.fullmatch(word) else word
+                quote_count.setdefault(normalized_quote, 0)
+                if language == 'cs' and word == "„":
+                    # this is always the starting quote in Czech
+                    quote_count[normalized_quote] = 0
+                if language == 'cs' and word == "“":
+                    # this is usually the ending quote in Czech
+                    quote_count[normalized_quote] = 1
+                if quote_count[normalized_quote] % 2 == 0:
+                    if language == 'en' and word == "'" and i > 0 and words[i - 1].endswith('s'):
+                        # single quote for posesssives ending in s... "The Jones' house"
+                        text += word
+                        prepend_space = " "
+                    else:
+                        # right shift
+                        text += prepend_space + word
+                        prepend_space = ""
+                        quote_count[normalized_quote] += 1
+                else:
+                    # left shift
+                    text += word
+                    prepend_space = " "
+                    quote_count[normalized_quote] += 1
+            elif language == 'fi' and words[i - 1].endswith(':') and _FINNISH_CASE_SUFFIX.fullmatch(word):
+                # Finnish : without intervening space if followed by case suffix
+                text += word.lower()
+                prepend_space = " "
+            else:
+                text += prepend_space + word
+                prepend_space = " "
+            i += 1
+
+        # clean up spaces at head and tail of each line as well as any double-spacing
+        text = re.sub(' +', ' ', text)
+        if text.startswith(' '):
+            text = text[1:]
+        if text.endswith(' '):
+            text = text[:-1]
+
+        if self._uppercase_first_letter:
+            text = self._re_uppercase_first.sub(lambda m: m.group(1) + m.group(2).upper(), text, count=1)
+
+        return text
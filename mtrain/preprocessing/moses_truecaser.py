@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+"""
+In-process truecasing and detruecasing compatible with the Moses scripts
+`truecase.perl` and `detruecase.perl`.
+
+A truecasing model is either loaded from the text file written by
+`train-truecaser.perl` into two dictionaries, or memory-mapped from a
+precompiled binary form (see `compile_model`) that several processes can
+share. Both are read-only after loading, so truecasers need no lock.
+"""
+
+import os
+import re
+import mmap
+import struct
+import bisect
+
+from mtrain import constants as C
+
+
+######################################
+# Truecasing models
+######################################
+
+# words that end a sentence, or are skipped before a sentence starts
+_SENTENCE_END = frozenset(['.', ':', '?', '!'])
+_DELAYED_SENTENCE_START = frozenset(['(', '[', '"', "'", '&apos;', '&quot;', '&#91;', '&#93;'])
+
+_BINARY_MAGIC = b'MTRAINTC'
+_BINARY_HEADER = struct.Struct('<II') # number of best forms, number of known forms
+
+def read_model(path_model):
+    '''
+    Reads a truecasing model written by `train-truecaser.perl`. Returns a
+    dictionary that maps lowercased words to their best casing, and a set of
+    all known casings, as `truecase.perl` does.
+    '''
+    best = {}
+    known = set()
+    with open(path_model, encoding='utf-8') as model_file:
+        for line in model_file:
+            fields = line.split()
+            if not fields:
+                continue
+            word, options = fields[0], fields[1:]
+            best[word.lower()] = word
+            known.add(word)
+            # options alternate between counts and alternative casings
+            for i in range(1, len(options) - 1, 2):
+                known.add(options[i])
+    return best, known
+
+class TruecasingModel(object):
+    '''
+    Truecasing model held in memory as a dictionary and a set.
+    '''
+
+    def __init__(self, best, known):
+        '''
+        @param best dictionary from lowercased words to their best casing
+        @param known set of known casings
+        '''
+        self._best = best
+        self._known = known
+
+    @classmethod
+    def load(cls, path_model):
+        '''
+        Loads the text model at @param path_model.
+        '''
+        return cls(*read_model(path_model))
+
+    def best(self, lowercased_word):
+        '''
+        Returns the best casing of @param lowercased_word, or None.
+        '''
+        return self._best.get(lowercased_word)
+
+    def is_known(self, word):
+        return word in self._known
+
+    def close(self):
+        pass
+
+def _write_table(binary_file, strings):
+    '''
+    Writes a table of UTF-8 encoded @param strings: offsets, then contents.
+    '''
+    offsets = [0]
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+    binary_file.write(struct.pack('<%dI' % len(offsets), *offsets))
+    data = b''.join(strings)
+    # pad to keep the offsets of the next table aligned
+    binary_file.write(data + b'\0' * (-len(data) % 4))
+
+def compile_model(path_model, path_binary=None):
+    '''
+    Writes the text model at @param path_model in a binary form that can be
+    memory-mapped with `MappedTruecasingModel`. Keys are sorted by their
+    UTF-8 encoding, so that they can be searched in place.
+
+    @param path_binary path of the binary model, by default @param
+        path_model with C.TRUECASING_BINARY_MODEL_SUFFIX
+    '''
+    if path_binary is None:
+        path_binary = path_model + C.TRUECASING_BINARY_MODEL_SUFFIX
+    best, known = read_model(path_model)
+    best_items = sorted((key.encode('utf-8'), value.encode('utf-8')) for key, value in best.items())
+    known_items = sorted(word.encode('utf-8') for word in known)
+    path_temp = path_binary + '.tmp'
+    with open(path_temp, 'wb') as binary_file:
+        binary_file.write(_BINARY_MAGIC)
+        binary_file.write(_BINARY_HEADER.pack(len(best_items), len(known_items)))
+        _write_table(binary_file, [key for key, _ in best_items])
+        _write_table(binary_file, [value for _, value in best_items])
+        _write_table(binary_file, known_items)
+    # readers never see a partially written model
+    os.replace(path_temp, path_binary)
+    return path_binary
+
+class _MappedTable(object):
+    '''
+    Sorted table of strings in a memory-mapped binary model, indexable and
+    searchable without decoding the whole table.
+    '''
+
+    def __init__(self, buffer, position, length):
+        offsets_size = (length + 1) * 4
+        self._offsets = buffer[position:position + offsets_size].cast('I')
+        self._data = buffer[position + offsets_size:]
+        self._length = length
+        data_size = self._offsets[length]
+        self.end = position + offsets_size + data_size + (-data_size % 4)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]])
+
+    def index(self, key):
+        '''
+        Returns the position of @param key, or -1 if it is not in the table.
+        '''
+        i = bisect.bisect_left(self, key)
+        if i < self._length and self[i] == key:
+            return i
+        return -1
+
+    def release(self):
+        self._offsets.release()
+        self._data.release()
+
+class MappedTruecasingModel(object):
+    '''
+    Truecasing model memory-mapped from a file written by `compile_model`.
+    The operating system shares its pages between all processes that map
+    the same file.
+    '''
+
+    def __init__(self, path_binary):
+        '''
+        @param path_binary path to a binary truecasing model
+        '''
+        with open(path_binary, 'rb') as binary_file:
+            self._mmap = mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_BINARY_MAGIC)] != _BINARY_MAGIC:
+            self._mmap.close()
+            raise IOError("Not a binary truecasing model: %s" % path_binary)
+        self._buffer = memoryview(self._mmap)
+        position = len(_BINARY_MAGIC)
+        num_best, num_known = _BINARY_HEADER.unpack_from(self._mmap, position)
+        position += _BINARY_HEADER.size
+        self._best_keys = _MappedTable(self._buffer, position, num_best)
+        self._best_values = _MappedTable(self._buffer, self._best_keys.end, num_best)
+        self._known = _MappedTable(self._buffer, self._best_values.end, num_known)
+
+    def best(self, lowercased_word):
+        '''
+        Returns the best casing of @param lowercased_word, or None.
+        '''
+        i = self._best_keys.index(lowercased_word.encode('utf-8'))
+        if i < 0:
+            return None
+        return self._best_values[i].decode('utf-8')
+
+    def is_known(self, word):
+        return self._known.index(word.encode('utf-8')) >= 0
+
+    def close(self):
+        for table in (self._best_keys, self._best_values, self._known):
+            table.release()
+        self._buffer.release()
+        self._mmap.close()
+
+def load_model(path_model):
+    '''
+    Loads the truecasing model at @param path_model. Memory-maps its binary
+    form if there is one that is at least as recent as the text model.
+    '''
+    path_binary = path_model + C.TRUECASING_BINARY_MODEL_SUFFIX
+    if os.path.exists(path_binary) and (
+            not os.path.exists(path_model) or
+            os.path.getmtime(path_binary) >= os.path.getmtime(path_model)):
+        return MappedTruecasingModel(path_binary)
+    return TruecasingModel.load(path_model)
+
+
+######################################
+# Truecaser
+######################################
+
+# XML tags, and words that may contain '<' or '>', as split by `truecase.perl`
+_XML_OR_WORD = re.compile(r'\s*(?:(<\S[^>]*>)|([^\s<>]+)|(\S+))')
+_NON_WHITESPACE = re.compile(r'\S')
+_PIPES = re.compile(r'\|+')
+
+def _split_xml(line):
+    '''
+    Splits @param line into words and the markup before each word, like
+    `split_xml` in `truecase.perl`. There is one more markup item than words.
+    '''
+    words = []
+    markup = ['']
+    position = 0
+    while _NON_WHITESPACE.search(line, position):
+        match = _XML_OR_WORD.match(line, position)
+        position = match.end()
+        tag, word = match.group(1), match.group(2) or match.group(3)
+        if tag:
+            if not line[match.start()].isspace() and words and words[-1].endswith('|'):
+                # exception for factor that is an XML tag
+                words[-1] += tag
+                pipes = _PIPES.match(line, position)
+                if pipes:
+                    words[-1] += pipes.group(0)
+                    position = pipes.end()
+            else:
+                markup[-1] += tag + ' '
+        else:
+            words.append(word)
+            markup.append('')
+    markup[-1] = markup[-1][:-1]
+    return words, markup
+
+class MosesTruecaser(object):
+    '''
+    Truecases segments like `truecase.perl`. Offers the same `process` and
+    `process_batch` interface as an ExternalProcessor.
+    '''
+
+    def __init__(self, path_model):
+        '''
+        @param path_model path to truecasing model trained in `mtrain`
+        '''
+        self._model = load_model(path_model)
+
+    def close(self):
+        self._model.close()
+
+    def process(self, line):
+        '''
+        Truecases a single line and returns the truecased line.
+        '''
+        words, markup = _split_xml(line.rstrip('\n'))
+        model = self._model
+        output = []
+        sentence_start = True
+        for i, token in enumerate(words):
+            if i and markup[i] == '':
+                output.append(' ')
+            output.append(markup[i])
+
+            # factors other than the surface form are kept as they are
+            factor_position = token.find('|')
+            if factor_position > 0:
+                word, other_factors = token[:factor_position], token[factor_position:]
+            else:
+                word, other_factors = token, ''
+
+            best = model.best(word.lower())
+            if best is not None and (sentence_start or not model.is_known(word)):
+                output.append(best)
+            else:
+                output.append(word)
+            output.append(other_factors)
+
+            if word in _SENTENCE_END:
+                sentence_start = True
+            elif word not in _DELAYED_SENTENCE_START:
+                sentence_start = False
+        output.append(markup[-1])
+        return ''.join(output)
+
+    def process_batch(self, lines, max_in_flight=None):
+        '''
+        Truecases several lines, returns the truecased lines in order.
+        '''
+        return [self.process(line) for line in lines]
+
+
+######################################
+# Detruecaser
+######################################
+
+class MosesDetruecaser(object):
+    '''
+    Detruecases segments like `detruecase.perl`: uppercases the first letter
+    of every sentence. Offers the same `process` and `process_batch`
+    interface as an ExternalProcessor.
+    '''
+
+    def close(self):
+        pass
+
+    def process(self, line):
+        '''
+        Detruecases a single line and returns the detruecased line.
+        '''
+        words = line.split()
+        sentence_start = True
+        for i, word in enumerate(words):
+            if sentence_start:
+                word = words[i] = word[:1].upper() + word[1:]
+            if word in _SENTENCE_END:
+                sentence_start = True
+            elif word not in _DELAYED_SENTENCE_START:
+                sentence_start = False
+        return " ".join(words)
+
+    def process_batch(self, lines, max_in_flight=None):
+        '''
+        Detruecases several lines, returns the detruecased lines in order.
+        '''
+        return [self.process(line) for line in lines]
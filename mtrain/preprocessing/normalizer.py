@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from mtrain import constants as C
-from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.preprocessing.external import create_processor
 
 """
 Normalize punctuation using the default Moses normalizer script.
@@ -14,9 +14,10 @@ class Normalizer(object):
     interaction with a normalizer process kept in memory.
     """
 
-    def __init__(self, lang_code):
+    def __init__(self, lang_code, num_processes=1):
         """
         @param lang_code language identifier
+        @param num_processes number of normalizer processes kept in memory
         """
         arguments = [
             '-l %s' % lang_code,
@@ -24,8 +25,9 @@ class Normalizer(object):
             '-q',  # don't report version
         ]   # no aggressive mode '-a' for normalizer
 
-        self._processor = ExternalProcessor(
-            command=" ".join([C.MOSES_NORMALIZER] + arguments)
+        self._processor = create_processor(
+            command=" ".join([C.MOSES_NORMALIZER] + arguments),
+            num_processes=num_processes
         )
 
     def close(self):
@@ -37,3 +39,9 @@ class Normalizer(object):
         """
         normalized_segment = self._processor.process(segment)
         return normalized_segment
+
+    def normalize_batch(self, segments):
+        """
+        Normalizes punctuation characters of a list of @param segments.
+        """
+        return self._processor.process_batch(segments)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from mtrain.constants import *
-from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.preprocessing.external import create_processor, process_async
 
 '''
 Recases segments using a Moses recaser engine.
@@ -13,18 +13,27 @@ class Recaser(object):
     interaction with a Moses recaser engine kept in memory.
     '''
 
-    def __init__(self, path_moses_ini):
+    def __init__(self, path_moses_ini, num_processes=1, asynchronous=False):
+        '''
+        @param path_moses_ini path to the Moses configuration of the recaser
+        @param num_processes number of recaser engines kept in memory
+        @param asynchronous whether the recaser engine is used from asyncio
+            coroutines, through `recase_async`
+        '''
         arguments = [
             '-f %s' % path_moses_ini,
             '-dl 0',
             '-minphr-memory',
             '-v 0',
         ]
-        self._processor = ExternalProcessor(
-            command=" ".join([MOSES] + arguments)
+        self._processor = create_processor(
+            command=" ".join([MOSES] + arguments),
+            num_processes=num_processes,
+            asynchronous=asynchronous
         )
 
     def close(self):
+        self._processor.close()
         del self._processor
 
     def recase(self, segment):
@@ -33,8 +42,20 @@ class Recaser(object):
         '''
         return self._processor.process(segment)
 
+    async def recase_async(self, segment):
+        '''
+        Recases a single segment in an asyncio coroutine.
+        '''
+        return await process_async(self._processor, segment)
+
     def recase_tokens(self, tokens):
         '''
         Recases a list of tokens.
         '''
         return self.recase(" ".join(tokens)).split(" ")
+
+    def recase_batch(self, segments):
+        '''
+        Recases a list of segments.
+        '''
+        return self._processor.process_batch(segments)
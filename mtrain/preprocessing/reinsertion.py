@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 
 from mtrain.constants import *
+from mtrain.preprocessing import xmlsyntax
 
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from lxml import etree
 
 import xml.sax
+import xml.sax.saxutils
+import functools
 import re
 import sys
 
@@ -31,67 +35,50 @@ class Reinserter(object):
     def _next_source_tag_region(self, source_tokens):
         '''
         Generates lists of source token indexes that are bounded by an opening
-            and closing tag.
+            and closing tag, pairing tags with a stack in a single pass. Regions
+            are generated in the order of their closing tags.
         @return a list of indexes if a region is found, until the generator is exhausted
         '''
-        while _tag_in_list(source_tokens):
-            current_indexes = []
-            current_opening_tag = None        
-            tags_seen_offset = 0
-            
-            for source_index, source_token in enumerate(source_tokens):
-                if _is_selfclosing_tag(source_token):
-                    # yield and break, no content
-                    del source_tokens[source_index]
-                    yield (source_index - tags_seen_offset, source_token), [], None
-                    break
-                elif _is_closing_tag(source_token):
-                    # delete this pair of tags from the source
-                    del source_tokens[source_index]
-                    try:
-                        del source_tokens[current_opening_tag[0]]
-                    except TypeError:
-                        print(source_tokens)
-                        sys.exit()
-                    # then yield, because the closing tag is bound to correspond to
-                    # the most recent opening tag
-                    yield (current_opening_tag[0] - tags_seen_offset, current_opening_tag[1]), \
-                        current_indexes, (source_index - tags_seen_offset, source_token)
-                    break            
-                elif _is_opening_tag(source_token):
-                    tags_seen_offset += 1
-                    # then reset current indexes and tags
-                    current_indexes = []
-                    current_opening_tag = source_index, source_token
-                else:
-                    if current_opening_tag:
-                        # then add to indexes
-                        current_indexes.append(source_index - tags_seen_offset)
-                    # else, do nothing; not yet in a source tag region
+        # opening tags that are not closed yet, with the number of text tokens before them
+        open_tags = []
+        num_text_tokens = 0
+
+        for source_token, token_class in zip(source_tokens, _classify_tokens(source_tokens)):
+            if token_class == _SELFCLOSING_TAG:
+                # no content
+                yield (num_text_tokens, source_token), [], None
+            elif token_class == _CLOSING_TAG:
+                if not open_tags:
+                    print(source_tokens)
+                    sys.exit()
+                # the closing tag is bound to correspond to the most recent opening tag
+                opening_tag, text_tokens_before_opening = open_tags.pop()
+                yield (text_tokens_before_opening - 1, opening_tag), \
+                    list(range(text_tokens_before_opening, num_text_tokens)), (num_text_tokens, source_token)
+            elif token_class == _OPENING_TAG:
+                open_tags.append((source_token, num_text_tokens))
+            else:
+                num_text_tokens += 1
 
-    def _find_source_phrase_regions(self, source_tag_region, segmentation):
+    def _find_source_phrase_regions(self, source_tag_region, phrase_index):
         '''
         Given a source tag region and segmentation, determines the source phrases
             the source tag region is in.
-        @param source_tag_region a list of indexes that identify a source tag region
-        @param segmentation phrase segmentation reported by Moses, a dictionary
-            where keys are tuples of source spans
-        @return a sorted list of tuples, a subset of @param segmentation
+        @param source_tag_region a list of contiguous indexes that identify a
+            source tag region
+        @param phrase_index a _SourcePhraseIndex of the phrase segmentation
+        @return a sorted list of tuples, a subset of the segmentation
         '''
-        source_phrase_region = []
+        overlapping = set(phrase_index.overlapping(source_tag_region[0], source_tag_region[-1]))
+        if not overlapping:
+            return []
 
-        for start, end in segmentation:
-            phrase_collected = False
-            # one of the tokens of the source tag region in this phrase?
-            for index in source_tag_region:
-                if int(start) <= index <= int(end):
-                    source_phrase_region.append( (start, end) )
-                    phrase_collected = True
-                    # break early because there is enough evidence already
-                    break
-            if source_phrase_region and not phrase_collected:
-                # break early because source phrase region must be contiguous
-                break
+        # source phrase region must be contiguous in the order of the segmentation
+        source_phrase_region = []
+        position = min(overlapping)
+        while position in overlapping:
+            source_phrase_region.append(phrase_index.phrases[position])
+            position += 1
 
         return sorted(source_phrase_region)
 
@@ -154,6 +141,7 @@ class Reinserter(object):
         '''
         source_tokens = tokenize_keep_markup(source_segment)
         target_tokens = target_segment.split(" ")
+        phrase_index = _SourcePhraseIndex(segmentation)
 
         changes = []
         
@@ -180,7 +168,7 @@ class Reinserter(object):
             else:
                 closing_tag = closing[1]
 
-                source_phrase_regions = self._find_source_phrase_regions(source_tag_region, segmentation)
+                source_phrase_regions = self._find_source_phrase_regions(source_tag_region, phrase_index)
                 target_covering_phrases = self._find_target_covering_phrases(source_phrase_regions, segmentation)
 
                 if self._str_spr_coincide(source_tag_region, source_phrase_regions):
@@ -228,6 +216,7 @@ class Reinserter(object):
                         # find leftmost and rightmost TCP
                         left_start, left_end = min(target_covering_phrases, key=lambda x: x[0])
                         right_start, right_end = max(target_covering_phrases, key=lambda x: x[1])
+                        relevant_alignments = set(relevant_alignments)
 
                         for index in range(left_start, left_end+1):
                             if index in relevant_alignments:
@@ -238,11 +227,7 @@ class Reinserter(object):
                                 changes.append( (index, closing_tag) )
                                 break
 
-        # then, actually make changes in reverse order
-        for insert_at, tag in sorted(changes, key=lambda x: x[0], reverse=True):
-            target_tokens.insert(insert_at, tag)
-
-        return " ".join(target_tokens)
+        return " ".join(_apply_changes(target_tokens, changes))
 
     def _reinsert_markup_segmentation(self, source_segment, target_segment, segmentation):
         '''
@@ -397,47 +382,150 @@ class Reinserter(object):
                 "Reinsertion strategy '%s' is unknown." % self._reinsertion_strategy
                 )
 
+_OPENING_TAG_REGEX = re.compile(r'<[a-zA-Z_][^<>\/]*(".*")?[^\/<>]*>')
+_CLOSING_TAG_REGEX = re.compile(r"<\/[a-zA-Z_][^\/<> ]* *>")
+_SELFCLOSING_TAG_REGEX = re.compile(r"<[a-zA-Z_][^\/<>]*\/>")
+_XML_COMMENT_REGEX = re.compile(r"<!\-\-[^<>]*\-\->")
+_MARKUP_REGEX = re.compile(r"<[^<>]+>")
+
+# token classes
+_TEXT = 0
+_OPENING_TAG = 1
+_CLOSING_TAG = 2
+_SELFCLOSING_TAG = 3
+
+def _classify_token(token):
+    '''
+    Determines whether @param token is text, or an opening, closing or
+        self-closing tag. Tokens that look like both an opening and a
+        self-closing tag are self-closing tags.
+    '''
+    # all tags start with "<"
+    if not token.startswith("<"):
+        return _TEXT
+    if _SELFCLOSING_TAG_REGEX.match(token):
+        return _SELFCLOSING_TAG
+    if _CLOSING_TAG_REGEX.match(token):
+        return _CLOSING_TAG
+    if _OPENING_TAG_REGEX.match(token):
+        return _OPENING_TAG
+    return _TEXT
+
+def _classify_tokens(tokens):
+    '''
+    Classifies each token in @param tokens, see `_classify_token`.
+    @return a list of token classes, one for each token
+    '''
+    return [_classify_token(token) for token in tokens]
+
+class _SourcePhraseIndex(object):
+    '''
+    Indexes the source spans of a phrase segmentation, so that the phrases
+        overlapping a source span are found with binary search.
+    '''
+    def __init__(self, segmentation):
+        '''
+        @param segmentation phrase segmentation reported by Moses, a dictionary
+            where keys are tuples of source spans
+        '''
+        # source spans in the order of the segmentation
+        self.phrases = list(segmentation.keys())
+        self._spans = [(int(start), int(end)) for start, end in self.phrases]
+
+        self._sorted_positions = sorted(range(len(self._spans)), key=lambda position: self._spans[position])
+        self._starts = [self._spans[position][0] for position in self._sorted_positions]
+        self._ends = [self._spans[position][1] for position in self._sorted_positions]
+        # spans reported by Moses never overlap, then their ends are sorted as well
+        self._disjoint = all(start <= end for start, end in self._spans) and \
+            all(self._starts[i + 1] > self._ends[i] for i in range(len(self._spans) - 1))
+
+    def overlapping(self, first, last):
+        '''
+        Finds the phrases that contain at least one of the source indexes from
+            @param first to @param last.
+        @return the positions of these phrases in the segmentation
+        '''
+        if not self._disjoint:
+            return [
+                position for position, (start, end) in enumerate(self._spans)
+                if max(start, first) <= min(end, last)
+            ]
+        lower = bisect_left(self._ends, first)
+        upper = bisect_right(self._starts, last)
+        return [self._sorted_positions[i] for i in range(lower, upper)]
+
+def _apply_changes(tokens, changes):
+    '''
+    Inserts tags into @param tokens in a single left-to-right pass. The result
+        is the same as inserting them one after the other, in reverse order of
+        their positions.
+    @param changes a list of tuples (position, tag)
+    @return a new list of tokens
+    '''
+    changes = sorted(changes, key=lambda x: x[0], reverse=True)
+    if changes and changes[-1][0] < 0:
+        # negative positions are relative to the end of the list
+        tokens = list(tokens)
+        for insert_at, tag in changes:
+            tokens.insert(insert_at, tag)
+        return tokens
+
+    num_tokens = len(tokens)
+    inserted_before = defaultdict(list)
+    # tags inserted after the last token
+    tail = []
+
+    for insert_at, tag in changes:
+        if insert_at >= num_tokens:
+            tail.insert(min(insert_at - num_tokens, len(tail)), tag)
+        else:
+            inserted_before[insert_at].append(tag)
+
+    output_tokens = []
+    for index, token in enumerate(tokens):
+        if index in inserted_before:
+            # tags inserted at the same position end up in reverse order
+            output_tokens.extend(reversed(inserted_before[index]))
+        output_tokens.append(token)
+    output_tokens.extend(tail)
+
+    return output_tokens
+
 def _is_opening_tag(token):
     '''
     Determines whether @param token is the opening tag of an XML element.
     '''
-    return bool( re.match(r'<[a-zA-Z_][^<>\/]*(".*")?[^\/<>]*>', token) )
+    return bool( _OPENING_TAG_REGEX.match(token) )
 
 def _is_closing_tag(token):
     '''
     Determines whether @param token is the closing tag of an XML element.
     '''
-    return bool( re.match(r"<\/[a-zA-Z_][^\/<> ]* *>", token) )
+    return bool( _CLOSING_TAG_REGEX.match(token) )
 
 def _is_selfclosing_tag(token):
     '''
     Determines whether @param token is a self-closing XML element.
     '''
-    return bool( re.match(r"<[a-zA-Z_][^\/<>]*\/>", token) )
+    return bool( _SELFCLOSING_TAG_REGEX.match(token) )
 
 def is_xml_tag(token):
     '''
     Determines whether @param token is an XML element tag.
     '''
-    if _is_opening_tag(token) or _is_closing_tag(token) or _is_selfclosing_tag(token):
-        return True
-    else:
-        return False
+    return _classify_token(token) != _TEXT
 
 def _is_xml_comment(token):
     '''
     Determines whether @param token is an XML comment.
     '''
-    return bool( re.match(r"<!\-\-[^<>]*\-\->", token) )
+    return bool( _XML_COMMENT_REGEX.match(token) )
 
 def _tag_in_list(tokens):
     '''
     Returns True if any token in the list is a tag.
     '''
-    for token in tokens:
-        if _is_opening_tag(token) or _is_closing_tag(token) or _is_selfclosing_tag(token):
-            return True
-    return False
+    return any(_classify_token(token) != _TEXT for token in tokens)
 
 def _element_names_identical(opening_tag, closing_tag):
     '''
@@ -470,7 +558,7 @@ def _tag_indexes_from_tokens(source_tokens):
     tags_seen_offset = 0
 
     for source_index, source_token in enumerate(source_tokens):
-        if re.match("<[^<>]+>", source_token):
+        if _MARKUP_REGEX.match(source_token):
             elements_by_position[source_index - tags_seen_offset].append(source_token)
             tags_seen_offset += 1
         # else: do nothing
@@ -488,11 +576,11 @@ def _tag_indexes_from_tokens_segmentation(source_tokens):
 
     tags_seen_offset = 0
 
-    for source_index, source_token in enumerate(source_tokens):
-        if _is_opening_tag(source_token) or _is_selfclosing_tag(source_token):
+    for source_index, (source_token, token_class) in enumerate(zip(source_tokens, _classify_tokens(source_tokens))):
+        if token_class in (_OPENING_TAG, _SELFCLOSING_TAG):
             opening_elements_by_position[source_index - tags_seen_offset].append(source_token)
             tags_seen_offset += 1
-        elif _is_closing_tag(source_token):
+        elif token_class == _CLOSING_TAG:
             closing_elements_by_position[source_index - tags_seen_offset - 1].append(source_token)
             tags_seen_offset += 1
         # else: do nothing
@@ -567,13 +655,176 @@ def _get_string_from_attrs(attrs):
         ['%s=%s' % (key, xml.sax.saxutils.quoteattr(value)) for key, value in attrs.items()]
     )
 
-def tokenize_keep_markup(string):
+def _tokenize_keep_markup_sax(string):
     """
-    Splits a string into a list of tokens, but do not split at whitespace if the space
-    is inside an XML element tag.
+    Splits a string into a list of tokens with a SAX parser, see
+    `tokenize_keep_markup`.
     """
     handler = _NodesToListHandler()
     wrapped_string = "<root>" + string + "</root>"
 
     xml.sax.parseString(wrapped_string, handler)
     return handler.return_nodes()[1:-1]
+
+# the SAX parser reads strings in chunks of this size, and reports
+# characters separately at the boundaries
+_SAX_BUFFER_SIZE = 2 ** 16
+_SAX_WRAPPING_LENGTH = len("<root></root>")
+
+# markup that is not handled by `_tokenize_keep_markup_fast`: comments,
+# processing instructions, CDATA sections, carriage returns and characters
+# that are not allowed in XML
+_UNHANDLED_MARKUP_REGEX = re.compile(r"<[!?]|\]\]>|" + xmlsyntax.UNHANDLED_CHARACTERS)
+# splits a string into text and tags, every other item is a tag
+_XML_TAG_SPLIT_REGEX = re.compile(
+    r"(</" + xmlsyntax.XML_NAME + xmlsyntax.XML_SPACE + r"*>|<" + xmlsyntax.XML_NAME +
+    r"(?:" + xmlsyntax.XML_SPACE + r"+" + xmlsyntax.XML_NAME + xmlsyntax.XML_SPACE + r"*=" + xmlsyntax.XML_SPACE +
+    r"*(?:\"[^<\"]*\"|'[^<']*'))*" + xmlsyntax.XML_SPACE + r"*/?>)"
+)
+_XML_START_TAG_REGEX = re.compile(
+    r"<(" + xmlsyntax.XML_NAME + r")((?:" + xmlsyntax.XML_SPACE + r"+[a-zA-Z_:].*?)?)" + xmlsyntax.XML_SPACE + r"*(/?)>",
+    re.DOTALL
+)
+_XML_ATTRIBUTE_VALUE_REGEX = re.compile(r"(?:[^&]|" + xmlsyntax.XML_REFERENCE + r")*")
+_XML_VALUE_PART_REGEX = re.compile(xmlsyntax.XML_REFERENCE + r"|[\t\n]")
+
+def _attribute_string(attributes):
+    '''
+    Parses and formats the @param attributes of a start tag like
+        `_get_string_from_attrs`.
+    @return the formatted attributes, None if they are not well-formed
+    '''
+    formatted = []
+    names = set()
+    for match in xmlsyntax.XML_ATTRIBUTE_REGEX.finditer(attributes):
+        name = match.group(1)
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        if name in names or not _XML_ATTRIBUTE_VALUE_REGEX.fullmatch(value):
+            return None
+        names.add(name)
+
+        characters = []
+        position = 0
+        for part in _XML_VALUE_PART_REGEX.finditer(value):
+            characters.append(value[position:part.start()])
+            # literal whitespace in attribute values is normalized to spaces
+            character = " " if part.group(0) in "\t\n" else xmlsyntax.resolve_reference(part.group(0))
+            if character is None:
+                return None
+            characters.append(character)
+            position = part.end()
+        characters.append(value[position:])
+
+        formatted.append('%s=%s' % (name, xml.sax.saxutils.quoteattr("".join(characters))))
+    return " ".join(formatted)
+
+@functools.lru_cache(maxsize=xmlsyntax.TAG_CACHE_SIZE)
+def _parse_start_tag(tag):
+    '''
+    Parses a start or empty-element @param tag.
+    @return a tuple (element name, node without the final ">" or "/>",
+        whether the element is empty), None if the tag is not well-formed
+    '''
+    name, attributes, empty = _XML_START_TAG_REGEX.fullmatch(tag).groups()
+    attribute_string = _attribute_string(attributes)
+    if attribute_string is None:
+        return None
+    node = "<%s %s" % (name, attribute_string) if attribute_string else "<%s" % name
+    return name, node, bool(empty)
+
+def _text_nodes(text):
+    '''
+    Splits @param text at spaces like `_NodesToListHandler`, where newlines
+        are reported as separate characters. Nodes that only consist of
+        whitespace are discarded.
+    '''
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\n" in text:
+        text = text.replace("\n", " ")
+    return [node for node in text.split(" ") if node and not node.isspace()]
+
+def _tokenize_keep_markup_fast(string):
+    '''
+    Splits a string into a list of tokens in a single scan, see
+        `tokenize_keep_markup`.
+    @return the same tokens as `_tokenize_keep_markup_sax`, None if @param string
+        contains markup that is not handled, or is not well-formed
+    '''
+    if len(string) + _SAX_WRAPPING_LENGTH > _SAX_BUFFER_SIZE or _UNHANDLED_MARKUP_REGEX.search(string):
+        return None
+    if "<" not in string and "&" not in string:
+        return _text_nodes(string)
+
+    nodes = []
+    open_elements = []
+    pending_start_element = False
+
+    for index, item in enumerate(_XML_TAG_SPLIT_REGEX.split(string)):
+        if index % 2 == 0:
+            if not item:
+                continue
+            if "<" in item:
+                return None
+            if pending_start_element:
+                nodes[-1] += ">"
+                pending_start_element = False
+            if "&" not in item:
+                if not item.isspace():
+                    nodes.extend(_text_nodes(item))
+                continue
+            # references are reported separately
+            for reference_index, text in enumerate(xmlsyntax.XML_REFERENCE_SPLIT_REGEX.split(item)):
+                if reference_index % 2 == 0:
+                    if "&" in text:
+                        return None
+                    nodes.extend(_text_nodes(text))
+                else:
+                    if not xmlsyntax.is_reference(text):
+                        return None
+                    character = xmlsyntax.resolve_reference(text)
+                    if character is None:
+                        return None
+                    nodes.extend(_text_nodes(xml.sax.saxutils.escape(character)))
+
+        elif item[1] == "/":
+            name = item[2:-1].rstrip(" \t\n")
+            if not open_elements or open_elements.pop() != name:
+                return None
+            if pending_start_element:
+                nodes[-1] += "/>"
+                pending_start_element = False
+            else:
+                nodes.append("</%s>" % name)
+
+        else:
+            if pending_start_element:
+                nodes[-1] += ">"
+            parsed = _parse_start_tag(item)
+            if parsed is None:
+                return None
+            name, node, empty = parsed
+            if empty:
+                nodes.append(node + "/>")
+                pending_start_element = False
+            else:
+                nodes.append(node)
+                open_elements.append(name)
+                pending_start_element = True
+
+    if open_elements:
+        return None
+
+    return nodes
+
+def tokenize_keep_markup(string):
+    """
+    Splits a string into a list of tokens, but do not split at whitespace if the space
+    is inside an XML element tag. Raises an exception if the string is not
+    well-formed XML content.
+    """
+    tokens = _tokenize_keep_markup_fast(string)
+    if tokens is None:
+        # unusual or malformed markup, let the SAX parser handle (or reject) it
+        tokens = _tokenize_keep_markup_sax(string)
+    return tokens
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Splits a parallel corpus into shards of line-aligned byte ranges, processes
+the shards in a pool of worker processes and merges the results in order.
+"""
+
+import io
+import os
+import pickle
+import logging
+import tempfile
+import multiprocessing
+
+from mtrain import constants as C
+
+
+######################################
+# Shard boundaries
+######################################
+
+def _line_starts_after(path, byte_offsets):
+    '''
+    For each of the sorted @param byte_offsets, finds the first line in the
+    file at @param path that starts at or after the offset. Returns a list of
+    (line number, byte offset) tuples; (None, file size) if there is none.
+    '''
+    results = []
+    offsets = iter(byte_offsets)
+    target = next(offsets, None)
+    num_lines = 0
+    position = 0
+    with open(path, 'rb') as f:
+        while target is not None:
+            if target <= 0:
+                results.append((0, 0))
+                target = next(offsets, None)
+                continue
+            block = f.read(C.SHARDING_BLOCK_SIZE)
+            if not block:
+                break
+            search_from = 0
+            while target is not None:
+                newline = block.find(b'\n', max(target - 1 - position, search_from))
+                if newline < 0:
+                    break
+                results.append((num_lines + block.count(b'\n', 0, newline + 1), position + newline + 1))
+                search_from = newline
+                target = next(offsets, None)
+            num_lines += block.count(b'\n')
+            position += len(block)
+    while target is not None:
+        results.append((None, position))
+        target = next(offsets, None)
+    return results
+
+def _line_offsets(path, line_numbers):
+    '''
+    Returns the byte offsets at which the sorted @param line_numbers start in
+    the file at @param path, or the file size for lines past its end.
+    '''
+    results = []
+    numbers = iter(line_numbers)
+    target = next(numbers, None)
+    num_lines = 0 # newlines before the current position
+    position = 0
+    with open(path, 'rb') as f:
+        while target is not None:
+            if target <= num_lines:
+                # line `num_lines` starts at the current position
+                results.append(position)
+                target = next(numbers, None)
+                continue
+            block = f.read(C.SHARDING_BLOCK_SIZE)
+            if not block:
+                break
+            newline = -1
+            lines_after_block = num_lines + block.count(b'\n')
+            while target is not None and target <= lines_after_block:
+                # advance to the newline that ends the line before the target
+                while num_lines < target:
+                    newline = block.find(b'\n', newline + 1)
+                    num_lines += 1
+                results.append(position + newline + 1)
+                target = next(numbers, None)
+            num_lines = lines_after_block
+            position += len(block)
+    while target is not None:
+        results.append(position)
+        target = next(numbers, None)
+    return results
+
+def shard_boundaries(path_source, path_target, num_shards):
+    '''
+    Splits a parallel corpus into up to @param num_shards shards of similar
+    size in bytes (on the source side). Shards start at the same line on both
+    sides. Returns a list of ((source start, source end), (target start,
+    target end)) byte ranges.
+    '''
+    size_source = os.path.getsize(path_source)
+    size_target = os.path.getsize(path_target)
+    offsets = [size_source * i // num_shards for i in range(1, num_shards)]
+    starts = [(0, 0)]
+    for line_number, offset in _line_starts_after(path_source, offsets):
+        if line_number is not None and offset < size_source and offset > starts[-1][1]:
+            starts.append((line_number, offset))
+    starts_target = _line_offsets(path_target, [line_number for line_number, _ in starts])
+    ends_source = [offset for _, offset in starts[1:]] + [size_source]
+    ends_target = starts_target[1:] + [size_target]
+    return [
+        ((start_source, end_source), (start_target, end_target))
+        for (_, start_source), end_source, start_target, end_target
+        in zip(starts, ends_source, starts_target, ends_target)
+    ]
+
+def read_lines(path, start, end):
+    '''
+    Returns the lines in the byte range [@param start, @param end) of the
+    file at @param path, decoded as when iterating over `open(path, 'r')`.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return list(io.TextIOWrapper(io.BytesIO(data)))
+
+
+######################################
+# Processing
+######################################
+
+_worker_processor = None
+
+def _init_worker(processor):
+    '''
+    Loads the components of @param processor once per worker process.
+    '''
+    global _worker_processor
+    _worker_processor = processor
+    _worker_processor.load()
+
+def _process_shard(shard):
+    '''
+    Processes a single @param shard in a worker process and stores its
+    results in a temporary file. Returns the path to this file.
+    '''
+    (path_source, start_source, end_source), (path_target, start_target, end_target), temp_dir = shard
+    results = [
+        _worker_processor.process(segment_source, segment_target)
+        for segment_source, segment_target in zip(
+            read_lines(path_source, start_source, end_source),
+            read_lines(path_target, start_target, end_target)
+        )
+    ]
+    handle, path_results = tempfile.mkstemp(prefix='shard.', dir=temp_dir)
+    with os.fdopen(handle, 'wb') as f:
+        pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path_results
+
+def process_parallel_corpus(processor, path_source, path_target, num_workers=1, temp_dir=None):
+    '''
+    Applies @param processor to every bisegment of a parallel corpus and
+    yields the results in corpus order.
+
+    @param processor an object with a method `process(segment_source,
+        segment_target)`, and a method `load()` that creates the components
+        it needs. Must be picklable before `load()` is called. With a
+        single worker, the processor is used as is, without calling `load()`
+    @param path_source path to the source side of the corpus
+    @param path_target path to the target side of the corpus
+    @param num_workers number of worker processes
+    @param temp_dir directory where results of shards are stored until they
+        are merged
+    '''
+    if num_workers <= 1:
+        with open(path_source, 'r') as corpus_source, open(path_target, 'r') as corpus_target:
+            for segment_source, segment_target in zip(corpus_source, corpus_target):
+                yield processor.process(segment_source, segment_target)
+        return
+
+    shards = [
+        ((path_source, start_source, end_source), (path_target, start_target, end_target), temp_dir)
+        for (start_source, end_source), (start_target, end_target)
+        in shard_boundaries(path_source, path_target, num_workers * C.SHARDS_PER_WORKER)
+    ]
+    logging.debug("Processing %s in %d shards with %d workers", path_source, len(shards), num_workers)
+    pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(processor,))
+    try:
+        # results of later shards are computed while earlier ones are merged
+        for path_results in pool.imap(_process_shard, shards):
+            with open(path_results, 'rb') as f:
+                results = pickle.load(f)
+            os.remove(path_results)
+            yield from results
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
 """
-(De-)tokenizes segments using the default Moses (de-)tokenizer.
+(De-)tokenizes segments using the default Moses (de-)tokenizer, either with
+the Moses Perl scripts or with a compatible in-process implementation.
 """
 
 from mtrain import constants as C
-from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.preprocessing.external import create_processor, process_async
+from mtrain.preprocessing.moses_tokenizer import MosesTokenizer, MosesDetokenizer
 
 
 class Tokenizer(object):
@@ -14,13 +16,30 @@ class Tokenizer(object):
     interaction with a Moses tokenizer process kept in memory.
     """
 
-    def __init__(self, lang_code, protect=False, protected_patterns_path=None, escape=True):
+    def __init__(self, lang_code, protect=False, protected_patterns_path=None, escape=True, num_processes=1,
+                 backend=C.TOKENIZER_BACKEND, asynchronous=False):
         """
         @param lang_code language identifier
         @param protect whether the tokenizer should respect patterns that should not be tokenized
         @param protected_patterns_path path to file with protected patterns
         @param escape whether characters that break the Moses decoder should be escaped
+        @param num_processes number of tokenizer processes kept in memory
+            (ignored by the in-process backend)
+        @param backend tokenizer implementation, see C.TOKENIZER_BACKENDS
+        @param asynchronous whether the tokenizer process is used from asyncio
+            coroutines, through `tokenize_async`
         """
+        if backend == C.TOKENIZER_BACKEND_PYTHON:
+            self._processor = MosesTokenizer(
+                lang_code,
+                protected_patterns_path=protected_patterns_path if protect else None,
+                aggressive=True,
+                escape=escape
+            )
+            return
+        elif backend != C.TOKENIZER_BACKEND_PERL:
+            raise ValueError("Unknown tokenizer backend '%s'" % backend)
+
         arguments = [
             '-l %s' % lang_code,
             '-b',  # disable Perl buffering
@@ -38,11 +57,14 @@ class Tokenizer(object):
                 '-no-escape'  # do not escape reserved characters in Moses
             )
 
-        self._processor = ExternalProcessor(
-            command=" ".join([C.MOSES_TOKENIZER] + arguments)
+        self._processor = create_processor(
+            command=" ".join([C.MOSES_TOKENIZER] + arguments),
+            num_processes=num_processes,
+            asynchronous=asynchronous
         )
 
     def close(self):
+        self._processor.close()
         del self._processor
 
     def tokenize(self, segment, split=True):
@@ -56,6 +78,28 @@ class Tokenizer(object):
             return tokenized_segment.split(" ")
         return tokenized_segment
 
+    async def tokenize_async(self, segment, split=True):
+        """
+        Tokenizes a single @param segment in an asyncio coroutine, see
+        `tokenize`.
+        """
+        tokenized_segment = await process_async(self._processor, segment)
+        if split:
+            return tokenized_segment.split(" ")
+        return tokenized_segment
+
+    def tokenize_batch(self, segments, split=True):
+        """
+        Tokenizes a list of @param segments, keeping several segments in
+        flight in the Moses tokenizer process.
+
+        @param split determines if tokenized segments should be split by a space
+        """
+        tokenized_segments = self._processor.process_batch(segments)
+        if split:
+            return [tokenized_segment.split(" ") for tokenized_segment in tokenized_segments]
+        return tokenized_segments
+
 
 class Detokenizer(object):
     """
@@ -63,12 +107,27 @@ class Detokenizer(object):
     allowing interaction with a Moses detokenizer process kept in memory.
     """
 
-    def __init__(self, lang_code, uppercase_first_letter=False):
+    def __init__(self, lang_code, uppercase_first_letter=False, num_processes=1,
+                 backend=C.TOKENIZER_BACKEND, asynchronous=False):
         """
         @param lang_code language identifier
         @param uppercase_first_letter whether or not to uppercase the first
             letter in the detokenized output.
+        @param num_processes number of detokenizer processes kept in memory
+            (ignored by the in-process backend)
+        @param backend detokenizer implementation, see C.TOKENIZER_BACKENDS
+        @param asynchronous whether the detokenizer process is used from
+            asyncio coroutines, through `detokenize_async`
         """
+        if backend == C.TOKENIZER_BACKEND_PYTHON:
+            self._processor = MosesDetokenizer(
+                lang_code,
+                uppercase_first_letter=uppercase_first_letter
+            )
+            return
+        elif backend != C.TOKENIZER_BACKEND_PERL:
+            raise ValueError("Unknown tokenizer backend '%s'" % backend)
+
         arguments = [
             '-l %s' % lang_code,
             '-b',  # disable Perl buffering
@@ -76,12 +135,15 @@ class Detokenizer(object):
         ]
         if uppercase_first_letter:
             arguments.append('-u')
-        self._processor = ExternalProcessor(
+        self._processor = create_processor(
             command=" ".join([C.MOSES_DETOKENIZER] + arguments),
+            num_processes=num_processes,
+            asynchronous=asynchronous,
             stream_stderr=True
         )
 
     def close(self):
+        self._processor.close()
         del self._processor
 
     def detokenize(self, tokens):
@@ -89,3 +151,15 @@ class Detokenizer(object):
         Detokenizes a list of @param tokens into a segment
         """
         return self._processor.process(" ".join(tokens))
+
+    async def detokenize_async(self, tokens):
+        """
+        Detokenizes a list of @param tokens in an asyncio coroutine.
+        """
+        return await process_async(self._processor, " ".join(tokens))
+
+    def detokenize_batch(self, token_lists):
+        """
+        Detokenizes a list of @param token_lists into a list of segments.
+        """
+        return self._processor.process_batch([" ".join(tokens) for tokens in token_lists])
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 
 """
-(De)truecases segments using the default Moses (de)truecaser.
+(De)truecases segments using the default Moses (de)truecaser, either with the
+Moses Perl scripts or with a compatible in-process implementation.
 """
 
 from mtrain import constants as C
-from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.preprocessing.external import create_processor, process_async
+from mtrain.preprocessing.moses_truecaser import MosesTruecaser, MosesDetruecaser
 
 class Truecaser(object):
     """
@@ -13,23 +15,37 @@ class Truecaser(object):
     interaction with a Moses truecaser process kept in memory.
     """
 
-    def __init__(self, path_model):
+    def __init__(self, path_model, num_processes=1, backend=C.TRUECASER_BACKEND, asynchronous=False):
         """
         @param path_model path to truecasing model trained in `mtrain`
+        @param num_processes number of truecaser processes kept in memory
+            (ignored by the in-process backend)
+        @param backend truecaser implementation, see C.TRUECASER_BACKENDS
+        @param asynchronous whether the truecaser process is used from asyncio
+            coroutines, through `truecase_tokens_async`
         """
+        if backend == C.TRUECASER_BACKEND_PYTHON:
+            self._processor = MosesTruecaser(path_model)
+            return
+        elif backend != C.TRUECASER_BACKEND_PERL:
+            raise ValueError("Unknown truecaser backend '%s'" % backend)
+
         arguments = [
             '-model %s' % path_model,
             '-b' #disable Perl buffering
         ]
 
-        self._processor = ExternalProcessor(
-            command=" ".join([C.MOSES_TRUECASER] + arguments)
+        self._processor = create_processor(
+            command=" ".join([C.MOSES_TRUECASER] + arguments),
+            num_processes=num_processes,
+            asynchronous=asynchronous
         )
 
     def close(self):
         """
         Deletes object to free up memory.
         """
+        self._processor.close()
         del self._processor
 
     def truecase_segment(self, segment):
@@ -47,21 +63,47 @@ class Truecaser(object):
             return truecased_string.split(" ")
         return truecased_string
 
+    async def truecase_tokens_async(self, tokens, split=True):
+        """
+        Truecases a list of tokens in an asyncio coroutine.
+        """
+        truecased_string = await process_async(self._processor, " ".join(tokens))
+        if split:
+            return truecased_string.split(" ")
+        return truecased_string
+
+    def truecase_batch(self, segments):
+        """
+        Truecases a list of segments.
+        """
+        return self._processor.process_batch(segments)
+
 class Detruecaser(object):
     """
     Creates a detruecaser which detruecases sentences on-the-fly, i.e., allowing
     interaction with a Moses truecaser process kept in memory.
     """
-    def __init__(self):
+    def __init__(self, num_processes=1, backend=C.TRUECASER_BACKEND):
         """
         Detruecaser that is a script, no model training.
+
+        @param num_processes number of detruecaser processes kept in memory
+            (ignored by the in-process backend)
+        @param backend detruecaser implementation, see C.TRUECASER_BACKENDS
         """
+        if backend == C.TRUECASER_BACKEND_PYTHON:
+            self._processor = MosesDetruecaser()
+            return
+        elif backend != C.TRUECASER_BACKEND_PERL:
+            raise ValueError("Unknown truecaser backend '%s'" % backend)
+
         arguments = [
             '-b' # disable Perl buffering
         ]
 
-        self._processor = ExternalProcessor(
-            command=" ".join([C.MOSES_DETRUECASER] + arguments)
+        self._processor = create_processor(
+            command=" ".join([C.MOSES_DETRUECASER] + arguments),
+            num_processes=num_processes
         )
 
     def close(self):
@@ -79,3 +121,9 @@ class Detruecaser(object):
         """
         detruecased_segment = self.detruecase_segment(" ".join(tokens))
         return detruecased_segment.split(" ")
+
+    def detruecase_batch(self, segments):
+        """
+        Detruecases a list of segments.
+        """
+        return self._processor.process_batch(segments)
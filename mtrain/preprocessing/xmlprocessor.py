@@ -8,7 +8,9 @@ from mtrain.preprocessing.masking import Masker
 from mtrain.preprocessing.reinsertion import Reinserter
 from mtrain.constants import *
 from mtrain.preprocessing import cleaner
+from mtrain.preprocessing import xmlsyntax
 
+import functools
 import re
 import xml.sax.saxutils
 from lxml import etree
@@ -45,8 +47,12 @@ class XmlProcessor(object):
         '''
         # unescaped markup
         try:
-            tree = etree.fromstring('<root>' + segment + '</root>')
-            segment  = etree.tostring(tree, encoding='unicode', method='text')
+            text = _text_content(segment)
+            if text is None:
+                # unusual markup, let lxml handle (or reject) it
+                tree = etree.fromstring('<root>' + segment + '</root>')
+                text = etree.tostring(tree, encoding='unicode', method='text')
+            segment = text
         except:
             # malformed fragment, fall back strategy
             tokens = []
@@ -55,13 +61,14 @@ class XmlProcessor(object):
                     tokens.extend(token.split(" "))
             segment = " ".join(tokens)
         # markup that was escaped in the original segment, now surfaced
-        if '<' in segment and not keep_escaped_markup:        
+        if '<' in segment and not keep_escaped_markup:
             segment = re.sub('<[^>]*>', '', segment)
         else:
             segment = xml.sax.saxutils.escape(segment)
         # normalize whitespace
-        segment = re.sub(' +', ' ', segment).strip()
-        return cleaner.escape_special_chars(segment)
+        if '  ' in segment:
+            segment = " ".join(filter(None, segment.split(" ")))
+        return cleaner.escape_special_chars(segment.strip())
 
     def _mask_markup(self, segment):
         '''
@@ -135,3 +142,110 @@ class XmlProcessor(object):
         elif self._xml_strategy == XML_PASS_THROUGH:
             return target_segment.translation # then return segment unchanged
 
+
+# characters that are not handled by `_text_content`: carriage returns and
+# characters that are not allowed in XML
+_UNHANDLED_CHARACTERS_REGEX = re.compile(xmlsyntax.UNHANDLED_CHARACTERS)
+# "<" that cannot start a tag in any well-formed fragment
+_MALFORMED_MARKUP_REGEX = re.compile(r"<(?![a-zA-Z_:/!?]|[^\x00-\x7f])")
+# splits a string into text and tags, every other item is a tag
+_MARKUP_SPLIT_REGEX = re.compile(r"(<[^<>]*>)")
+# tags handled by `_text_content`, names with namespace prefixes and namespace
+# declarations are not handled
+_XML_CLOSING_TAG_REGEX = re.compile(r"</(" + xmlsyntax.XML_NAME + r")" + xmlsyntax.XML_SPACE + r"*>")
+_XML_START_TAG_REGEX = re.compile(
+    r"<(" + xmlsyntax.XML_NAME + r")(?:" + xmlsyntax.XML_SPACE + r"+(?!xmlns" + xmlsyntax.XML_SPACE + r"*=)" +
+    xmlsyntax.XML_NAME + xmlsyntax.XML_SPACE + r"*=" + xmlsyntax.XML_SPACE + r"*(?:\"[^<\"]*\"|'[^<']*'))*" +
+    xmlsyntax.XML_SPACE + r"*(/?)>"
+)
+
+def _resolve_references(text):
+    '''
+    Replaces the references in @param text with the characters they refer to.
+        Raises a ValueError if @param text is not well-formed character data.
+    '''
+    characters = []
+    for index, item in enumerate(xmlsyntax.XML_REFERENCE_SPLIT_REGEX.split(text)):
+        if index % 2 == 0:
+            if '&' in item:
+                raise ValueError("Unterminated reference in %s" % text)
+            characters.append(item)
+        else:
+            if not xmlsyntax.is_reference(item):
+                raise ValueError("Undefined entity %s" % item)
+            character = xmlsyntax.resolve_reference(item)
+            if character is None:
+                raise ValueError("Reference to invalid character %s" % item)
+            characters.append(character)
+    return "".join(characters)
+
+@functools.lru_cache(maxsize=xmlsyntax.TAG_CACHE_SIZE)
+def _parse_tag(tag):
+    '''
+    Parses a start, end or empty-element @param tag. Raises a ValueError
+        if it is certainly not well-formed.
+    @return a tuple (element name, whether it is an end tag, whether the
+        element is empty), None if @param tag is not handled
+    '''
+    match = _XML_CLOSING_TAG_REGEX.fullmatch(tag)
+    if match:
+        if ':' in match.group(1):
+            return None
+        return match.group(1), True, False
+    match = _XML_START_TAG_REGEX.fullmatch(tag)
+    if not match:
+        if _MALFORMED_MARKUP_REGEX.match(tag):
+            raise ValueError("Tag is not well-formed: %s" % tag)
+        return None
+    if ':' in match.group(1):
+        return None
+    names = set()
+    for attribute in xmlsyntax.XML_ATTRIBUTE_REGEX.finditer(tag, match.end(1)):
+        name = attribute.group(1)
+        if ':' in name:
+            return None
+        if name in names:
+            raise ValueError("Duplicate attribute %s in %s" % (name, tag))
+        names.add(name)
+        value = attribute.group(2) if attribute.group(2) is not None else attribute.group(3)
+        if '&' in value:
+            _resolve_references(value)
+    return match.group(1), False, bool(match.group(2))
+
+def _text_content(segment):
+    '''
+    Extracts the text content of @param segment in a single scan, like
+        serializing the parsed fragment with lxml and method='text'. Raises
+        a ValueError if @param segment is certainly not well-formed.
+    @return the text content, None if @param segment contains comments,
+        processing instructions, CDATA sections or other markup that is
+        not handled
+    '''
+    if '<!' in segment or '<?' in segment or ']]>' in segment or \
+            (not segment.isprintable() and _UNHANDLED_CHARACTERS_REGEX.search(segment)):
+        return None
+    if '<' not in segment and '&' not in segment:
+        return segment
+
+    items = _MARKUP_SPLIT_REGEX.split(segment)
+    text = items[::2]
+    if '<' in "".join(text):
+        if _MALFORMED_MARKUP_REGEX.search(segment):
+            raise ValueError("Segment is not well-formed: %s" % segment)
+        return None
+    open_elements = []
+    for tag in items[1::2]:
+        parsed = _parse_tag(tag)
+        if parsed is None:
+            return None
+        name, closing, empty = parsed
+        if closing:
+            if not open_elements or open_elements.pop() != name:
+                raise ValueError("Mismatched end tag %s" % tag)
+        elif not empty:
+            open_elements.append(name)
+    if open_elements:
+        raise ValueError("Unclosed elements %s" % ", ".join(open_elements))
+    if '&' in segment:
+        text = [_resolve_references(item) if '&' in item else item for item in text]
+    return "".join(text)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+'''
+Regular expressions and helpers for scanning XML fragments without a parser,
+shared by `reinsertion` and `xmlprocessor`, so that both recognize the same
+well-formed markup.
+'''
+
+import re
+
+# tags are parsed once for this many distinct tags
+TAG_CACHE_SIZE = 4096
+
+XML_NAME = r"[a-zA-Z_:][a-zA-Z0-9_:.\-]*"
+XML_SPACE = r"[ \t\n]"
+XML_REFERENCE = r"&(?:amp|lt|gt|quot|apos|#[0-9]+|#x[0-9a-fA-F]+);"
+
+# carriage returns and characters that are not allowed in XML, not handled by
+# the scanners
+UNHANDLED_CHARACTERS = r"[\x00-\x08\x0b\x0c\r\x0e-\x1f\ud800-\udfff\ufffe\uffff]"
+
+# splits text into character data and references, every other item is a reference
+XML_REFERENCE_SPLIT_REGEX = re.compile(r"(&[^&]*?;)")
+XML_CHARACTER_REFERENCE_REGEX = re.compile(r"&#(?:[0-9]+|x[0-9a-fA-F]+);")
+XML_ATTRIBUTE_REGEX = re.compile(
+    r"(" + XML_NAME + r")" + XML_SPACE + r"*=" + XML_SPACE + r"*(?:\"([^<\"]*)\"|'([^<']*)')"
+)
+
+PREDEFINED_ENTITIES = {'&amp;': '&', '&lt;': '<', '&gt;': '>', '&quot;': '"', '&apos;': "'"}
+
+def is_reference(reference):
+    '''
+    Whether @param reference is a predefined entity or a character reference.
+    '''
+    return reference in PREDEFINED_ENTITIES or XML_CHARACTER_REFERENCE_REGEX.fullmatch(reference) is not None
+
+def resolve_reference(reference):
+    '''
+    Returns the character @param reference refers to, None if it does not
+        refer to a character allowed in XML. @param reference must be a
+        predefined entity or a character reference, see `is_reference`.
+    '''
+    if reference in PREDEFINED_ENTITIES:
+        return PREDEFINED_ENTITIES[reference]
+    if reference.startswith("&#x"):
+        code_point = int(reference[3:-1], 16)
+    else:
+        code_point = int(reference[2:-1])
+    if code_point in (0x9, 0xA, 0xD) or 0x20 <= code_point <= 0xD7FF or \
+            0xE000 <= code_point <= 0xFFFD or 0x10000 <= code_point <= 0x10FFFF:
+        return chr(code_point)
+    return None
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+"""
+Serves a translation engine over local HTTP, so that the engine and all of its
+components are loaded only once for many clients.
+
+Clients POST a JSON object {"segments": ["...", ...]} and receive
+{"translations": ["...", ...]}. Requests are put in a bounded queue and
+translated in batches by a single dispatcher thread. If the queue is full,
+clients get a 503 response and should retry later.
+"""
+
+import json
+import queue
+import logging
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from mtrain import constants as C
+
+
+class _TranslationRequest(object):
+    """
+    Segments of a single client request, together with their translations once
+    they are available.
+    """
+    def __init__(self, segments):
+        self.segments = segments
+        self.translations = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TranslationServer(object):
+    """
+    Local HTTP server for a translation engine trained with `mtrain`.
+    """
+
+    def __init__(self,
+                 engine,
+                 host=C.SERVER_HOST,
+                 port=C.SERVER_PORT,
+                 max_queue_size=C.SERVER_MAX_QUEUE_SIZE,
+                 max_batch_size=C.SERVER_MAX_BATCH_SIZE,
+                 translate_options=None,
+                 postprocess=None):
+        """
+        @param engine a translation engine that implements `translate_segments`
+        @param host the host name or IP address the server is bound to
+        @param port the port the server listens on, 0 for an arbitrary free port
+        @param max_queue_size the maximum number of requests waiting for
+            translation, further requests are rejected
+        @param max_batch_size the maximum number of segments translated at once,
+            several requests are combined up to this size
+        @param translate_options keyword arguments passed to `translate_segments`
+        @param postprocess a function applied to each source segment and its
+            translation, returning the translation sent to the client
+        """
+        self._engine = engine
+        self._max_batch_size = max_batch_size
+        self._translate_options = translate_options or {}
+        self._postprocess = postprocess
+        self._queue = queue.Queue(maxsize=max_queue_size)
+
+        self._httpd = _ThreadingHTTPServer((host, port), self._make_handler())
+        self._dispatcher = threading.Thread(target=self._dispatch)
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    @property
+    def address(self):
+        """
+        The (host, port) tuple the server is bound to.
+        """
+        return self._httpd.server_address
+
+    def serve_forever(self):
+        logging.info("Serving translations on http://%s:%d", *self.address)
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def submit(self, segments):
+        """
+        Queues @param segments for translation.
+
+        @return a _TranslationRequest, or None if the queue is full
+        """
+        request = _TranslationRequest(segments)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            return None
+        return request
+
+    def _next_batch(self):
+        """
+        Blocks until a request is available, then adds further waiting
+        requests as long as the batch does not exceed the maximum batch size.
+        """
+        requests = [self._queue.get()]
+        num_segments = len(requests[0].segments)
+        while num_segments < self._max_batch_size:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            requests.append(request)
+            num_segments += len(request.segments)
+        return requests
+
+    def _dispatch(self):
+        """
+        Translates queued requests in batches, forever.
+        """
+        while True:
+            requests = self._next_batch()
+            # empty segments are not sent to the engine
+            segments = [segment for request in requests for segment in request.segments if segment]
+            try:
+                translations = self._engine.translate_segments(segments, **self._translate_options)
+                if self._postprocess is not None:
+                    translations = [self._postprocess(segment, translation) for segment, translation in zip(segments, translations)]
+                translations = iter(translations)
+                for request in requests:
+                    request.translations = [next(translations) if segment else '' for segment in request.segments]
+            except Exception as e:
+                logging.exception("Translation of %d segments failed", len(segments))
+                for request in requests:
+                    request.error = str(e)
+            for request in requests:
+                request.done.set()
+
+    def _make_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    payload = json.loads(self.rfile.read(length).decode('utf-8'))
+                    segments = [segment.strip() for segment in payload['segments']]
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self._respond(400, {"error": "expected a JSON object with a list of `segments`"})
+                    return
+
+                request = server.submit(segments)
+                if request is None:
+                    self._respond(503, {"error": "too many pending requests"}, retry_after=1)
+                    return
+                request.done.wait()
+                if request.error is not None:
+                    self._respond(500, {"error": request.error})
+                else:
+                    self._respond(200, {"translations": request.translations})
+
+            def _respond(self, status, body, retry_after=None):
+                content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(content)))
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                logging.debug("%s - %s", self.address_string(), format % args)
+
+        return _Handler
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+from unittest import TestCase
+
+from mtrain.preprocessing.bpe import BytePairEncoder
+
+class TestBytePairEncoder(TestCase):
+    '''
+    In-process encoding must match apply_bpe.py. Test cases are those of
+    TestBytePairEncoderSegment in test_bpe.py and match the byte-pair encoding
+    models in `test/data`.
+    '''
+    data = os.sep.join([os.path.dirname(os.path.abspath(__file__)), 'data'])
+
+    test_cases_ro = {
+        "Est onia": "Est onia",
+        "Estonia": "Estonia",
+        "Barcel ona": "Bar@@ cel ona",
+        "Barcelona": "Barcelona",
+        "Estona": "Est@@ ona",
+        "Barcelonia": "Barcel@@ onia"
+    }
+    test_cases_en = {
+        "in": "in",
+        "the": "the",
+        "uni versity": "uni versity",
+        "university": "university",
+        "in the university .": "in the university .",
+        "universityy .": "universit@@ y@@ y ."
+    }
+
+    def test_encode_segment(self):
+        encoder = BytePairEncoder(os.sep.join([self.data, 'ro-en.bpe']))
+        for example_segment, encoded_segment in self.test_cases_ro.items():
+            self.assertEqual(encoder.encode_segment(example_segment), encoded_segment)
+        encoder.close()
+
+        encoder = BytePairEncoder(os.sep.join([self.data, 'en-ro.bpe']))
+        for example_segment, encoded_segment in self.test_cases_en.items():
+            self.assertEqual(encoder.encode_segment(example_segment), encoded_segment)
+        encoder.close()
+
+    def test_encode_segments_uses_word_cache(self):
+        encoder = BytePairEncoder(os.sep.join([self.data, 'en-ro.bpe']))
+        self.assertEqual(
+            encoder.encode_segments(["universityy .", "universityy  universityy ."]),
+            ["universit@@ y@@ y .", "universit@@ y@@ y universit@@ y@@ y ."]
+        )
+        cache_info = encoder.cache_info()
+        self.assertEqual(cache_info.misses, 2)
+        self.assertEqual(cache_info.hits, 3)
+        encoder.close()
+
+    def test_vocabulary(self):
+        '''
+        Subwords that are not in the vocabulary (above a frequency threshold)
+        are split further, like `apply_bpe.py --vocabulary`.
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.vocab', delete=False) as vocab_file:
+            vocab_file.write("universit@@ 10\ny 60\n")
+        self.addCleanup(os.remove, vocab_file.name)
+        model_path = os.sep.join([self.data, 'en-ro.bpe'])
+
+        encoder = BytePairEncoder(model_path, vocab_path=vocab_file.name, vocab_threshold=5)
+        self.assertEqual(encoder.encode_segment("universityy ."), "universit@@ y@@ y .")
+        encoder.close()
+
+        encoder = BytePairEncoder(model_path, vocab_path=vocab_file.name, vocab_threshold=50)
+        self.assertEqual(encoder.encode_segment("universityy"), "u@@ n@@ i@@ v@@ e@@ r@@ s@@ i@@ t@@ y@@ y")
+        encoder.close()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import json
+
+from mtrain.test.test_case_with_cleanup import TestCaseWithCleanup
+from mtrain.cache import TranslationCache, engine_identity
+from mtrain import constants as C
+
+class TestTranslationCache(TestCaseWithCleanup):
+
+    def test_get_put(self):
+        cache = TranslationCache("engine", max_size=10)
+        self.assertIsNone(cache.get("Ein Satz.", lowercase=False))
+        cache.put("Ein Satz.", "A sentence.", lowercase=False)
+        self.assertEqual(cache.get("Ein Satz.", lowercase=False), "A sentence.")
+        self.assertIsNone(cache.get("Ein Satz.", lowercase=True),
+            "Translations with different options must be cached separately")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        cache = TranslationCache("engine", max_size=2)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        cache.get("a") # a is now more recently used than b
+        cache.put("c", "C")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"), "Least recently used entry must be evicted")
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.get("c"), "C")
+
+    def test_persistent(self):
+        path = os.sep.join([self._basedir_test_cases, "cache.sqlite"])
+        cache = TranslationCache("engine", max_size=1, path=path)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        cache.close()
+
+        cache = TranslationCache("engine", max_size=1, path=path)
+        self.assertEqual(cache.get("a"), "A", "Entries must persist across instances")
+        cache.close()
+
+        cache = TranslationCache("retrained engine", max_size=1, path=path)
+        self.assertIsNone(cache.get("a"), "Entries of other engines must not be used")
+        cache.close()
+
+    def test_persistent_size(self):
+        path = os.sep.join([self._basedir_test_cases, "bounded.sqlite"])
+        cache = TranslationCache("engine", max_size=0, path=path, max_persistent_size=2)
+        for segment in "abc":
+            cache.put(segment, segment.upper())
+        self.assertIsNone(cache.get("a"), "Oldest entry must be removed from disk")
+        self.assertEqual(cache.get("c"), "C")
+        cache.close()
+
+    def test_put_many(self):
+        path = os.sep.join([self._basedir_test_cases, "batch.sqlite"])
+        cache = TranslationCache("engine", max_size=1, path=path, max_persistent_size=3)
+        cache.put_many([("a", "A"), ("b", "B")], lowercase=False)
+        cache.put_many([("b", "B"), ("c", "C"), ("d", "D")], lowercase=False)
+        cache.close()
+
+        cache = TranslationCache("engine", max_size=0, path=path)
+        self.assertIsNone(cache.get("a", lowercase=False), "Oldest entry must be removed from disk")
+        self.assertEqual([cache.get(segment, lowercase=False) for segment in "bcd"], ["B", "C", "D"],
+            "Entries stored together must persist across instances")
+        cache.close()
+
+    def test_engine_identity(self):
+        basepath = os.sep.join([self._basedir_test_cases, "engine_identity"])
+        os.makedirs(basepath + os.sep + C.PATH_COMPONENT['engine'])
+        with open(basepath + os.sep + C.CONFIG, 'w') as f:
+            json.dump({"src_lang": "de"}, f)
+        identity = engine_identity(basepath)
+        self.assertEqual(identity, engine_identity(basepath))
+
+        path_moses_ini = os.sep.join([basepath, C.PATH_COMPONENT['engine'], 'moses.ini'])
+        with open(path_moses_ini, 'w') as f:
+            f.write("[feature]\n")
+        self.assertNotEqual(identity, engine_identity(basepath),
+            "A new moses.ini must change the engine identity")
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+import os
+
 from unittest import TestCase
 from mtrain.preprocessing import cleaner
+from mtrain.test.test_case_with_cleanup import TestCaseWithCleanup
 
 class TestCleaner(TestCase):
     '''
@@ -63,6 +66,31 @@ class TestCleaner(TestCase):
                 "De-escaped version of `%s` must be `%s`" % (escaped, original)
             )
 
+    def test_escape_special_chars_batch(self):
+        originals = list(self.test_cases_special_chars.keys())
+        self.assertEqual(
+            cleaner.escape_special_chars_batch(originals),
+            [self.test_cases_special_chars[original] for original in originals]
+        )
+        self.assertEqual(
+            cleaner.escape_special_chars_batch(["a\n&", "[b]"]),
+            ["a\n&amp;", "&#91;b&#93;"],
+            "Segments with newlines must be escaped correctly"
+        )
+        self.assertEqual(cleaner.escape_special_chars_batch([]), [])
+
+    def test_deescape_special_chars_batch(self):
+        originals = list(self.test_cases_special_chars.keys())
+        self.assertEqual(
+            cleaner.deescape_special_chars_batch([self.test_cases_special_chars[original] for original in originals]),
+            originals
+        )
+        self.assertEqual(
+            cleaner.deescape_special_chars_batch(["&amp;lt;", ""]),
+            ["&lt;", ""],
+            "De-escaping must not de-escape characters twice"
+        )
+
     def test_normalize_romanian(self):
         '''
         Testing implementation of script https://github.com/rsennrich/wmt16-scripts/blob/master/preprocess/normalise-romanian.py.
@@ -76,3 +104,27 @@ class TestCleaner(TestCase):
         '''        
         for example_segment, diac_free_segment in self.test_cases_ro_diacritics.items():
             self.assertEqual(cleaner.remove_ro_diacritics(example_segment), diac_free_segment)
+
+
+class TestCleanerFiles(TestCaseWithCleanup):
+
+    def test_escape_and_deescape_special_chars_file(self):
+        lines = ['salt&pepper\n', '<a href="index.html">foo</a>\n', '\n', "[foo] 's"]
+        original_path = os.sep.join([self._basedir_test_cases, 'special-chars.txt'])
+        escaped_path = original_path + '.escaped'
+        deescaped_path = original_path + '.deescaped'
+        with open(original_path, 'w', encoding='utf-8') as original_file:
+            original_file.write("".join(lines))
+
+        cleaner.escape_special_chars_file(original_path, escaped_path)
+        with open(escaped_path, 'r', encoding='utf-8') as escaped_file:
+            self.assertEqual(
+                escaped_file.read(),
+                "".join(cleaner.escape_special_chars(line) for line in lines),
+                "Escaping a file must escape every line"
+            )
+
+        cleaner.deescape_special_chars_file(escaped_path, deescaped_path)
+        with open(deescaped_path, 'r', encoding='utf-8') as deescaped_file:
+            self.assertEqual(deescaped_file.read(), "".join(lines),
+                "De-escaping an escaped file must restore the original file")
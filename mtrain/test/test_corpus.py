@@ -2,7 +2,7 @@
 
 from mtrain.test.test_case_with_cleanup import TestCaseWithCleanup
 
-from mtrain.corpus import ParallelCorpus
+from mtrain.corpus import ParallelCorpus, ReservoirSampler
 from mtrain import assertions
 
 import os
@@ -116,3 +116,50 @@ class TestParallelCorpus(TestCaseWithCleanup):
             "Target segments must be written to file immediately"
         )
         corpus.close()
+
+
+class TestReservoirSampler(TestCaseWithCleanup):
+
+    def _sample(self, size, num_items, random_generator):
+        sampler = ReservoirSampler(size, random_generator)
+        sample = [None] * size
+        for item in range(num_items):
+            position = sampler.offer()
+            if position is not None:
+                sample[position] = item
+        return sample
+
+    def test_sample_fills_positions_in_order(self):
+        self.assertEqual(
+            self._sample(5, 5, random.Random(1)),
+            [0, 1, 2, 3, 4],
+            "The first items must fill the sample in order"
+        )
+
+    def test_sample_is_reproducible(self):
+        self.assertEqual(
+            self._sample(10, 10000, random.Random(42)),
+            self._sample(10, 10000, random.Random(42)),
+            "Samples drawn with the same seed must be identical"
+        )
+
+    def test_sample_is_uniform(self):
+        random_generator = random.Random(7)
+        counts = [0] * 20
+        for _ in range(5000):
+            for item in self._sample(4, 20, random_generator):
+                counts[item] += 1
+        # each item is selected with a probability of 4/20, i.e. 1000 times
+        for count in counts:
+            self.assertTrue(
+                850 < count < 1150,
+                "Every item must enter the sample with the same probability"
+            )
+
+    def test_empty_sample(self):
+        sampler = ReservoirSampler(0)
+        self.assertEqual(
+            [sampler.offer() for _ in range(10)],
+            [None] * 10,
+            "No item may enter an empty sample"
+        )
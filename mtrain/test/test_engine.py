@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+
+from unittest import TestCase
+
+from mtrain.engine import EngineMoses, TranslatedSegment
+
+class TestEngineMoses(TestCase):
+
+    def _create_engine(self, report_alignment, report_segmentation):
+        # an engine without Moses process, only parses translations
+        engine = EngineMoses.__new__(EngineMoses)
+        engine._report_alignment = report_alignment
+        engine._report_segmentation = report_segmentation
+        return engine
+
+    def test_translated_segment_alignment_and_segmentation(self):
+        engine = self._create_engine(True, True)
+        translated = engine._translated_segment("this is |0-1| |2-2| a small test |3-4| ||| 0-0 1-1 3-2 3-3 4-4")
+        self.assertEqual(translated.translation, "this is a small test")
+        self.assertEqual(translated.alignment, {0: [0], 1: [1], 3: [2, 3], 4: [4]})
+        self.assertEqual(translated.alignment[2], [], "Unaligned source tokens must have no alignments")
+        self.assertEqual(
+            list(translated.segmentation.items()),
+            [((0, 1), (0, 1)), ((2, 2), ()), ((3, 4), (2, 4))],
+            "Segmentation must map source spans to target spans in target order"
+        )
+
+    def test_translated_segment_without_reports(self):
+        engine = self._create_engine(False, False)
+        translated = engine._translated_segment("this is a test")
+        self.assertEqual(translated.translation, "this is a test")
+        self.assertIsNone(translated.alignment)
+        self.assertIsNone(translated.segmentation)
+
+    def test_alignment_can_be_modified(self):
+        engine = self._create_engine(True, False)
+        translated = engine._translated_segment("a b ||| 0-1")
+        translated.alignment[1].append(0)
+        self.assertEqual(translated.alignment, {0: [1], 1: [0]},
+            "Changes to the alignment must be kept")
+
+    def test_process_started_when_needed(self):
+        engine = EngineMoses("moses.ini")
+        self.assertIsNone(engine._processor,
+            "The Moses process must not be started before segments are translated")
+        engine.close()
+
+    def _write_output(self, content):
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.out', delete=False) as output_file:
+            output_file.write(content)
+        self.addCleanup(os.remove, output_file.name)
+        return output_file.name
+
+    def test_read_translations(self):
+        engine = self._create_engine(True, True)
+        # raw output of `moses -print-alignment-info -report-segmentation`,
+        # with an empty line after each translation
+        output_path = self._write_output(
+            "das ist |0-1| ein Test |2-3| ||| 0-0 1-1 2-2 3-3\n"
+            "\n"
+            "Hallo |0-0| ||| 0-0\n"
+            "\n"
+        )
+        translated = list(engine.read_translations(output_path))
+        self.assertEqual([t.translation for t in translated], ["das ist ein Test", "Hallo"],
+            "Empty lines after alignment info must be skipped")
+        self.assertEqual(translated[0].alignment, {0: [0], 1: [1], 2: [2], 3: [3]})
+        self.assertEqual(list(translated[0].segmentation.items()), [((0, 1), (0, 1)), ((2, 3), (2, 3))])
+        self.assertEqual(translated[1].alignment, {0: [0]})
+        self.assertEqual(list(translated[1].segmentation.items()), [((0, 0), (0, 0))])
+
+    def test_read_translations_without_reports(self):
+        engine = self._create_engine(False, False)
+        output_path = self._write_output("das ist ein Test\n\nHallo\n")
+        self.assertEqual(
+            [t.translation for t in engine.read_translations(output_path)],
+            ["das ist ein Test", "", "Hallo"],
+            "Without alignment info, empty lines are empty translations"
+        )
+
+class TestTranslatedSegment(TestCase):
+
+    def test_dictionaries(self):
+        translated = TranslatedSegment("a b", alignment={0: [1]}, segmentation={(0, 0): (1, 1)})
+        self.assertEqual(translated.alignment, {0: [1]})
+        self.assertEqual(translated.segmentation, {(0, 0): (1, 1)})
+
+    def test_slots(self):
+        translated = TranslatedSegment("a b")
+        with self.assertRaises(AttributeError):
+            translated.other = None
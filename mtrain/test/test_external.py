@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+
+from unittest import TestCase
+
+from mtrain.preprocessing.external import ExternalProcessor, ExternalProcessorPool, AsyncExternalProcessor, create_processor, process_async
+
+class TestExternalProcessor(TestCase):
+
+    def test_process(self):
+        p = ExternalProcessor("cat")
+        self.assertEqual(p.process("alpha beta\n"), "alpha beta",
+            "ExternalProcessor must return the stripped output of the process")
+        p.close()
+
+    def test_process_batch_keeps_order(self):
+        p = ExternalProcessor("cat")
+        lines = ["line %d" % i for i in range(5000)]
+        self.assertEqual(p.process_batch(lines, max_in_flight=16), lines,
+            "Batch processing must return outputs in the order of the inputs")
+        p.close()
+
+    def test_process_batch_empty(self):
+        p = ExternalProcessor("cat")
+        self.assertEqual(p.process_batch([]), [],
+            "Batch processing of no lines must return an empty list")
+        p.close()
+
+    def test_process_batch_trailing_output(self):
+        # emulates Moses printing an empty line after each output line
+        p = ExternalProcessor("sed -u 'G'", trailing_output=True)
+        lines = ["äbc", "def", "ghi"]
+        self.assertEqual(p.process_batch(lines), lines,
+            "Batch processing must skip trailing output lines")
+        self.assertEqual(p.process("jkl"), "jkl",
+            "Single line processing must still work after a batch")
+        p.close()
+
+    def test_process_stream(self):
+        p = ExternalProcessor("cat")
+        produced = []
+
+        def _lines():
+            for i in range(1000):
+                produced.append(i)
+                yield "line %d" % i
+
+        results = p.process_stream(_lines(), max_in_flight=8)
+        self.assertEqual(next(results), "line 0")
+        self.assertLess(len(produced), 1000,
+            "Lines must be read while earlier outputs are consumed")
+        self.assertEqual(list(results), ["line %d" % i for i in range(1, 1000)])
+        p.close()
+
+    def test_process_stream_stop_early(self):
+        p = ExternalProcessor("cat")
+        results = p.process_stream(("line %d" % i for i in range(1000)), max_in_flight=8)
+        self.assertEqual(next(results), "line 0")
+        results.close()
+        self.assertEqual(p.process("next"), "next",
+            "Outputs of lines in flight must be discarded when the stream is closed")
+        p.close()
+
+    def test_process_stream_failing_input(self):
+        p = ExternalProcessor("cat")
+
+        def _lines():
+            yield "line"
+            raise ValueError("no more lines")
+
+        with self.assertRaises(ValueError):
+            list(p.process_stream(_lines()))
+        self.assertEqual(p.process("next"), "next")
+        p.close()
+
+class TestExternalProcessorPool(TestCase):
+
+    def test_create_processor(self):
+        p = create_processor("cat")
+        self.assertIsInstance(p, ExternalProcessor)
+        p.close()
+        p = create_processor("cat", num_processes=3)
+        self.assertIsInstance(p, ExternalProcessorPool)
+        self.assertEqual(p.size, 3)
+        p.close()
+
+    def test_process_concurrently(self):
+        p = ExternalProcessorPool("cat", size=3)
+        results = {}
+
+        def _translate(i):
+            results[i] = p.process("segment %d" % i)
+
+        threads = [threading.Thread(target=_translate, args=(i,)) for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {i: "segment %d" % i for i in range(50)},
+            "Each concurrent request must get its own output")
+        self.assertEqual(p._busy, [0, 0, 0],
+            "No process may be marked busy after all requests are done")
+        p.close()
+
+    def test_process_batch_keeps_order(self):
+        p = ExternalProcessorPool("cat", size=3)
+        lines = ["line %d" % i for i in range(1000)]
+        self.assertEqual(p.process_batch(lines), lines,
+            "Batch processing must return outputs in the order of the inputs")
+        self.assertEqual(p.process_batch(["a"]), ["a"])
+        p.close()
+
+class TestAsyncExternalProcessor(TestCase):
+
+    def _run(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_create_processor(self):
+        p = create_processor("cat", num_processes=3, asynchronous=True)
+        self.assertIsInstance(p, AsyncExternalProcessor)
+        p.close()
+
+    def test_process_concurrently(self):
+        async def _translate_all(p):
+            lines = ["segment %d" % i for i in range(2000)]
+            results = await asyncio.gather(*[p.process(line) for line in lines])
+            p.close()
+            await p.wait_closed()
+            return lines, list(results)
+
+        lines, results = self._run(_translate_all(AsyncExternalProcessor("cat", max_in_flight=16)))
+        self.assertEqual(results, lines,
+            "Each concurrent request must get its own output")
+
+    def test_process_batch_trailing_output(self):
+        async def _process(p):
+            results = await p.process_batch(["äbc", "def", "ghi"])
+            results.append(await p.process("jkl"))
+            p.close()
+            await p.wait_closed()
+            return results
+
+        self.assertEqual(self._run(_process(AsyncExternalProcessor("sed -u 'G'", trailing_output=True))),
+            ["äbc", "def", "ghi", "jkl"],
+            "Processing must skip trailing output lines")
+
+    def test_process_ended(self):
+        async def _process(p):
+            try:
+                return await p.process("a")
+            finally:
+                p.close()
+                await p.wait_closed()
+
+        with self.assertRaises(RuntimeError):
+            self._run(_process(AsyncExternalProcessor("true")))
+
+    def test_process_async_in_process(self):
+        class _Upper(object):
+            def process(self, line):
+                return line.upper()
+
+        self.assertEqual(self._run(process_async(_Upper(), "abc")), "ABC",
+            "In-process processors must be called directly")
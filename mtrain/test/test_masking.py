@@ -65,6 +65,31 @@ class TestIdentityMasker(TestCase):
                 "Identity masker must restore masks correctly given a translated segment and a mapping"
             )
 
+    def test_identity_unmasking_many_masks(self):
+        m = Masker('identity')
+        unmasked = " ".join("see http://www.statmt.org/%d or <b> a%d@ribute.com </b>" % (i, i) for i in range(200))
+        masked, mapping = m.mask_segment(unmasked)
+        self.assertEqual(
+            m.unmask_segment(unmasked, masked, mapping),
+            unmasked,
+            "Identity masker must restore all masks in long segments"
+        )
+
+    def test_identity_unmasking_unused_and_unknown_masks(self):
+        m = Masker('identity')
+        self.assertEqual(
+            m.unmask_segment('', 'a __xml_1__ b __url_5__ __xml_1__', [('__xml_0__', '<b>'), ('__xml_1__', '</b>')]),
+            'a </b> b <b>',
+            "Identity masker must replace the first occurrence of mask tokens, remove unknown ones and append unused originals"
+        )
+
+    def test_is_mask_token(self):
+        m = Masker('identity')
+        self.assertTrue(m._is_mask_token('__xml_0__'))
+        self.assertTrue(m._is_mask_token('__url_12__'))
+        self.assertFalse(m._is_mask_token('__xml__'))
+        self.assertFalse(m._is_mask_token('xml_0'))
+
     test_cases_identity_force_mask_translation = [
         ("", ""),
         ("text without masks", "text without masks"),
@@ -93,6 +118,30 @@ class TestIdentityMasker(TestCase):
             "Identity masking did not return the correct mapping for a list of input tokens"
         )
 
+    def test_identity_masking_mapping_order(self):
+        m = Masker('identity')
+        self.assertEqual(
+            m.mask_segment('http://www.statmt.org <b> an@ribute.com </b> &amp; http://www.x.org'),
+            (
+                '__url_0__ __xml_0__ __email_0__ __xml_1__ __entity_0__ __url_1__',
+                [('__xml_0__', '<b>'), ('__xml_1__', '</b>'), ('__entity_0__', '&amp;'),
+                 ('__email_0__', 'an@ribute.com'), ('__url_0__', 'http://www.statmt.org'), ('__url_1__', 'http://www.x.org')]
+            ),
+            "Mask tokens must be numbered per pattern and the mapping must be ordered by pattern first"
+        )
+
+    def test_identity_masking_overlapping_patterns(self):
+        m = Masker('identity', escape=False)
+        # earlier patterns are masked first, later patterns can contain their mask tokens
+        self.assertEqual(
+            m.mask_segment('see http://a.b/<x y> and x<b>@y.com'),
+            (
+                'see __url_0__ and __email_0__',
+                [('__xml_0__', '<x y>'), ('__xml_1__', '<b>'), ('__email_0__', 'x__xml_1__@y.com'), ('__url_0__', 'http://a.b/__xml_0__')]
+            ),
+            "Overlapping patterns must be masked in the order of PROTECTED_PATTERNS"
+        )
+
 class TestAlignmentMasker(TestCase):
     
     test_cases_alignment_masking = [
@@ -144,6 +193,23 @@ class TestAlignmentMasker(TestCase):
                 "Alignment masking must restore markup in translated text based on the source segment, target segment, mapping and alignment"
             )
     
+    def test_alignment_unmasking_consumes_mapping_in_order(self):
+        m = Masker('alignment')
+        mapping = [('__url__', 'http://a.org'), ('__xml__', '<b>'), ('__url__', 'http://b.org'), ('__url__', 'http://c.org')]
+        alignment = {0:[1], 1:[0], 2:[2]}
+        self.assertEqual(
+            m.unmask_segment('__url__ __xml__ __url__', '__xml__ __url__ __url__', mapping, alignment),
+            '<b> http://a.org http://b.org http://c.org',
+            "Alignment masking must reinsert originals in the order of the mapping and append unused originals"
+        )
+        self.assertEqual(mapping, [('__url__', 'http://c.org')], "Used entries must be removed from the mapping")
+
+    def test_is_mask_token(self):
+        m = Masker('alignment')
+        self.assertTrue(m._is_mask_token('__xml__'))
+        self.assertFalse(m._is_mask_token('__xml_0__'))
+        self.assertFalse(m._is_mask_token('__unknown__'))
+
     test_cases_alignment_force_mask_translation = [
         ("text with __single__ alignment mask", 'text with <mask translation="__single__">__single__</mask> alignment mask'),
         ("Email me at __email__ or __xml__ __url__ __xml__", 'Email me at <mask translation="__email__">__email__</mask> or <mask translation="__xml__">__xml__</mask> <mask translation="__url__">__url__</mask> <mask translation="__xml__">__xml__</mask>'),
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+from unittest import TestCase
+
+from mtrain import constants as C
+from mtrain.preprocessing.external import ExternalProcessor
+from mtrain.nematus_worker import read_batches
+
+class TestNematusWorker(TestCase):
+
+    def _start_worker(self, batch_size=80):
+        command = " ".join([sys.executable, C.NEMATUS_WORKER, "--identity", "--batch_size %d" % batch_size])
+        return ExternalProcessor(command)
+
+    def test_translate_segment(self):
+        worker = self._start_worker()
+        self.assertEqual(worker.process("ein Satz ."), "ein Satz .")
+        self.assertEqual(worker.process("noch ein Satz ."), "noch ein Satz .",
+            "Worker must keep translating after the first segment")
+        worker.close()
+
+    def test_translate_batches(self):
+        worker = self._start_worker(batch_size=7)
+        segments = ["Satz %d mit Ümlauten" % i for i in range(500)]
+        self.assertEqual(worker.process_batch(segments), segments,
+            "Worker must return one line per input line, in order")
+        worker.close()
+
+    def test_translate_stream(self):
+        worker = self._start_worker(batch_size=7)
+        segments = ("Satz %d" % i for i in range(500))
+        self.assertEqual(list(worker.process_stream(segments)), ["Satz %d" % i for i in range(500)],
+            "Worker must translate segments that are produced while it translates")
+        worker.close()
+
+    def test_carriage_return_within_segment(self):
+        worker = self._start_worker()
+        self.assertEqual(worker.process("ein\rSatz ."), "ein\rSatz .",
+            "Worker must not split segments on carriage returns")
+        self.assertEqual(worker.process("noch ein Satz ."), "noch ein Satz .",
+            "Worker must keep input and output lines paired after a carriage return")
+        worker.close()
+
+    def test_read_batches(self):
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, "eins\nzwei\rdrei\n\nvier".encode('utf-8'))
+        os.close(write_fd)
+        batches = list(read_batches(read_fd, 2))
+        os.close(read_fd)
+        self.assertEqual(batches, [["eins", "zwei\rdrei"], ["", "vier"]])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+
+from unittest import TestCase
+
+from mtrain.pipeline import run_pipeline
+
+class TestPipeline(TestCase):
+
+    def test_keeps_order(self):
+        stages = [lambda x: x + 1, lambda x: x * 2, str]
+        self.assertEqual(list(run_pipeline(range(1000), stages, queue_size=4)),
+            [str((x + 1) * 2) for x in range(1000)],
+            "Results must be in the order of the items")
+
+    def test_no_items(self):
+        self.assertEqual(list(run_pipeline([], [str])), [])
+
+    def test_stages_run_concurrently(self):
+        def _slow(x):
+            time.sleep(0.01)
+            return x
+
+        start = time.time()
+        self.assertEqual(list(run_pipeline(range(30), [_slow, _slow, _slow])), list(range(30)))
+        # sequentially, 30 items in 3 stages take at least 0.9 seconds
+        self.assertLess(time.time() - start, 0.7,
+            "Stages must work on different items at the same time")
+
+    def test_stage_uses_single_thread(self):
+        threads = set()
+
+        def _record(x):
+            threads.add(threading.current_thread())
+            return x
+
+        list(run_pipeline(range(100), [_record]))
+        self.assertEqual(len(threads), 1,
+            "Each stage must process all items in the same thread")
+
+    def test_exception_is_raised(self):
+        def _fail(x):
+            if x == 5:
+                raise ValueError("item %d" % x)
+            return x
+
+        results = []
+        with self.assertRaises(ValueError):
+            for result in run_pipeline(range(10), [_fail]):
+                results.append(result)
+        self.assertEqual(results, [0, 1, 2, 3, 4],
+            "Items before the failing one must be yielded")
+
+    def test_stop_early(self):
+        threads_before = set(threading.enumerate())
+        results = run_pipeline(iter(range(100000)), [lambda x: x], queue_size=2)
+        self.assertEqual(next(results), 0)
+        results.close()
+        self.assertEqual(set(threading.enumerate()) - threads_before, set(),
+            "Closing the pipeline must stop its threads")
@@ -95,6 +95,89 @@ class TestReinsertion(TestCase):
                 "some strings are erroneously considered to be comments or vice versa"
             )
 
+    test_cases_classify_token = [
+        ("<b>", reinsertion._OPENING_TAG),
+        ("<a href=\"x\">", reinsertion._OPENING_TAG),
+        ("</b>", reinsertion._CLOSING_TAG),
+        ("<i/>", reinsertion._SELFCLOSING_TAG),
+        ("<!-- comment -->", reinsertion._TEXT),
+        ("word", reinsertion._TEXT),
+        ("&lt;", reinsertion._TEXT)
+    ]
+
+    def test_classify_token(self):
+        for token, token_class in self.test_cases_classify_token:
+            self.assertEqual(
+                reinsertion._classify_token(token),
+                token_class,
+                "Tokens must be classified as text, opening, closing or self-closing tags"
+            )
+
+    def test_next_source_tag_region(self):
+        r = reinsertion.Reinserter('full')
+        source_tokens = "a <b> b <i/> <u> c </u> d </b> <x> </x> e".split(" ")
+        self.assertEqual(
+            list(r._next_source_tag_region(source_tokens)),
+            [
+                ((2, '<i/>'), [], None),
+                ((1, '<u>'), [2], (3, '</u>')),
+                ((0, '<b>'), [1, 2, 3], (4, '</b>')),
+                ((3, '<x>'), [], (4, '</x>'))
+            ],
+            "Tag regions must pair closing tags with the most recent opening tag, in the order of closing tags"
+        )
+
+    def test_find_source_phrase_regions(self):
+        r = reinsertion.Reinserter('full')
+        # phrases in target order
+        segmentation = {(3,4):(0,1), (0,0):(2,2), (1,2):(3,4), (5,5):(5,5)}
+        phrase_index = reinsertion._SourcePhraseIndex(segmentation)
+        self.assertEqual(
+            r._find_source_phrase_regions([0, 1], phrase_index),
+            [(0,0), (1,2)],
+            "Source phrase regions must contain all phrases that overlap the source tag region"
+        )
+        self.assertEqual(
+            r._find_source_phrase_regions([2, 3, 4, 5], phrase_index),
+            [(3,4)],
+            "Source phrase regions must be contiguous in the order of the segmentation"
+        )
+
+    def test_apply_changes(self):
+        self.assertEqual(
+            reinsertion._apply_changes(["a", "b"], [(1, "<i>"), (0, "<b>"), (1, "</i>"), (3, "</b>"), (2, "<x/>")]),
+            ["<b>", "a", "</i>", "<i>", "b", "<x/>", "</b>"],
+            "Changes must be applied as if inserted one by one in reverse order of their positions"
+        )
+
+    test_cases_tokenize_keep_markup = [
+        ("", []),
+        ("a  b\tc \n d", ["a", "b\tc", "d"]),
+        ("das ist <b> ein </b> test", ["das", "ist", "<b>", "ein", "</b>", "test"]),
+        ('<ph id="1" x = \'a b\'/> <b></b> <i> </i>', ['<ph id="1" x="a b"/>', "<b/>", "<i>", "</i>"]),
+        ('<a t="&amp;&#10;\tx"> y </a >', ['<a t="&amp;&#10; x">', "y", "</a>"]),
+        ("a&amp;b &#91; &gt; > c", ["a", "&amp;", "b", "[", "&gt;", "&gt;", "c"]),
+        ("<!-- comment --> a <![CDATA[ b c ]]>", ["a", "b", "c"])
+    ]
+
+    def test_tokenize_keep_markup(self):
+        for string, tokens in self.test_cases_tokenize_keep_markup:
+            self.assertEqual(
+                reinsertion.tokenize_keep_markup(string),
+                tokens,
+                "Markup-aware tokenization must not split XML element tags"
+            )
+            self.assertEqual(
+                reinsertion.tokenize_keep_markup(string),
+                reinsertion._tokenize_keep_markup_sax(string),
+                "Markup-aware tokenization must be identical to parsing with SAX"
+            )
+
+    def test_tokenize_keep_markup_not_well_formed(self):
+        for string in ["<b> a", "a </b>", "<b> </i>", "a &nbsp; b", "a & b", "a < b", '<a x="1" x="2"/>', "&#0;"]:
+            with self.assertRaises(Exception):
+                reinsertion.tokenize_keep_markup(string)
+
     def test_unknown_strategy_raises_error(self):
         with self.assertRaises(NotImplementedError):
             r = reinsertion.Reinserter('unknown strategy')
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+import urllib.request
+import urllib.error
+
+from unittest import TestCase
+
+from mtrain.server import TranslationServer
+
+class _UppercasingEngine(object):
+    '''
+    Stand-in for a translation engine, optionally blocking until released.
+    '''
+    def __init__(self, block=False):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def translate_segments(self, segments, **kwargs):
+        self.started.set()
+        self.release.wait()
+        self.batches.append(segments)
+        return [segment.upper() for segment in segments]
+
+class TestTranslationServer(TestCase):
+
+    def _post(self, server, body):
+        host, port = server.address
+        request = urllib.request.Request(
+            "http://%s:%d/translate" % (host, port),
+            data=json.dumps(body).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def _start(self, engine, **kwargs):
+        server = TranslationServer(engine, port=0, **kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_translate(self):
+        server = self._start(_UppercasingEngine())
+        response = self._post(server, {"segments": ["ein Satz", "", "ähnlich"]})
+        self.assertEqual(response, {"translations": ["EIN SATZ", "", "ÄHNLICH"]},
+            "Server must return one translation per segment, empty segments stay empty")
+
+    def test_postprocess(self):
+        server = self._start(_UppercasingEngine(), postprocess=lambda source, translation: source + translation)
+        response = self._post(server, {"segments": ["ein", "", "zwei"]})
+        self.assertEqual(response, {"translations": ["einEIN", "", "zweiZWEI"]},
+            "Server must apply postprocessing to each source segment and its translation")
+
+    def test_bad_request(self):
+        server = self._start(_UppercasingEngine())
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._post(server, {"segment": "ein Satz"})
+        self.assertEqual(context.exception.code, 400)
+
+    def test_backpressure(self):
+        engine = _UppercasingEngine(block=True)
+        server = self._start(engine, max_queue_size=1)
+        # one request is being translated, one waits in the queue
+        waiting = [server.submit(["a"])]
+        engine.started.wait()
+        waiting.append(server.submit(["b"]))
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._post(server, {"segments": ["d"]})
+        self.assertEqual(context.exception.code, 503,
+            "Server must reject requests if the queue is full")
+        engine.release.set()
+        for request in waiting:
+            request.done.wait()
+            self.assertEqual(request.translations, [s.upper() for s in request.segments])
+
+    def test_batching(self):
+        engine = _UppercasingEngine(block=True)
+        server = self._start(engine, max_queue_size=10, max_batch_size=3)
+        requests = [server.submit([str(i)]) for i in range(5)]
+        engine.release.set()
+        for i, request in enumerate(requests):
+            request.done.wait()
+            self.assertEqual(request.translations, [str(i)])
+        self.assertTrue(max(len(batch) for batch in engine.batches) > 1,
+            "Waiting requests must be translated together")
+        self.assertTrue(max(len(batch) for batch in engine.batches) <= 3)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import os
+
+from mtrain.test.test_case_with_cleanup import TestCaseWithCleanup
+from mtrain.preprocessing import sharding
+
+class _Concatenator(object):
+    '''
+    Minimal processor for process_parallel_corpus.
+    '''
+    def load(self):
+        self.loaded = True
+
+    def process(self, segment_source, segment_target):
+        return segment_source.strip() + "|" + segment_target.strip()
+
+class TestSharding(TestCaseWithCleanup):
+
+    def _write(self, filename, lines, final_newline=True):
+        path = os.sep.join([self._basedir_test_cases, filename])
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + ("\n" if final_newline else ""))
+        return path
+
+    def _read_shards(self, path_source, path_target, num_shards):
+        bisegments = []
+        for (start_source, end_source), (start_target, end_target) in sharding.shard_boundaries(path_source, path_target, num_shards):
+            bisegments.extend(zip(
+                sharding.read_lines(path_source, start_source, end_source),
+                sharding.read_lines(path_target, start_target, end_target)
+            ))
+        return bisegments
+
+    def test_shards_are_line_aligned(self):
+        source = ["%d %s" % (i, "ä" * (i % 7)) for i in range(100)]
+        target = ["%d %s" % (i, "b" * (i % 13)) for i in range(100)]
+        path_source = self._write("shards.src", source)
+        path_target = self._write("shards.trg", target)
+        with open(path_source) as f_source, open(path_target) as f_target:
+            expected = list(zip(f_source, f_target))
+        for num_shards in [1, 2, 7, 100, 150]:
+            self.assertEqual(self._read_shards(path_source, path_target, num_shards), expected)
+
+    def test_shards_without_final_newline(self):
+        path_source = self._write("no-newline.src", ["a", "b", "c"], final_newline=False)
+        path_target = self._write("no-newline.trg", ["x", "y", "z"], final_newline=False)
+        self.assertEqual(
+            self._read_shards(path_source, path_target, 3),
+            [("a\n", "x\n"), ("b\n", "y\n"), ("c", "z")]
+        )
+
+    def test_process_parallel_corpus_keeps_order(self):
+        source = ["source %d" % i for i in range(1000)]
+        target = ["target %d" % i for i in range(1000)]
+        path_source = self._write("order.src", source)
+        path_target = self._write("order.trg", target)
+        expected = ["%s|%s" % bisegment for bisegment in zip(source, target)]
+        for num_workers in [1, 4]:
+            results = sharding.process_parallel_corpus(
+                _Concatenator(),
+                path_source,
+                path_target,
+                num_workers=num_workers,
+                temp_dir=self._basedir_test_cases
+            )
+            self.assertEqual(list(results), expected)
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import os
+import asyncio
 from unittest import TestCase
 
 from mtrain.preprocessing.tokenizer import Tokenizer
+from mtrain.preprocessing.moses_tokenizer import MosesTokenizer, MosesDetokenizer, load_nonbreaking_prefixes
 from mtrain.constants import *
 
 class TestTokenizer(TestCase):
@@ -31,3 +34,85 @@ class TestTokenizer(TestCase):
                 "Tokenizer must replace special char `%s` with `%s`" % (char, replacement)
             )
         t.close()
+
+    def _test_tokenize_async(self, backend):
+        t = Tokenizer('en', backend=backend, asynchronous=True)
+        loop = asyncio.new_event_loop()
+        self.assertEqual(
+            loop.run_until_complete(t.tokenize_async("alpha, beta")),
+            t.tokenize("alpha, beta"),
+            "Tokenizing in a coroutine must give the same result"
+        )
+        loop.close()
+        t.close()
+
+    def test_tokenize_async_perl(self):
+        self._test_tokenize_async(TOKENIZER_BACKEND_PERL)
+
+    def test_tokenize_async_python(self):
+        self._test_tokenize_async(TOKENIZER_BACKEND_PYTHON)
+
+
+class TestMosesTokenizerParity(TestCase):
+    '''
+    Compares the in-process (de-)tokenizer to outputs of the Moses Perl
+    scripts stored in `test/data/tokenizer`: for every `<name>.txt`,
+    `<name>.perl.txt` holds the output of the corresponding Perl script.
+    '''
+
+    DATA = os.sep.join([os.path.dirname(os.path.abspath(__file__)), 'data'])
+    FIXTURES = os.sep.join([DATA, 'tokenizer'])
+    PREFIXES = os.sep.join([DATA, 'nonbreaking_prefixes'])
+    PROTECTED_PATTERNS = os.sep.join([DATA, 'protected-patterns.dat'])
+
+    def _assert_parity(self, name, processor):
+        with open(os.sep.join([self.FIXTURES, name + '.txt']), encoding='utf-8') as f:
+            segments = f.read().splitlines()
+        with open(os.sep.join([self.FIXTURES, name + '.perl.txt']), encoding='utf-8') as f:
+            expected = f.read().splitlines()
+        for segment, expected_segment in zip(segments, expected):
+            self.assertEqual(
+                processor.process(segment),
+                expected_segment,
+                "In-process implementation must process `%s` like the Moses script" % segment
+            )
+        self.assertEqual(processor.process_batch(segments), expected)
+
+    def test_tokenize_en(self):
+        self._assert_parity('tokenize.en', MosesTokenizer('en', prefixes_dir=self.PREFIXES))
+
+    def test_tokenize_fr(self):
+        self._assert_parity('tokenize.fr', MosesTokenizer('fr', prefixes_dir=self.PREFIXES))
+
+    def test_tokenize_protected_no_escape(self):
+        t = MosesTokenizer(
+            'en',
+            protected_patterns_path=self.PROTECTED_PATTERNS,
+            escape=False,
+            prefixes_dir=self.PREFIXES
+        )
+        self._assert_parity('tokenize-protected.en', t)
+
+    def test_tokenize_not_aggressive(self):
+        t = MosesTokenizer('en', aggressive=False, prefixes_dir=self.PREFIXES)
+        self.assertEqual(t.process("a test-case"), "a test-case")
+
+    def test_detokenize_en(self):
+        self._assert_parity('detokenize.en', MosesDetokenizer('en'))
+
+    def test_detokenize_fr(self):
+        self._assert_parity('detokenize.fr', MosesDetokenizer('fr'))
+
+    def test_detokenize_uppercase_first_letter(self):
+        d = MosesDetokenizer('en', uppercase_first_letter=True)
+        self.assertEqual(d.process("&quot; hello , world &quot;"), '"Hello, world"')
+
+    def test_nonbreaking_prefixes_loaded_once(self):
+        self.assertIs(
+            load_nonbreaking_prefixes('de', self.PREFIXES),
+            load_nonbreaking_prefixes('de', self.PREFIXES)
+        )
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Tokenizer('en', backend='java')
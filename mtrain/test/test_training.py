@@ -8,7 +8,7 @@ import os
 
 from mtrain.test.test_case_with_cleanup import TestCaseWithCleanup, TestCaseHelper
 
-from mtrain.training import TrainingMoses, TrainingNematus
+from mtrain.training import TrainingMoses, TrainingNematus, CorpusPreprocessor
 from mtrain.constants import *
 from mtrain import assertions
 
@@ -97,6 +97,102 @@ class TestTrainingMoses(TestCaseWithCleanup, TestCaseHelper):
             "Number of segments in target side of training corpus must be correct"
         )
 
+    def test_preprocess_base_corpus_sharded(self):
+        '''
+        Preprocessing shards of the base corpus in several processes must
+        result in the same corpora as preprocessing in a single process.
+        '''
+        random_basedir_name = self.get_random_basename()
+        os.mkdir(random_basedir_name)
+        self._create_random_parallel_corpus_files(
+            path=random_basedir_name,
+            filename_source="sample-corpus.en",
+            filename_target="sample-corpus.fr",
+            num_bisegments=500
+        )
+        corpora = []
+        for num_workers in [1, 3]:
+            basedir = os.sep.join([random_basedir_name, str(num_workers)])
+            os.mkdir(basedir)
+            t = TrainingMoses(basedir, "en", "fr", SELFCASING, 50, 20, None, XML_PASS_THROUGH)
+            t.preprocess(os.sep.join([random_basedir_name, "sample-corpus"]), 2, 5, True, False, False, num_workers=num_workers)
+            contents = {}
+            for basename in [BASENAME_TRAINING_CORPUS, BASENAME_TUNING_CORPUS, BASENAME_EVALUATION_CORPUS]:
+                for lang in ["en", "fr"]:
+                    with open(os.sep.join([basedir, "corpus", basename + "." + lang])) as f:
+                        contents[basename + "." + lang] = f.read()
+            self.assertFalse(
+                [filename for filename in os.listdir(os.sep.join([basedir, "corpus"])) if filename.startswith("shard.")],
+                "Temporary files of shards must be removed"
+            )
+            corpora.append(contents)
+        self.assertEqual(corpora[0], corpora[1])
+
+    def test_preprocess_base_corpus_seed(self):
+        '''
+        Trainings with the same seed must select the same segments for tuning
+        and evaluation, every segment must be in exactly one corpus.
+        '''
+        random_basedir_name = self.get_random_basename()
+        os.mkdir(random_basedir_name)
+        self._create_random_parallel_corpus_files(
+            path=random_basedir_name,
+            filename_source="sample-corpus.en",
+            filename_target="sample-corpus.fr",
+            num_bisegments=300
+        )
+        corpora = []
+        for run, seed in enumerate([7, 7, 8]):
+            basedir = os.sep.join([random_basedir_name, str(run)])
+            os.mkdir(basedir)
+            t = TrainingMoses(basedir, "en", "fr", SELFCASING, 50, 20, None, XML_PASS_THROUGH)
+            t.preprocess(os.sep.join([random_basedir_name, "sample-corpus"]), 1, 80, True, False, False, seed=seed)
+            contents = {}
+            for basename in [BASENAME_TRAINING_CORPUS, BASENAME_TUNING_CORPUS, BASENAME_EVALUATION_CORPUS]:
+                with open(os.sep.join([basedir, "corpus", basename + ".en"])) as f:
+                    contents[basename] = f.read().splitlines()
+            self.assertEqual(len(contents[BASENAME_TUNING_CORPUS]), 50)
+            self.assertEqual(len(contents[BASENAME_EVALUATION_CORPUS]), 20)
+            self.assertEqual(
+                len(set(contents[BASENAME_TRAINING_CORPUS] + contents[BASENAME_TUNING_CORPUS] + contents[BASENAME_EVALUATION_CORPUS])),
+                300,
+                "Every segment must be in exactly one corpus"
+            )
+            self.assertFalse(
+                [filename for filename in os.listdir(os.sep.join([basedir, "corpus"])) if SUFFIX_UNSPLIT in filename],
+                "Temporary corpora must be removed"
+            )
+            corpora.append(contents)
+        self.assertEqual(corpora[0], corpora[1])
+        self.assertNotEqual(corpora[0], corpora[2])
+
+    def test_corpus_preprocessor_tokenizes_once(self):
+        '''
+        Checking the length of a bisegment and preprocessing it must tokenize
+        each segment only once.
+        '''
+        class CountingTokenizer(object):
+            def __init__(self):
+                self.num_calls = 0
+            def tokenize(self, segment, split=True):
+                self.num_calls += 1
+                return segment.replace(",", " ,")
+
+        tokenizer_source, tokenizer_target = CountingTokenizer(), CountingTokenizer()
+        preprocessor = CorpusPreprocessor("en", "fr", 1, 5, xml_strategy=XML_PASS_THROUGH)
+        preprocessor.use(tokenizer_source, tokenizer_target)
+        self.assertEqual(
+            preprocessor.process("Hello, world\n", "Bonjour, monde\n"),
+            (0, ("Hello, world\n", "Bonjour, monde\n", "Hello , world", "Bonjour , monde"))
+        )
+        self.assertEqual(
+            preprocessor.process("a b c d e f\n", "a\n"),
+            (0, None),
+            "Bisegments with too many tokens must be discarded"
+        )
+        self.assertEqual(tokenizer_source.num_calls, 2)
+        self.assertEqual(tokenizer_target.num_calls, 1)
+
     def test_preprocess_base_corpus_correct_number_of_lines_train_tune_eval(self):
         random_basedir_name = self.get_random_basename()
         os.mkdir(random_basedir_name)
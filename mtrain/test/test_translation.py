@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import asyncio
+import tempfile
+
+from unittest import TestCase
+
+from mtrain import constants as C
+from mtrain.cache import TranslationCache
+from mtrain.engine import EngineMoses, TranslatedSegment
+from mtrain.preprocessing.external import AsyncExternalProcessor
+from mtrain.preprocessing.masking import Masker
+from mtrain.preprocessing.tokenizer import Tokenizer, Detokenizer
+from mtrain.translation import TranslationEngineMoses, AsyncTranslationEngineMoses, TranslationEngineNematus
+
+class _FlushCountingIO(io.StringIO):
+
+    def __init__(self):
+        super(_FlushCountingIO, self).__init__()
+        self.lines_at_flush = []
+
+    def flush(self):
+        self.lines_at_flush.append(self.getvalue().count("\n"))
+        super(_FlushCountingIO, self).flush()
+
+class _ReversingEngine(object):
+    '''
+    Stand-in for a Moses engine that reverses the order of tokens and reports
+    the corresponding alignment and segmentation.
+    '''
+    def __init__(self):
+        self.segments = []
+
+    def translate_segment(self, segment):
+        self.segments.append(segment)
+        tokens = segment.split(" ")
+        last = len(tokens) - 1
+        return TranslatedSegment(
+            " ".join(reversed(tokens)),
+            alignment={i: [last - i] for i in range(len(tokens))},
+            segmentation={(0, last): (0, last)}
+        )
+
+    def translate_segments(self, segments):
+        return [self.translate_segment(segment) for segment in segments]
+
+    def translate_file(self, input_path, output_path, num_threads=1):
+        self.temp_paths = [input_path, output_path]
+        with open(input_path, encoding="utf-8") as input_handle:
+            self._file_translations = self.translate_segments([line.rstrip("\n") for line in input_handle])
+
+    def read_translations(self, output_path):
+        return iter(self._file_translations)
+
+    def close(self):
+        pass
+
+def _create_moses_engine(engine_class=TranslationEngineMoses, masking_strategy=None):
+    '''
+    Creates a Moses translation engine without trained model, with a
+    _ReversingEngine and in-process components.
+    '''
+    engine = engine_class.__new__(engine_class)
+    engine._casing_strategy = C.SELFCASING
+    engine._masking_strategy = masking_strategy
+    engine._xml_strategy = None
+    engine._cache = None
+    engine._engine = _ReversingEngine()
+    protected_patterns_path = os.sep.join([os.path.dirname(os.path.abspath(__file__)), 'data', C.PROTECTED_PATTERNS_FILE_NAME])
+    engine._tokenizer = Tokenizer('en', protect=masking_strategy is not None, protected_patterns_path=protected_patterns_path,
+                                  escape=masking_strategy is None, backend=C.TOKENIZER_BACKEND_PYTHON)
+    engine._detokenizer = Detokenizer('en', backend=C.TOKENIZER_BACKEND_PYTHON)
+    if masking_strategy is not None:
+        engine._masker = Masker(masking_strategy)
+    return engine
+
+class TestTranslationEngineMoses(TestCase):
+
+    segments = [
+        "Hello World !",
+        "Visit https://www.example.com for details .",
+        "Write to info@example.com or https://example.org , please .",
+        "The end"
+    ]
+
+    def test_translate_segments_like_translate_segment(self):
+        for masking_strategy in [None, C.MASKING_IDENTITY, C.MASKING_ALIGNMENT]:
+            engine = _create_moses_engine(masking_strategy=masking_strategy)
+            self.assertEqual(
+                engine.translate_segments(self.segments),
+                [engine.translate_segment(segment) for segment in self.segments],
+                "Batched pre- and postprocessing must give the same results as the per-segment path, masking: %s" % masking_strategy
+            )
+
+    def test_translate_segments_restores_masked_content(self):
+        engine = _create_moses_engine(masking_strategy=C.MASKING_IDENTITY)
+        self.assertEqual(
+            engine.translate_segments(self.segments[1:2]),
+            [". details for https://www.example.com visit"]
+        )
+
+    def _create_cached_engine(self):
+        # the second segment is cached already, with a translation the
+        # _ReversingEngine would not produce
+        engine = _create_moses_engine(masking_strategy=C.MASKING_IDENTITY)
+        engine._cache = TranslationCache("test")
+        engine._cache.put(self.segments[1], "cached translation", preprocess=True, lowercase=False, detokenize=True)
+        return engine
+
+    def test_translate_file_pipelined_like_translate_segment(self):
+        engine = self._create_cached_engine()
+        expected = "".join(engine.translate_segment(segment) + "\n" for segment in self.segments)
+
+        engine = self._create_cached_engine()
+        output_handle = io.StringIO()
+        engine.translate_file(io.StringIO("".join(segment + "\n" for segment in self.segments)), output_handle)
+        self.assertEqual(output_handle.getvalue(), expected,
+            "Pipelined translation must write the same translations in the same order as the per-segment path")
+        self.assertEqual(output_handle.getvalue().split("\n")[1], "cached translation")
+        self.assertEqual(len(engine._engine.segments), len(self.segments) - 1,
+            "Cached segments must not be translated by the engine")
+        self.assertEqual(
+            engine._cache.get(self.segments[0], preprocess=True, lowercase=False, detokenize=True),
+            output_handle.getvalue().split("\n")[0],
+            "Pipelined translations must be cached"
+        )
+
+    def test_translate_file_with_threads_like_translate_segment(self):
+        engine = self._create_cached_engine()
+        expected = "".join(engine.translate_segment(segment) + "\n" for segment in self.segments)
+
+        engine = self._create_cached_engine()
+        output_handle = io.StringIO()
+        engine.translate_file(io.StringIO("".join(segment + "\n" for segment in self.segments)), output_handle, num_threads=4)
+        self.assertEqual(output_handle.getvalue(), expected,
+            "Translation in a single Moses run must write the same translations in the same order as the per-segment path")
+        self.assertEqual(len(engine._engine.segments), len(self.segments) - 1,
+            "Cached segments must not be translated by the engine")
+        self.assertEqual(
+            engine._cache.get(self.segments[0], preprocess=True, lowercase=False, detokenize=True),
+            output_handle.getvalue().split("\n")[0],
+            "Translations of a single Moses run must be cached"
+        )
+        self.assertFalse(any(os.path.exists(path) for path in engine._engine.temp_paths),
+            "Temporary files must be removed")
+
+class TestAsyncTranslationEngineMoses(TestCase):
+
+    segments = ["Segment %d , in order" % i for i in range(40)]
+
+    def _create_engine(self):
+        # an engine whose Moses process is replaced by a process that reverses
+        # the order of tokens, like _ReversingEngine
+        engine = _create_moses_engine(AsyncTranslationEngineMoses)
+        engine._max_in_flight = 8
+        engine._engine = EngineMoses.__new__(EngineMoses)
+        engine._engine._report_alignment = False
+        engine._engine._report_segmentation = False
+        engine._engine._processor = AsyncExternalProcessor(
+            "%s -u -c \"import sys; [print(' '.join(reversed(line.split())), flush=True) for line in iter(sys.stdin.readline, '')]\"" % sys.executable
+        )
+        return engine
+
+    def _run(self, engine, coroutine):
+        async def _run_and_close():
+            try:
+                return await coroutine
+            finally:
+                engine._engine._processor.close()
+                await engine._engine._processor.wait_closed()
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(_run_and_close())
+        finally:
+            loop.close()
+
+    def _expected(self, segments):
+        engine = _create_moses_engine()
+        return [engine.translate_segment(segment) for segment in segments]
+
+    def test_translate_segments_keeps_order(self):
+        engine = self._create_engine()
+        self.assertEqual(self._run(engine, engine.translate_segments(self.segments)), self._expected(self.segments),
+            "Concurrently translated segments must be returned in order")
+
+    def test_translate_stream_keeps_order(self):
+        async def _segments():
+            for i, segment in enumerate(self.segments):
+                if i % 7 == 0:
+                    await asyncio.sleep(0.001)
+                yield segment
+
+        async def _translate(engine):
+            return [translation async for translation in engine.translate_stream(_segments())]
+
+        engine = self._create_engine()
+        self.assertEqual(self._run(engine, _translate(engine)), self._expected(self.segments),
+            "Translations of a stream must be yielded in order")
+
+    def test_translate_segments_persistent_cache(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            engine = self._create_engine()
+            engine._cache = TranslationCache("test", path=os.sep.join([tempdir, "cache.sqlite"]))
+            engine._cache.put(self.segments[1], "cached translation", preprocess=True, lowercase=False, detokenize=True)
+            expected = self._expected(self.segments[:3])
+            expected[1] = "cached translation"
+            self.assertEqual(self._run(engine, engine.translate_segments(self.segments[:3])), expected,
+                "Cached and new translations must be returned in order")
+            self.assertEqual(engine._cache.get(self.segments[0], preprocess=True, lowercase=False, detokenize=True), expected[0],
+                "New translations must be cached")
+            engine._cache.close()
+
+    def test_cancel_does_not_desynchronise(self):
+        async def _translate(engine):
+            await engine.translate_segment("warm up")
+            cancelled = asyncio.ensure_future(engine.translate_segment("cancelled segment"))
+            for _ in range(5):
+                await asyncio.sleep(0)
+            cancelled.cancel()
+            translations = await engine.translate_segments(self.segments[:5])
+            return cancelled.cancelled(), translations
+
+        engine = self._create_engine()
+        cancelled, translations = self._run(engine, _translate(engine))
+        self.assertTrue(cancelled)
+        self.assertEqual(translations, self._expected(self.segments[:5]),
+            "Segments translated after a cancelled one must get their own translations")
+
+class TestTranslationEngineNematus(TestCase):
+
+    def _create_engine(self):
+        # an engine without model and components, translating to uppercase
+        engine = TranslationEngineNematus.__new__(TranslationEngineNematus)
+        engine.translate_segments = lambda segments: [segment.upper() for segment in segments]
+        return engine
+
+    def test_translate_file_in_chunks(self):
+        engine = self._create_engine()
+        input_handle = io.StringIO("".join("segment %d\n" % i for i in range(7)))
+        output_handle = _FlushCountingIO()
+        engine.translate_file(input_handle, output_handle, chunk_size=3)
+        self.assertEqual(output_handle.getvalue(), "".join("SEGMENT %d\n" % i for i in range(7)))
+        self.assertEqual(output_handle.lines_at_flush, [3, 6, 7],
+            "Translations must be written and flushed after each chunk")
@@ -7,6 +7,7 @@ from mtrain.test.test_case_with_cleanup import TestCaseWithCleanup, TestCaseHelp
 from mtrain.preprocessing.normalizer import Normalizer
 from mtrain.preprocessing.tokenizer import Tokenizer, Detokenizer
 from mtrain.preprocessing.truecaser import Truecaser, Detruecaser
+from mtrain.preprocessing.moses_truecaser import compile_model, MappedTruecasingModel
 from mtrain.training import TrainingNematus
 from mtrain.constants import *
 from mtrain import commander
@@ -180,3 +181,68 @@ class TestDetruecaser(TestCase):
         for example_segment, detruecased_segment in self.test_cases.items():
             self.assertEqual(detruecaser.detruecase(example_segment), detruecased_segment)
         detruecaser.close()
+
+class TestMosesTruecaser(TestCaseWithCleanup):
+    '''
+    Compares the in-process truecaser to outputs of `truecase.perl` and
+    `detruecase.perl` for a small model.
+    '''
+    # model as written by train-truecaser.perl
+    model = "\n".join([
+        "the (5/6) The (1)",
+        "Obama (3/3)",
+        "this (2/3) This (1)",
+        "is (4/4)",
+        "in (3/4) In (1)",
+        "English (1/1)",
+    ]) + "\n"
+
+    # segment: output of truecase.perl
+    test_cases = {
+        'This is Obama .': 'this is Obama .',
+        'The OBAMA is in the THE .': 'the Obama is in the the .',
+        '&quot; This is . &quot; In English': '&quot; this is . &quot; in English',
+        'Unknown This|X|Y words': 'Unknown This|X|Y words',
+        '<b> This </b> is <i/>': '<b> this</b> is<i/>', # sic
+        '': '',
+    }
+
+    def _write_model(self):
+        path_model = os.sep.join([self._basedir_test_cases, 'model.en'])
+        with open(path_model, 'w', encoding='utf-8') as f:
+            f.write(self.model)
+        return path_model
+
+    def _assert_truecases(self, truecaser):
+        for segment, truecased_segment in self.test_cases.items():
+            self.assertEqual(truecaser.truecase_segment(segment), truecased_segment)
+        self.assertEqual(
+            truecaser.truecase_batch(list(self.test_cases.keys())),
+            list(self.test_cases.values())
+        )
+        self.assertEqual(truecaser.truecase_tokens(['In', 'English']), ['in', 'English'])
+
+    def test_truecase(self):
+        truecaser = Truecaser(self._write_model(), backend=TRUECASER_BACKEND_PYTHON)
+        self._assert_truecases(truecaser)
+        truecaser.close()
+
+    def test_truecase_mapped_model(self):
+        path_binary = compile_model(self._write_model())
+        self.assertTrue(path_binary.endswith(TRUECASING_BINARY_MODEL_SUFFIX))
+        truecaser = Truecaser(path_binary[:-len(TRUECASING_BINARY_MODEL_SUFFIX)], backend=TRUECASER_BACKEND_PYTHON)
+        self.assertIsInstance(truecaser._processor._model, MappedTruecasingModel)
+        self._assert_truecases(truecaser)
+        truecaser.close()
+
+    def test_detruecase(self):
+        detruecaser = Detruecaser(backend=TRUECASER_BACKEND_PYTHON)
+        self.assertEqual(
+            detruecaser.detruecase_segment('this is it . &quot; and ( then ) ! ändern'),
+            'This is it . &quot; And ( then ) ! Ändern'
+        )
+        self.assertEqual(
+            detruecaser.detruecase_batch(['in conclusion , Obama', '  ']),
+            ['In conclusion , Obama', '']
+        )
+        detruecaser.close()
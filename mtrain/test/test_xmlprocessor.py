@@ -2,6 +2,7 @@
 
 from unittest import TestCase
 
+from mtrain.preprocessing import xmlprocessor
 from mtrain.preprocessing.xmlprocessor import *
 from mtrain.constants import *
 
@@ -22,3 +23,37 @@ class TestXmlProcessor(TestCase):
                 x._strip_markup(input) == output,
                 "XML processor did not remove all markup from string or removed too much"
             )
+
+    test_cases_xmlprocessor_markup_stripping_references = [
+        # segment, keep_escaped_markup, result
+        ("Tom &amp; Jerry", True, "Tom &amp;amp; Jerry"),
+        ("a <b x=\"1 &gt; 0\">b</b> &#91;c&#x5d;", True, "a b &#91;c&#93;"),
+        ("a &lt;i&gt;b&lt;/i&gt;", True, "a &amp;lt;i&amp;gt;b&amp;lt;/i&amp;gt;"),
+        ("a &lt;i&gt;b&lt;/i&gt;", False, "a b"),
+        # not well-formed, stripped with the fall back strategy
+        ("Tom & Jerry", True, "Tom &amp;amp; Jerry"),
+        ("a <b> c", True, "a c"),
+        ("x < y", True, "x &amp;lt; y"),
+        # handled by lxml
+        ("a <!-- b --> c <![CDATA[<d>]]>", True, "a c &amp;lt;d&amp;gt;"),
+        ("a\r\nb", True, "a\nb")
+    ]
+
+    def test_xmlprocessor_markup_stripping_references(self):
+        x = XmlProcessor('strip')
+        for input, keep_escaped_markup, output in self.test_cases_xmlprocessor_markup_stripping_references:
+            self.assertEqual(
+                x._strip_markup(input, keep_escaped_markup),
+                output,
+                "XML processor must resolve references and escape the remaining text"
+            )
+
+    def test_text_content(self):
+        self.assertEqual(xmlprocessor._text_content("a <b x='1'>b &amp;</b><i/>"), "a b &")
+        self.assertIsNone(xmlprocessor._text_content("a <!-- b -->"),
+            "Comments must be left to lxml")
+        self.assertIsNone(xmlprocessor._text_content("<a:b/>"),
+            "Namespaced elements must be left to lxml")
+        for segment in ["a </b>", "<b> a", "<b> </i>", "a & b", "&nbsp;", "&#0;", "a < b", "<b x='1' x='2'/>"]:
+            with self.assertRaises(ValueError):
+                xmlprocessor._text_content(segment)
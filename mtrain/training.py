@@ -7,18 +7,185 @@ import re
 import abc
 
 from abc import ABCMeta
+from array import array
 from mtrain.utils import symlink
 
 from mtrain import assertions, commander
 from mtrain import evaluator
 from mtrain import constants as C
-from mtrain.corpus import ParallelCorpus
+from mtrain.corpus import ParallelCorpus, ReservoirSampler
 from mtrain.preprocessing import lowercaser, reinsertion
 from mtrain.preprocessing.normalizer import Normalizer
 from mtrain.preprocessing.tokenizer import Tokenizer
+from mtrain.preprocessing.moses_truecaser import compile_model as compile_truecasing_model
 from mtrain.preprocessing.masking import Masker, write_masking_patterns
 from mtrain.preprocessing.xmlprocessor import XmlProcessor
 from mtrain.preprocessing.bpe import BytePairEncoderFile
+from mtrain.preprocessing.sharding import process_parallel_corpus
+
+
+class CorpusPreprocessor(object):
+    '''
+    Checks the lengths of bisegments in a base corpus and preprocesses them.
+    Components are not pickled, so that the preprocessor can be sent to
+    worker processes that load their own components (see
+    `sharding.process_parallel_corpus`).
+    '''
+
+    def __init__(self, src_lang, trg_lang, min_tokens, max_tokens, protected_patterns_path=None,
+                 masking_strategy=None, xml_strategy=None, mask=False, process_xml=False, preprocess=True):
+        '''
+        @param src_lang the language code of the source language
+        @param trg_lang the language code of the target language
+        @param min_tokens minimal number of tokens in a segment
+        @param max_tokens maximal number of tokens in a segment
+        @param protected_patterns_path path to patterns the tokenizers should
+            protect, None if they should not protect any patterns
+        @param masking_strategy whether and how mask tokens should be
+            introduced into segments
+        @param xml_strategy whether fragments of markup in the data should be
+            passed through, removed or masked
+        @param mask whether or not segments should be masked
+        @param process_xml whether or not the XML processing strategy should be
+            applied to segments
+        @param preprocess whether segments should be preprocessed, or only
+            their lengths checked
+        '''
+        self._src_lang = src_lang
+        self._trg_lang = trg_lang
+        self._min_tokens = min_tokens
+        self._max_tokens = max_tokens
+        self._protected_patterns_path = protected_patterns_path
+        self._masking_strategy = masking_strategy
+        self._xml_strategy = xml_strategy
+        self._mask = mask
+        self._process_xml = process_xml
+        self._preprocess = preprocess
+        self._tokenizer_source = None
+        self._tokenizer_target = None
+        self._masker = None
+        self._xml_processor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for component in ['_tokenizer_source', '_tokenizer_target', '_masker', '_xml_processor']:
+            state[component] = None
+        return state
+
+    def load(self):
+        '''
+        Creates tokenizers, masker and XML processor.
+        '''
+        if self._protected_patterns_path:
+            self._tokenizer_source = Tokenizer(self._src_lang, protect=True, protected_patterns_path=self._protected_patterns_path, escape=False)
+            self._tokenizer_target = Tokenizer(self._trg_lang, protect=True, protected_patterns_path=self._protected_patterns_path, escape=False)
+        else:
+            self._tokenizer_source = Tokenizer(self._src_lang)
+            self._tokenizer_target = Tokenizer(self._trg_lang)
+        if self._masking_strategy:
+            self._masker = Masker(self._masking_strategy, escape=True)
+        self._xml_processor = XmlProcessor(self._xml_strategy)
+
+    def use(self, tokenizer_source, tokenizer_target, masker=None, xml_processor=None):
+        '''
+        Uses existing components instead of loading new ones.
+        '''
+        self._tokenizer_source = tokenizer_source
+        self._tokenizer_target = tokenizer_target
+        self._masker = masker
+        self._xml_processor = xml_processor
+
+    def _preprocess_tokenized(self, segment, masked_segment=None):
+        '''
+        Processes markup in and masks a tokenized @param segment. Reuses
+        @param masked_segment, the masked form of @param segment, if markup
+        processing does not change the segment before masking.
+        '''
+        xml_processor = self._xml_processor if self._process_xml and self._xml_strategy else None
+        if xml_processor is not None:
+            segment, _ = xml_processor.preprocess_markup(segment)
+        if self._mask and self._masking_strategy:
+            if masked_segment is not None and xml_processor is None:
+                segment = masked_segment
+            else:
+                segment, _ = self._masker.mask_segment(segment)
+        return segment
+
+    def _count_tokens(self, segment):
+        '''
+        Counts the tokens of a tokenized @param segment accurately: masks
+        the segment if there is a masking strategy, XML element tags count as
+        single tokens.
+
+        @return the number of tokens, None if the segment is not well-formed,
+            and the masked segment, None if it was not masked
+        '''
+        masked_segment = None
+        if self._masking_strategy:
+            masked_segment, _ = self._masker.mask_segment(segment)
+        try:
+            tokens = reinsertion.tokenize_keep_markup(masked_segment if masked_segment is not None else segment)
+        except:
+            logging.debug("Segment is not well-formed: '%s'" % segment)
+            return None, masked_segment
+        return len(tokens), masked_segment
+
+    def process(self, segment_source, segment_target):
+        '''
+        Checks the lengths of a bisegment and preprocesses it. Each segment
+        is tokenized (and masked) only once, for both steps.
+
+        @return a tuple of the number of segments that are not well-formed,
+            and a tuple (source segment, target segment, preprocessed source
+            segment, preprocessed target segment), None if the bisegment
+            should be discarded. Without preprocessing, the preprocessed
+            segments are the stripped original segments.
+        '''
+        num_malformed = 0
+        preprocessed = []
+        for segment, tokenizer in [(segment_source, self._tokenizer_source), (segment_target, self._tokenizer_target)]:
+            segment = segment.strip()
+            tokenized_segment = tokenizer.tokenize(segment, split=False)
+            num_tokens, masked_segment = self._count_tokens(tokenized_segment)
+            if num_tokens is None:
+                num_malformed += 1
+            elif self._min_tokens <= num_tokens <= self._max_tokens:
+                if self._preprocess:
+                    preprocessed.append(self._preprocess_tokenized(tokenized_segment, masked_segment))
+                else:
+                    preprocessed.append(segment)
+                continue
+            return num_malformed, None
+        return num_malformed, (segment_source, segment_target) + tuple(preprocessed)
+
+
+def distribute_bisegments(filepaths, routes, default_corpus=None):
+    '''
+    Inserts the bisegments of a parallel corpus into other corpora, by their
+    numbers, in a single pass.
+
+    @param filepaths the paths to the source and target side of the corpus
+    @param routes a list of (numbers, corpus) tuples: the bisegments with
+        the sorted @param numbers (an array) are inserted into the corpus,
+        or skipped if the corpus is None
+    @param default_corpus the corpus for bisegments that are not in any
+        route, skipped if None
+    '''
+    routes = [(iter(numbers), corpus) for numbers, corpus in routes]
+    next_numbers = [next(numbers, None) for numbers, _ in routes]
+    path_source, path_target = filepaths
+    with open(path_source, 'r') as corpus_source, open(path_target, 'r') as corpus_target:
+        for i, (segment_source, segment_target) in enumerate(zip(corpus_source, corpus_target)):
+            corpus = default_corpus
+            for j, (numbers, route_corpus) in enumerate(routes):
+                if next_numbers[j] == i:
+                    corpus = route_corpus
+                    next_numbers[j] = next(numbers, None)
+                    break
+            if corpus is not None:
+                corpus.insert(segment_source, segment_target)
+            elif default_corpus is None and all(number is None for number in next_numbers):
+                break # no more bisegments to insert
 
 
 class TrainingBase(object):
@@ -133,6 +300,7 @@ class TrainingBase(object):
         Create tokenizers: Masking and XML masking strategies have impact on tokenizer behaviour.
         '''
         tokenizer_protects = False
+        self._protected_patterns_path = None
 
         if self._masking_strategy:
             tokenizer_protects = True
@@ -158,6 +326,7 @@ class TrainingBase(object):
                 protected_patterns_path,
                 markup_only=bool(self._xml_strategy)
             )
+            self._protected_patterns_path = protected_patterns_path
 
             self._tokenizer_source = Tokenizer(
                 self._src_lang,
@@ -207,6 +376,9 @@ class TrainingBase(object):
             )
         commands = [command(self._src_lang), command(self._trg_lang)]
         commander.run_parallel(commands, "Training truecasing models")
+        # precompile models so that translation workers can memory-map them
+        for lang in (self._src_lang, self._trg_lang):
+            compile_truecasing_model(os.sep.join([basepath, 'model.%s' % lang]))
 
     def truecase(self):
         '''
@@ -335,7 +507,8 @@ class TrainingBase(object):
                 symlink_path(C.BASENAME_EVALUATION_CORPUS, self._trg_lang)
             )
 
-    def preprocess(self, corpus_base_path, min_tokens, max_tokens, preprocess_external, mask=None, process_xml=None):
+    def preprocess(self, corpus_base_path, min_tokens, max_tokens, preprocess_external, mask=None, process_xml=None,
+                   num_workers=1, seed=C.CORPUS_SPLIT_SEED):
         '''
         Preprocesses the given parallel corpus.
 
@@ -350,6 +523,10 @@ class TrainingBase(object):
         @param mask whether or not segments should be masked
         @param process_xml whether or not the XML processing strategy should be
             applied to segments or not
+        @param num_workers number of processes that preprocess corpora
+        @param seed seed of the random number generator that selects segments
+            for tuning and evaluation from the base corpus, None for a
+            different selection in every run
 
         Note: The source and target side files of the parallel corpus are
             induced from concatenating @param corpus_base_path with
@@ -362,7 +539,7 @@ class TrainingBase(object):
         logging.info("Processing parallel corpus: %s-%s", self._src_lang, self._trg_lang)
 
         # tokenize, clean, mask and split base corpus
-        self._preprocess_base_corpus(corpus_base_path, min_tokens, max_tokens, mask, process_xml)
+        self._preprocess_base_corpus(corpus_base_path, min_tokens, max_tokens, mask, process_xml, num_workers, seed)
         # tokenize, clean, mask and xml-process separate tuning and training corpora (if applicable)
         if isinstance(self._tuning, str):
             self._preprocess_external_corpus(
@@ -371,7 +548,8 @@ class TrainingBase(object):
                 min_tokens,
                 max_tokens,
                 preprocess_external=preprocess_external,
-                process_xml=process_xml
+                process_xml=process_xml,
+                num_workers=num_workers
             )
         if isinstance(self._evaluation, str):
             self._preprocess_external_corpus(
@@ -380,7 +558,8 @@ class TrainingBase(object):
                 min_tokens,
                 max_tokens,
                 preprocess_external=False, # never preprocess EVAL corpus
-                process_xml=process_xml
+                process_xml=process_xml,
+                num_workers=num_workers
             )
         # lowercase as needed
         self._lowercase()
@@ -444,47 +623,33 @@ class TrainingBase(object):
             os.remove("%s/cased.kenlm.gz" % base_dir_recaser)
             os.remove("%s/phrase-table.gz" % base_dir_recaser)
 
-    def _check_segment_length(self, segment, min_tokens, max_tokens, tokenizer,
-                              accurate=False):
+    def _get_corpus_preprocessor(self, min_tokens, max_tokens, mask, process_xml, preprocess=True):
         '''
-        Checks the length of segments (in tokens). An accurate check strips,
-        tokenizes the segment and XML element tags count as single tokens.
-
-        @param segment the segment the length of which should be determined
-        @param min_tokens minimal number of tokens in a segment
-        @param max_tokens maximal number of tokens in a segment
-        @param tokenizer the right tokenizer depending on the language
-        @param accurate whether the counting should be naive (faster) or accurate (slower)
-
-        @return the input segment. None means that the segment should be
-            discarded.
+        Returns a CorpusPreprocessor that uses the components of this
+        training, see CorpusPreprocessor for the parameters.
         '''
-        original_segment = segment
-
-        # more accurate count if preprocessing steps are applied
-        if accurate:
-            segment = segment.strip()
-            segment = tokenizer.tokenize(segment, split=False)
-            if self._masking_strategy:
-                segment, _ = self._masker.mask_segment(segment)
-            try:
-                tokens = reinsertion.tokenize_keep_markup(segment)
-            except:
-                logging.debug("Segment is not well-formed: '%s'" % segment)
-                # segment is not well-formed, discard
-                self._num_malformed_segments += 1
-                return None
-        else:
-            tokens = [token for token in segment.split(" ") if token != '']
-        if len(tokens) < min_tokens or len(tokens) > max_tokens:
-            # None means segment should be discarded
-            return None
-
-        return original_segment
-
-
+        preprocessor = CorpusPreprocessor(
+            self._src_lang,
+            self._trg_lang,
+            min_tokens,
+            max_tokens,
+            protected_patterns_path=self._protected_patterns_path,
+            masking_strategy=self._masking_strategy,
+            xml_strategy=self._xml_strategy,
+            mask=mask,
+            process_xml=process_xml,
+            preprocess=preprocess
+        )
+        preprocessor.use(
+            self._tokenizer_source,
+            self._tokenizer_target,
+            masker=self._masker if self._masking_strategy else None,
+            xml_processor=self._xml_processor
+        )
+        return preprocessor
 
-    def _preprocess_base_corpus(self, corpus_base_path, min_tokens, max_tokens, mask=None, process_xml=None):
+    def _preprocess_base_corpus(self, corpus_base_path, min_tokens, max_tokens, mask=None, process_xml=None,
+                                num_workers=1, seed=C.CORPUS_SPLIT_SEED):
         '''
         Splits @param corpus_base_path into training, tuning, and evaluation
         sections (as applicable). Outputs are stored in /corpus.
@@ -494,96 +659,103 @@ class TrainingBase(object):
         @param mask whether or not masking is applied
         @param process_xml whether or not the XML processing strategy should be
             applied to the segments in base corpus
+        @param num_workers number of processes that check lengths of and
+            preprocess segments, on shards of the base corpus
+        @param seed seed of the random number generator that selects segments
+            for tuning and evaluation
         '''
         # determine number of segments for tuning and evaluation, if any
         num_tune = 0 if not isinstance(self._tuning, int) else self._tuning
         num_eval = 0 if not isinstance(self._evaluation, int) else self._evaluation
-        # open parallel input corpus for reading
-        corpus_source = open(corpus_base_path + "." + self._src_lang, 'r')
-        corpus_target = open(corpus_base_path + "." + self._trg_lang, 'r')
+        num_sample = num_tune + num_eval
+        path_source = corpus_base_path + "." + self._src_lang
+        path_target = corpus_base_path + "." + self._trg_lang
 
-        # create parallel output corpora
         corpus_train = ParallelCorpus(
             self._get_path_corpus(C.BASENAME_TRAINING_CORPUS, self._src_lang),
             self._get_path_corpus(C.BASENAME_TRAINING_CORPUS, self._trg_lang),
-            max_size=None,
-            preprocess=True,
-            tokenize=True,
-            tokenizer_src=self._tokenizer_source,
-            tokenizer_trg=self._tokenizer_target,
-            mask=mask,
-            masker=self._masker if self._masking_strategy else None,
-            process_xml=process_xml,
-            xml_processor=self._xml_processor if self._xml_strategy else None
-        )
-        corpus_tune = ParallelCorpus(
-            self._get_path_corpus(C.BASENAME_TUNING_CORPUS, self._src_lang),
-            self._get_path_corpus(C.BASENAME_TUNING_CORPUS, self._trg_lang),
-            max_size=num_tune,
-            preprocess=True,
-            tokenize=True,
-            tokenizer_src=self._tokenizer_source,
-            tokenizer_trg=self._tokenizer_target,
-            mask=mask,
-            masker=self._masker if self._masking_strategy else None,
-            process_xml=process_xml,
-            xml_processor=self._xml_processor if self._xml_strategy else None
-        )
-        corpus_eval = ParallelCorpus(
-            self._get_path_corpus(C.BASENAME_EVALUATION_CORPUS, self._src_lang),
-            self._get_path_corpus(C.BASENAME_EVALUATION_CORPUS, self._trg_lang),
-            max_size=num_eval,
             preprocess=False
         )
-        # distribute segments from input corpus to output corpora
-        for i, (segment_source, segment_target) in enumerate(zip(corpus_source, corpus_target)):
-            # check lengths of segments
-            segment_source = self._check_segment_length(segment_source,
-                                                        min_tokens,
-                                                        max_tokens,
-                                                        tokenizer=self._tokenizer_source,
-                                                        accurate=True)
-            segment_target = self._check_segment_length(segment_target,
-                                                        min_tokens,
-                                                        max_tokens,
-                                                        tokenizer=self._tokenizer_target,
-                                                        accurate=True)
-            if None in [segment_source, segment_target]:
+        # first pass: preprocess all valid segments and select the numbers of
+        # segments for tuning and evaluation. Without tuning and evaluation,
+        # all valid segments are used for training.
+        if num_sample > 0:
+            corpus_valid = ParallelCorpus(
+                self._get_path_corpus([C.BASENAME_TRAINING_CORPUS, C.SUFFIX_UNSPLIT], self._src_lang),
+                self._get_path_corpus([C.BASENAME_TRAINING_CORPUS, C.SUFFIX_UNSPLIT], self._trg_lang),
+                preprocess=False
+            )
+        else:
+            corpus_valid = corpus_train
+        reservoir = ReservoirSampler(num_sample, random.Random(seed))
+        # the first num_tune positions of the sample are used for tuning
+        sample_segments = array('l', [0]) * num_sample # numbers among valid segments
+        sample_lines = array('l', [0]) * num_sample # line numbers in the base corpus
+        preprocessor = self._get_corpus_preprocessor(min_tokens, max_tokens, mask, process_xml)
+        bisegments = process_parallel_corpus(
+            preprocessor,
+            path_source,
+            path_target,
+            num_workers=num_workers,
+            temp_dir=self._get_path('corpus')
+        )
+        for line_number, (num_malformed, bisegment) in enumerate(bisegments):
+            self._num_malformed_segments += num_malformed
+            if bisegment is None:
                 continue  # discard segments with too few or too many tokens
-            # reservoir sampling (Algorithm R)
-            elif corpus_tune.get_size() < num_tune:
-                corpus_tune.insert(segment_source, segment_target)
-            elif corpus_eval.get_size() < num_eval:
-                corpus_eval.insert(segment_source, segment_target)
+            _, _, preprocessed_source, preprocessed_target = bisegment
+            position = reservoir.offer()
+            if position is not None:
+                sample_segments[position] = corpus_valid.get_size()
+                sample_lines[position] = line_number
+            corpus_valid.insert(preprocessed_source, preprocessed_target)
+        corpus_valid.close()
+
+        # second pass: distribute the selected segments
+        if num_sample > 0:
+            # fewer valid segments than requested fill the tuning corpus first
+            num_selected = min(num_sample, corpus_valid.get_size())
+            tune_segments = array('l', sorted(sample_segments[:min(num_tune, num_selected)]))
+            eval_segments = array('l', sorted(sample_segments[len(tune_segments):num_selected]))
+            eval_lines = array('l', sorted(sample_lines[len(tune_segments):num_selected]))
+            corpus_tune = ParallelCorpus(
+                self._get_path_corpus(C.BASENAME_TUNING_CORPUS, self._src_lang),
+                self._get_path_corpus(C.BASENAME_TUNING_CORPUS, self._trg_lang),
+                preprocess=False
+            )
+            corpus_eval = ParallelCorpus(
+                self._get_path_corpus(C.BASENAME_EVALUATION_CORPUS, self._src_lang),
+                self._get_path_corpus(C.BASENAME_EVALUATION_CORPUS, self._trg_lang),
+                preprocess=False
+            )
+            # preprocessed segments for training and tuning, segments selected
+            # for evaluation are skipped
+            distribute_bisegments(
+                corpus_valid.get_filepaths(),
+                [(tune_segments, corpus_tune), (eval_segments, None)],
+                default_corpus=corpus_train
+            )
+            # the evaluation corpus keeps the original segments
+            distribute_bisegments((path_source, path_target), [(eval_lines, corpus_eval)])
+            corpus_valid.delete()
+            corpus_train.close()
+            corpus_tune.close()
+            corpus_eval.close()
+            # delete empty corpora, if any
+            if num_tune == 0:
+                corpus_tune.delete()
             else:
-                if num_tune > 0 and random.randint(0, i) < (num_tune + num_eval):
-                    segment_source, segment_target = corpus_tune.insert(segment_source, segment_target)
-                elif num_eval > 0 and random.randint(0, i) < (num_tune + num_eval):
-                    segment_source, segment_target = corpus_eval.insert(segment_source, segment_target)
-                corpus_train.insert(segment_source, segment_target)
-        # close file handles
-        corpus_source.close()
-        corpus_target.close()
-        corpus_train.close()
-        # preprocess segments, then write to disk, the close file handle
-        corpus_tune.close()
-        corpus_eval.close()
-        # logging
+                logging.info("Tuning corpus: %s segments", corpus_tune.get_size())
+            if num_eval == 0:
+                corpus_eval.delete()
+            else:
+                logging.info("Evaluation corpus: %s segments", corpus_eval.get_size())
         logging.info("Training corpus: %s segments", corpus_train.get_size())
         logging.debug("Discarded %i segments because they were not well-formed" % self._num_malformed_segments)
-        # delete empty corpora, if any
-        if num_tune == 0:
-            corpus_tune.delete()
-        else:
-            logging.info("Tuning corpus: %s segments", corpus_tune.get_size())
-        if num_eval == 0:
-            corpus_eval.delete()
-        else:
-            logging.info("Evaluation corpus: %s segments", corpus_eval.get_size())
 
     def _preprocess_external_corpus(self, basepath_external_corpus, basename,
                                     min_tokens, max_tokens, preprocess_external,
-                                    process_xml=None):
+                                    process_xml=None, num_workers=1):
         '''
         Preprocesses an external corpus into /corpus.
 
@@ -598,42 +770,36 @@ class TrainingBase(object):
         @param preprocess_external whether the segments should be preprocessed
         @param process_xml whether or not the XML processing strategy should be
             applied to the segments in external corpora
+        @param num_workers number of processes that check lengths of and
+            preprocess segments
         '''
         corpus = ParallelCorpus(
             self._get_path_corpus(basename, self._src_lang),
             self._get_path_corpus(basename, self._trg_lang),
             max_size=None,
-            preprocess=preprocess_external,
-            tokenize=True if preprocess_external else False,
-            tokenizer_src=self._tokenizer_source,
-            tokenizer_trg=self._tokenizer_target,
+            preprocess=False
+        )
+        preprocessor = self._get_corpus_preprocessor(
+            min_tokens,
+            max_tokens,
             mask=bool(self._masking_strategy),
-            masker=self._masker if self._masking_strategy else None,
             process_xml=process_xml,
-            xml_processor=self._xml_processor if self._xml_strategy else None
+            preprocess=preprocess_external
+        )
+        bisegments = process_parallel_corpus(
+            preprocessor,
+            basepath_external_corpus + "." + self._src_lang,
+            basepath_external_corpus + "." + self._trg_lang,
+            num_workers=num_workers,
+            temp_dir=self._get_path('corpus')
         )
-        # pre-process segments
-        corpus_source = open(basepath_external_corpus + "." + self._src_lang, 'r')
-        corpus_target = open(basepath_external_corpus + "." + self._trg_lang, 'r')
-        for segment_source, segment_target in zip(corpus_source, corpus_target):
-            # tokenize, clean and mask segments (most importantly, remove trailing \n)
-            segment_source = self._check_segment_length(segment_source,
-                                                        min_tokens,
-                                                        max_tokens,
-                                                        tokenizer=self._tokenizer_source,
-                                                        accurate=True)
-            segment_target = self._check_segment_length(segment_target,
-                                                        min_tokens,
-                                                        max_tokens,
-                                                        tokenizer=self._tokenizer_target,
-                                                        accurate=True)
-            if None in [segment_source, segment_target]:
+        for num_malformed, bisegment in bisegments:
+            self._num_malformed_segments += num_malformed
+            if bisegment is None:
                 continue  # discard segments with too few or too many tokens
-            else:
-                corpus.insert(segment_source, segment_target)
+            _, _, preprocessed_source, preprocessed_target = bisegment
+            corpus.insert(preprocessed_source, preprocessed_target)
         corpus.close()
-        corpus_source.close()
-        corpus_target.close()
         # logging
         if basename == C.BASENAME_TUNING_CORPUS:
             logging.info("Tuning corpus: %s segments", corpus.get_size())
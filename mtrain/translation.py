@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
 import os
+import asyncio
+import functools
+import itertools
 import tempfile
 import logging
+import warnings
 import abc
 
 from abc import ABCMeta
+from collections import deque
 
 from mtrain import inspector
 from mtrain import constants as C
 from mtrain import utils
+from mtrain.cache import TranslationCache, engine_identity
+from mtrain.pipeline import run_pipeline
 from mtrain.engine import EngineMoses, EngineNematus
 from mtrain.preprocessing import lowercaser
 from mtrain.preprocessing.truecaser import Truecaser, Detruecaser
@@ -27,15 +34,22 @@ class TranslationEngineBase(object):
     """
     __metaclass__ = ABCMeta
 
+    # whether external components are used from asyncio coroutines
+    _asynchronous = False
+
     def __init__(self,
                  basepath,
-                 training_config):
+                 training_config,
+                 num_processes=1):
         '''
         @param basepath the path to the engine, i.e., `mtrain`'s output
             directory (-o).
+        @param num_processes number of identical processes started for each
+            external component, so that concurrent requests are not serialized
         '''
         assert inspector.is_mtrain_engine(basepath)
         self._basepath = basepath.rstrip(os.sep)
+        self._num_processes = num_processes
 
         # determine config of trained model, if not given
         if training_config is None:
@@ -104,14 +118,15 @@ class TranslationEngineBase(object):
                 detailed_strategy,
                 C.PROTECTED_PATTERNS_FILE_NAME
             ])
-            self._tokenizer = Tokenizer(self._src_lang, protect=True, protected_patterns_path=patterns_path, escape=False)
+            self._tokenizer = Tokenizer(self._src_lang, protect=True, protected_patterns_path=patterns_path, escape=False, num_processes=self._num_processes, asynchronous=self._asynchronous)
         else:
-            self._tokenizer = Tokenizer(self._src_lang)
+            self._tokenizer = Tokenizer(self._src_lang, num_processes=self._num_processes, asynchronous=self._asynchronous)
 
         self._components.append(self._tokenizer)
 
     def _load_detokenizer(self):
-        self._detokenizer = Detokenizer(self._trg_lang, uppercase_first_letter=False)
+        self._detokenizer = Detokenizer(self._trg_lang, uppercase_first_letter=False, num_processes=self._num_processes,
+                                        asynchronous=self._asynchronous)
         self._components.append(self._detokenizer)
 
     def _load_detruecaser(self):
@@ -124,7 +139,7 @@ class TranslationEngineBase(object):
             C.RECASING,
             'moses.ini'
         ])
-        self._recaser = Recaser(path_moses_ini)
+        self._recaser = Recaser(path_moses_ini, num_processes=self._num_processes, asynchronous=self._asynchronous)
         self._components.append(self._recaser)
 
     def _load_masker(self):
@@ -142,7 +157,7 @@ class TranslationEngineBase(object):
             C.TRUECASING,
             'model.%s' % self._src_lang
         ])
-        self._truecaser = Truecaser(path_model)
+        self._truecaser = Truecaser(path_model, num_processes=self._num_processes, asynchronous=self._asynchronous)
 
         self._components.append(self._truecaser)
 
@@ -150,7 +165,7 @@ class TranslationEngineBase(object):
         """
         Create detruecaser.
         """
-        self._detruecaser = Detruecaser()
+        self._detruecaser = Detruecaser(num_processes=self._num_processes)
         self._components.append(self._detruecaser)
 
     def close(self):
@@ -193,6 +208,31 @@ class TranslationEngineMoses(TranslationEngineBase):
     Moses translation engine trained using `mtrain`.
     """
 
+    def __init__(self, basepath, training_config, num_processes=1, cache_size=0, cache_path=None):
+        """
+        @param cache_size maximum number of translations cached in memory, 0
+            to disable caching (unless @param cache_path is given)
+        @param cache_path path to an SQLite database where translations are
+            cached persistently
+        """
+        super(TranslationEngineMoses, self).__init__(basepath, training_config, num_processes=num_processes)
+
+        if cache_size or cache_path:
+            self._cache = TranslationCache(engine_identity(self._basepath),
+                                           max_size=cache_size,
+                                           path=cache_path)
+        else:
+            self._cache = None
+
+    def close(self):
+        """
+        Closes the translation cache, then deletes references to obsolete
+        objects.
+        """
+        if self._cache is not None:
+            self._cache.close()
+        super(TranslationEngineMoses, self).close()
+
     def _load_engine(self):
         """
         Starts a Moses process and keep it running.
@@ -209,6 +249,8 @@ class TranslationEngineMoses(TranslationEngineBase):
             path_moses_ini=path_moses_ini,
             report_alignment=report,
             report_segmentation=report,
+            num_processes=self._num_processes,
+            asynchronous=self._asynchronous
         )
 
         self._components.append(self._engine)
@@ -221,6 +263,28 @@ class TranslationEngineMoses(TranslationEngineBase):
         else:
             tokens = lowercaser.lowercase_tokens(tokens)
         source_segment = " ".join(tokens)
+        return self._preprocess_tokenized_segment(source_segment)
+
+    def _preprocess_segments(self, segments):
+        """
+        Preprocesses a list of @param segments, tokenizing and truecasing them
+        in batches.
+
+        @return a list of tuples, one for each segment, as returned by
+            `_preprocess_segment`
+        """
+        tokenized_segments = self._tokenizer.tokenize_batch(segments, split=False)
+        if self._casing_strategy == C.TRUECASING:
+            source_segments = self._truecaser.truecase_batch(tokenized_segments)
+        else:
+            source_segments = [lowercaser.lowercase_string(segment) for segment in tokenized_segments]
+        return [self._preprocess_tokenized_segment(segment) for segment in source_segments]
+
+    def _preprocess_tokenized_segment(self, source_segment):
+        """
+        Applies masking and markup handling to a tokenized and cased
+        @param source_segment.
+        """
         segment = source_segment
         # related to masking and markup
         if self._masking_strategy is not None:
@@ -269,6 +333,47 @@ class TranslationEngineMoses(TranslationEngineBase):
         # implicit else
         return target_segment.translation
 
+    def _postprocess_segments(self,
+                              source_segments,
+                              target_segments,
+                              masked_source_segments,
+                              lowercase=False,
+                              detokenize=True,
+                              mask_mappings=None,
+                              xml_mappings=None):
+        """
+        Postprocesses a list of translated segments. Recasing and detokenization
+        are done in batches, all other steps are identical to
+        `_postprocess_segment`.
+
+        @param source_segments preprocessed source segments
+        @param target_segments TranslatedSegment objects returned by the engine
+        @param masked_source_segments source segments as sent to the engine
+        """
+        num_segments = len(target_segments)
+        mask_mappings = mask_mappings or [None] * num_segments
+        xml_mappings = xml_mappings or [None] * num_segments
+
+        if self._masking_strategy is not None:
+            for target_segment, masked_source_segment, mask_mapping in zip(target_segments, masked_source_segments, mask_mappings):
+                target_segment.translation = self._masker.unmask_segment(masked_source_segment, target_segment.translation, mask_mapping)
+        if lowercase:
+            for target_segment in target_segments:
+                target_segment.translation = lowercaser.lowercase_string(target_segment.translation)
+        elif self._casing_strategy == C.RECASING:
+            recased_segments = self._recaser.recase_batch([target_segment.translation for target_segment in target_segments])
+            for target_segment, recased_segment in zip(target_segments, recased_segments):
+                target_segment.translation = recased_segment
+        if self._xml_strategy is not None:
+            for source_segment, target_segment, xml_mapping, masked_source_segment in zip(source_segments, target_segments, xml_mappings, masked_source_segments):
+                target_segment.translation = self._xml_processor.postprocess_markup(source_segment, target_segment, xml_mapping, masked_source_segment)
+
+        translations = [target_segment.translation for target_segment in target_segments]
+        if detokenize:
+            return self._detokenizer.detokenize_batch([translation.split(" ") for translation in translations])
+        # implicit else
+        return translations
+
     def translate_segment(self, segment, preprocess=True, lowercase=False, detokenize=True):
         """
         Translates a single @param segment.
@@ -278,6 +383,19 @@ class TranslationEngineMoses(TranslationEngineBase):
             casing (False) of the output segment.
         @param detokenize whether to detokenize the translated segment
         """
+        if self._cache is not None:
+            options = dict(preprocess=preprocess, lowercase=lowercase, detokenize=detokenize)
+            translation = self._cache.get(segment, **options)
+            if translation is None:
+                translation = self._translate_segment(segment, preprocess, lowercase, detokenize)
+                self._cache.put(segment, translation, **options)
+            return translation
+        return self._translate_segment(segment, preprocess, lowercase, detokenize)
+
+    def _translate_segment(self, segment, preprocess, lowercase, detokenize):
+        """
+        Translates a single @param segment, bypassing the cache.
+        """
         if preprocess:
             source_segment, segment, mask_mapping, xml_mapping = self._preprocess_segment(segment)
         else:
@@ -297,16 +415,379 @@ class TranslationEngineMoses(TranslationEngineBase):
             xml_mapping=xml_mapping
         )
 
-    def translate_file(self, input_handle, output_handle):
+    def translate_segments(self, segments, preprocess=True, lowercase=False, detokenize=True):
+        """
+        Translates a list of @param segments, processing them in batches in
+        every component.
+
+        @param preprocess whether to apply preprocessing steps to segments
+        @param lowercase whether to lowercase (True) or restore the original
+            casing (False) of the output segments.
+        @param detokenize whether to detokenize the translated segments
+        """
+        if self._cache is None:
+            return self._translate_segments(segments, preprocess, lowercase, detokenize)
+
+        options = dict(preprocess=preprocess, lowercase=lowercase, detokenize=detokenize)
+        translations = [self._cache.get(segment, **options) for segment in segments]
+        missing = [i for i, translation in enumerate(translations) if translation is None]
+        if missing:
+            new_translations = self._translate_segments([segments[i] for i in missing], preprocess, lowercase, detokenize)
+            for i, translation in zip(missing, new_translations):
+                translations[i] = translation
+            self._cache.put_many([(segments[i], translations[i]) for i in missing], **options)
+        return translations
+
+    def _translate_segments(self, segments, preprocess, lowercase, detokenize):
+        """
+        Translates a list of @param segments, bypassing the cache.
+        """
+        source_segments, masked_source_segments, mask_mappings, xml_mappings = self._preprocess_batch(segments, preprocess)
+        translated_segments = self._engine.translate_segments(masked_source_segments)
+
+        return self._postprocess_segments(
+            source_segments=source_segments,
+            target_segments=translated_segments,
+            masked_source_segments=masked_source_segments,
+            lowercase=lowercase,
+            detokenize=detokenize,
+            mask_mappings=mask_mappings,
+            xml_mappings=xml_mappings
+        )
+
+    def _preprocess_batch(self, segments, preprocess=True):
+        """
+        Preprocesses a list of @param segments, if @param preprocess is True.
+
+        @return source segments, masked source segments, mask mappings and
+            XML mappings, as separate lists
+        """
+        if not preprocess:
+            return list(segments), list(segments), None, None
+        preprocessed = self._preprocess_segments(segments)
+        if not preprocessed:
+            return [], [], None, None
+        return [list(column) for column in zip(*preprocessed)]
+
+    def translate_file(self, input_handle, output_handle, num_threads=None):
         """
         Translates a whole file given input and output handles.
 
-        TODO: use translate_file on the Engine level.
+        @param num_threads if given, the whole file is preprocessed, then
+            translated by a single Moses run with @param num_threads threads
+            and postprocessed; the Moses process kept in memory is stopped
+            meanwhile. Otherwise, segments are translated by the
+            engine process kept in memory, in a pipeline where all components
+            work at the same time on different segments. In both cases,
+            translations are looked up in and added to the cache.
+        """
+        if num_threads is None:
+            segments = (_PipelinedSegment(line.strip()) for line in input_handle)
+            # new translations are cached in batches, outside of the pipeline
+            uncached = []
+            for segment in run_pipeline(segments, self._pipeline_stages()):
+                output_handle.write(segment.translation + "\n")
+                if self._cache is not None and not segment.cached:
+                    uncached.append((segment.segment, segment.translation))
+                    if len(uncached) >= C.CACHE_COMMIT_SIZE:
+                        self._cache.put_many(uncached, **_PipelinedSegment.OPTIONS)
+                        uncached = []
+            if uncached:
+                self._cache.put_many(uncached, **_PipelinedSegment.OPTIONS)
+            return
+
+        segments = [line.strip() for line in input_handle]
+        options = _PipelinedSegment.OPTIONS
+        if self._cache is not None:
+            translations = [self._cache.get(segment, **options) for segment in segments]
+        else:
+            translations = [None] * len(segments)
+        missing = [i for i, translation in enumerate(translations) if translation is None]
+
+        if missing:
+            new_translations = self._translate_file_with_threads([segments[i] for i in missing], num_threads)
+            for i, translation in zip(missing, new_translations):
+                translations[i] = translation
+            if self._cache is not None:
+                self._cache.put_many([(segments[i], translations[i]) for i in missing], **options)
+
+        for translation in translations:
+            output_handle.write(translation + "\n")
+
+    def _translate_file_with_threads(self, segments, num_threads):
+        """
+        Translates a list of @param segments by preprocessing all of them,
+        running a single Moses process with @param num_threads threads and
+        postprocessing the output, bypassing the cache.
+        """
+        source_segments, masked_source_segments, mask_mappings, xml_mappings = self._preprocess_batch(segments)
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            preprocessed_path = os.sep.join([tempdir, "preprocessed"])
+            translated_path = os.sep.join([tempdir, "translated"])
+            logging.debug("tempdir=%s, preprocessed_path=%s, translated_path=%s", tempdir, preprocessed_path, translated_path)
+
+            with open(preprocessed_path, "w", encoding="utf-8") as preprocessed_handle:
+                for segment in masked_source_segments:
+                    preprocessed_handle.write(segment + "\n")
+
+            self._engine.translate_file(input_path=preprocessed_path,
+                                        output_path=translated_path,
+                                        num_threads=num_threads)
+            translated_segments = list(self._engine.read_translations(translated_path))
+
+        return self._postprocess_segments(
+            source_segments=source_segments,
+            target_segments=translated_segments,
+            masked_source_segments=masked_source_segments,
+            mask_mappings=mask_mappings,
+            xml_mappings=xml_mappings
+        )
+
+    def _pipeline_stages(self):
+        """
+        Returns the stages of `translate_file` without a number of threads,
+        each of them uses a single component. The stages take and return a
+        _PipelinedSegment, segments found in the cache skip all stages.
+        """
+        def _look_up(segment):
+            if self._cache is not None:
+                segment.translation = self._cache.get(segment.segment, **_PipelinedSegment.OPTIONS)
+                segment.cached = segment.translation is not None
+            return segment
+
+        def _tokenize(segment):
+            if segment.translation is None:
+                segment.tokens = self._tokenizer.tokenize(segment.segment)
+            return segment
+
+        def _case(segment):
+            if segment.translation is None:
+                if self._casing_strategy == C.TRUECASING:
+                    segment.tokens = self._truecaser.truecase_tokens(segment.tokens)
+                else:
+                    segment.tokens = lowercaser.lowercase_tokens(segment.tokens)
+            return segment
+
+        def _mask(segment):
+            if segment.translation is None:
+                segment.source_segment, segment.masked_source_segment, segment.mask_mapping, segment.xml_mapping = \
+                    self._preprocess_tokenized_segment(" ".join(segment.tokens))
+            return segment
+
+        def _decode(segment):
+            if segment.translation is None:
+                segment.target_segment = self._engine.translate_segment(segment.masked_source_segment)
+            return segment
+
+        def _postprocess(segment):
+            if segment.translation is None:
+                segment.tokens = self._postprocess_segment(
+                    source_segment=segment.source_segment,
+                    masked_source_segment=segment.masked_source_segment,
+                    target_segment=segment.target_segment,
+                    detokenize=False,
+                    mask_mapping=segment.mask_mapping,
+                    xml_mapping=segment.xml_mapping
+                ).split(" ")
+            return segment
+
+        def _detokenize(segment):
+            if segment.translation is None:
+                segment.translation = self._detokenizer.detokenize(segment.tokens)
+            return segment
+
+        return [_look_up, _tokenize, _case, _mask, _decode, _postprocess, _detokenize]
+
+
+class _PipelinedSegment(object):
+    """
+    A segment on its way through the stages of a pipelined translation.
+    """
+    # options of `translate_segment` that pipelined translations correspond to
+    OPTIONS = dict(preprocess=True, lowercase=False, detokenize=True)
+
+    __slots__ = ['segment', 'tokens', 'source_segment', 'masked_source_segment',
+                 'mask_mapping', 'xml_mapping', 'target_segment', 'translation', 'cached']
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.tokens = None
+        self.source_segment = None
+        self.masked_source_segment = None
+        self.mask_mapping = None
+        self.xml_mapping = None
+        self.target_segment = None
+        self.translation = None
+        self.cached = False
+
+
+class AsyncTranslationEngineMoses(TranslationEngineMoses):
+    """
+    Moses translation engine trained using `mtrain`, used from asyncio
+    coroutines. External components run as asyncio subprocesses: while a
+    segment waits for one component, other segments are processed by the
+    other components, so that all of them are busy with concurrent requests.
+    """
+
+    _asynchronous = True
+
+    def __init__(self, basepath, training_config, cache_size=0, cache_path=None,
+                 max_in_flight=C.EXTERNAL_PROCESSOR_MAX_IN_FLIGHT):
+        """
+        @param cache_size maximum number of translations cached in memory, 0
+            to disable caching (unless @param cache_path is given)
+        @param cache_path path to an SQLite database where translations are
+            cached persistently
+        @param max_in_flight the maximum number of segments translated
+            concurrently by `translate_stream`
         """
-        for line in input_handle:
-            segment = line.strip()
-            translated_segment = self.translate_segment(segment)
-            output_handle.write(translated_segment + "\n")
+        self._max_in_flight = max(1, max_in_flight)
+        super(AsyncTranslationEngineMoses, self).__init__(basepath, training_config, cache_size=cache_size, cache_path=cache_path)
+
+    def close(self):
+        """
+        Closes the external processes and the translation cache.
+        """
+        for component in self._components:
+            if hasattr(component, 'close'):
+                component.close()
+        super(AsyncTranslationEngineMoses, self).close()
+
+    async def _preprocess_segment_async(self, segment):
+        """
+        Preprocesses a single @param segment, see `_preprocess_segment`.
+        """
+        tokens = await self._tokenizer.tokenize_async(segment)
+        if self._casing_strategy == C.TRUECASING:
+            tokens = await self._truecaser.truecase_tokens_async(tokens)
+        else:
+            tokens = lowercaser.lowercase_tokens(tokens)
+        return self._preprocess_tokenized_segment(" ".join(tokens))
+
+    async def _postprocess_segment_async(self,
+                                         source_segment,
+                                         target_segment,
+                                         masked_source_segment=None,
+                                         lowercase=False,
+                                         detokenize=True,
+                                         mask_mapping=None,
+                                         xml_mapping=None):
+        """
+        Postprocesses a single translated segment, see `_postprocess_segment`.
+        """
+        if self._masking_strategy is not None:
+            target_segment.translation = self._masker.unmask_segment(masked_source_segment, target_segment.translation, mask_mapping)
+        if lowercase:
+            target_segment.translation = lowercaser.lowercase_string(target_segment.translation)
+        elif self._casing_strategy == C.RECASING:
+            target_segment.translation = await self._recaser.recase_async(target_segment.translation)
+        if self._xml_strategy is not None:
+            target_segment.translation = self._xml_processor.postprocess_markup(source_segment, target_segment, xml_mapping, masked_source_segment)
+        if detokenize:
+            return await self._detokenizer.detokenize_async(target_segment.translation.split(" "))
+        # implicit else
+        return target_segment.translation
+
+    async def translate_segment(self, segment, preprocess=True, lowercase=False, detokenize=True):
+        """
+        Translates a single @param segment.
+
+        @param preprocess whether to apply preprocessing steps to segment
+        @param lowercase whether to lowercase (True) or restore the original
+            casing (False) of the output segment.
+        @param detokenize whether to detokenize the translated segment
+        """
+        if self._cache is not None:
+            options = dict(preprocess=preprocess, lowercase=lowercase, detokenize=detokenize)
+            translation = await self._run_cache(self._cache.get, segment, **options)
+            if translation is None:
+                translation = await self._translate_segment(segment, preprocess, lowercase, detokenize)
+                await self._run_cache(self._cache.put, segment, translation, **options)
+            return translation
+        return await self._translate_segment(segment, preprocess, lowercase, detokenize)
+
+    async def _run_cache(self, method, *args, **kwargs):
+        """
+        Calls a @param method of the cache. Methods of a persistent cache may
+        need disk access and run in an executor, to not block the event loop.
+        """
+        if self._cache.persistent:
+            return await asyncio.get_running_loop().run_in_executor(None, functools.partial(method, *args, **kwargs))
+        return method(*args, **kwargs)
+
+    async def _translate_segment(self, segment, preprocess, lowercase, detokenize):
+        """
+        Translates a single @param segment, bypassing the cache.
+        """
+        if preprocess:
+            source_segment, segment, mask_mapping, xml_mapping = await self._preprocess_segment_async(segment)
+        else:
+            source_segment = segment
+            mask_mapping = None
+            xml_mapping = None
+        translated_segment = await self._engine.translate_segment_async(segment)
+
+        return await self._postprocess_segment_async(
+            source_segment=source_segment,
+            masked_source_segment=segment,
+            target_segment=translated_segment,
+            lowercase=lowercase,
+            detokenize=detokenize,
+            mask_mapping=mask_mapping,
+            xml_mapping=xml_mapping
+        )
+
+    async def translate_stream(self, segments, preprocess=True, lowercase=False, detokenize=True):
+        """
+        Translates the @param segments of an iterable or an asynchronous
+        iterable and yields their translations in order, e.g. `async for
+        translation in engine.translate_stream(segments)`. Up to
+        `max_in_flight` segments are translated concurrently.
+        """
+        options = dict(preprocess=preprocess, lowercase=lowercase, detokenize=detokenize)
+        in_flight = deque()
+        try:
+            async for segment in _iterate_async(segments):
+                in_flight.append(asyncio.ensure_future(self.translate_segment(segment, **options)))
+                if len(in_flight) >= self._max_in_flight:
+                    yield await in_flight.popleft()
+            while in_flight:
+                yield await in_flight.popleft()
+        finally:
+            for translation in in_flight:
+                translation.cancel()
+
+    async def translate_segments(self, segments, preprocess=True, lowercase=False, detokenize=True):
+        """
+        Translates a list of @param segments concurrently, see
+        `translate_stream`.
+        """
+        return [
+            translation async for translation
+            in self.translate_stream(segments, preprocess, lowercase, detokenize)
+        ]
+
+    async def translate_file(self, input_handle, output_handle):
+        """
+        Translates a whole file given input and output handles, with several
+        segments in flight.
+        """
+        segments = (line.strip() for line in input_handle)
+        async for translation in self.translate_stream(segments):
+            output_handle.write(translation + "\n")
+
+
+async def _iterate_async(segments):
+    """
+    Iterates over an iterable or an asynchronous iterable of @param segments.
+    """
+    if hasattr(segments, '__aiter__'):
+        async for segment in segments:
+            yield segment
+    else:
+        for segment in segments:
+            yield segment
 
 
 class TranslationEngineNematus(TranslationEngineBase):
@@ -314,15 +795,22 @@ class TranslationEngineNematus(TranslationEngineBase):
     Nematus translation engine trained using `mtrain`.
     """
 
-    def __init__(self, basepath, training_config, device, preallocate, beam_size,  keep_temp_files=False):
+    def __init__(self, basepath, training_config, device, preallocate, beam_size, keep_temp_files=False, num_processes=1):
         """
+        @param keep_temp_files deprecated and ignored, translation no longer
+            creates temporary files
         """
+        if keep_temp_files:
+            warnings.warn(
+                "keep_temp_files is deprecated and has no effect: translation no longer creates temporary files",
+                DeprecationWarning,
+                stacklevel=2
+            )
         self._device = device
         self._preallocate = preallocate
         self._beam_size = beam_size
-        self._keep_temp_files = keep_temp_files
 
-        super(TranslationEngineNematus, self).__init__(basepath, training_config)
+        super(TranslationEngineNematus, self).__init__(basepath, training_config, num_processes=num_processes)
 
     def _load_components(self):
         """
@@ -336,7 +824,7 @@ class TranslationEngineNematus(TranslationEngineBase):
         """
         Creates normalizer.
         """
-        self._normalizer = Normalizer(self._src_lang)
+        self._normalizer = Normalizer(self._src_lang, num_processes=self._num_processes)
         self._components.append(self._normalizer)
 
     def _load_bpe_encoder(self):
@@ -351,13 +839,14 @@ class TranslationEngineNematus(TranslationEngineBase):
         model = os.sep.join([bpe_model_path, "%s-%s.bpe" % (self._src_lang, self._trg_lang)])
         vocab_source_path = os.sep.join([bpe_model_path, "vocab.%s" % self._src_lang])
 
-        self._bpe_encoder = BytePairEncoderSegment(model, vocab_source_path)
+        self._bpe_encoder = BytePairEncoderSegment(model, vocab_source_path, num_processes=self._num_processes)
 
         self._components.append(self._bpe_encoder)
 
     def _load_engine(self):
         """
-        Starts a process that holds a Nematus translation engine.
+        Starts a process that holds a Nematus translation engine and keeps
+        the model in memory.
         """
         self._path_nematus_model = os.sep.join([
             self._basepath,
@@ -387,6 +876,16 @@ class TranslationEngineNematus(TranslationEngineBase):
 
         return segment
 
+    def _preprocess_segments(self, segments):
+        """
+        Preprocesses a list of @param segments in batches, see
+        `_preprocess_segment`.
+        """
+        segments = self._normalizer.normalize_batch(segments)
+        segments = self._tokenizer.tokenize_batch(segments, split=False)
+        segments = self._truecaser.truecase_batch(segments)
+        return self._bpe_encoder.encode_segments(segments)
+
     def _postprocess_segment(self, segment):
         """
         Postprocesses a single @param segment.
@@ -400,60 +899,67 @@ class TranslationEngineNematus(TranslationEngineBase):
 
         return segment
 
-    def _postprocess_file(self, input_handle, output_handle):
+    def _postprocess_segments(self, segments):
         """
+        Postprocesses a list of @param segments in batches, see
+        `_postprocess_segment`.
         """
-        for line in input_handle:
-            segment = line.strip()
-            postprocessed_segment = self._postprocess_segment(segment)
-            output_handle.write(postprocessed_segment + "\n")
-
-    def _preprocess_file(self, input_handle, output_handle):
-        """
-        """
-        for line in input_handle:
-            segment = line.strip()
-            preprocessed_segment = self._preprocess_segment(segment)
-            output_handle.write(preprocessed_segment + "\n")
+        segments = [bpe_decode_segment(segment) for segment in segments]
+        segments = self._detruecaser.detruecase_batch(segments)
+        return self._detokenizer.detokenize_batch([segment.split(" ") for segment in segments])
 
     def translate_segment(self, segment):
         """
-        Currently not possible because of a limitation of the Nematus
-        script translate.py.
-        """
-        raise NotImplementedError
-
-    def translate_file(self, input_handle, output_handle):
-        """
-        Translates a whole file given input and output handles.
-        """
-        tempdir = tempfile.mkdtemp()
-        preprocessed_handle = tempfile.NamedTemporaryFile(prefix="preprocessed.", dir=tempdir, mode="w", encoding="utf-8", delete=False)
-        translated_handle = tempfile.NamedTemporaryFile(prefix="translated.", dir=tempdir, mode="w", delete=False)
-
-        preprocessed_path = preprocessed_handle.name
-        translated_path = translated_handle.name
-
-        logging.debug("tempdir=%s, preprocessed_path=%s, translated_path=%s", tempdir, preprocessed_path, translated_path)
-
-        # takes the overall input handle because first step
-        self._preprocess_file(input_handle=input_handle, output_handle=preprocessed_handle)
-
-        preprocessed_handle.close()
-        translated_handle.close()
-
-        self._engine.translate_file(input_path=preprocessed_path,
-                                    output_path=translated_path)
-
-        translated_handle = open(translated_path, "r")
-
-        # takes the overall output handle because last step
-        self._postprocess_file(input_handle=translated_handle, output_handle=output_handle)
-
-        # only close remaining handles if opened by this method
-        translated_handle.close()
-
-        if not self._keep_temp_files:
-            os.remove(preprocessed_path)
-            os.remove(translated_path)
-            os.rmdir(tempdir)
+        Translates a single @param segment with the model kept in memory.
+        """
+        preprocessed_segment = self._preprocess_segment(segment)
+        translated_segment = self._engine.translate_segment(preprocessed_segment)
+        return self._postprocess_segment(translated_segment)
+
+    def translate_segments(self, segments):
+        """
+        Translates a list of @param segments. Segments are processed in
+        batches by all components and translated in batches by the engine.
+        """
+        preprocessed_segments = self._preprocess_segments(segments)
+        translated_segments = self._engine.translate_segments(preprocessed_segments)
+        return self._postprocess_segments(translated_segments)
+
+    def translate_file(self, input_handle, output_handle, chunk_size=None):
+        """
+        Translates a whole file given input and output handles. Preprocessing,
+        the engine and postprocessing are connected by pipes and work at the
+        same time, without temporary files. Translations are written as soon
+        as they are available, only a bounded number of segments is in
+        memory at any time.
+
+        @param chunk_size if given, the input is instead read in chunks of
+            this many lines. Each chunk is translated as a batch, then its
+            translations are written and @param output_handle is flushed,
+            e.g. for interactive use in a pipeline of commands.
+        """
+        if chunk_size:
+            while True:
+                chunk = [line.strip() for line in itertools.islice(input_handle, chunk_size)]
+                if not chunk:
+                    return
+                for translation in self.translate_segments(chunk):
+                    output_handle.write(translation + "\n")
+                output_handle.flush()
+
+        preprocessing_stages = [
+            self._normalizer.normalize_punctuation,
+            lambda segment: self._tokenizer.tokenize(segment, split=False),
+            self._truecaser.truecase_segment,
+            self._bpe_encoder.encode_segment
+        ]
+        postprocessing_stages = [
+            bpe_decode_segment,
+            self._detruecaser.detruecase_segment,
+            lambda segment: self._detokenizer.detokenize(segment.split(" "))
+        ]
+        segments = (line.strip() for line in input_handle)
+        preprocessed_segments = run_pipeline(segments, preprocessing_stages)
+        translated_segments = self._engine.translate_stream(preprocessed_segments)
+        for translation in run_pipeline(translated_segments, postprocessing_stages):
+            output_handle.write(translation + "\n")
@@ -112,6 +112,15 @@ def symlink(orig, link_name):
             os.remove(link_name)
             os.symlink(orig, link_name)
 
+def uppercase_first_letter_like_source(source_segment, translation):
+    '''
+    Uppercases the first letter of @param translation if the first letter of
+    @param source_segment is uppercased.
+    '''
+    if source_segment[:1].isupper():
+        return translation[:1].upper() + translation[1:]
+    return translation
+
 def _escape_if_not_markup(segment):
     '''
     Splits a segment into tokens (markup-aware) and escapes tokens